@@ -0,0 +1,108 @@
+"""
+Emit latency of the synchronous, background and asyncio emitters, and end-to-end flush time,
+against a stand-in T2 server on localhost.
+
+"emit latency" is the time a caller spends in emit(): a full upload for the synchronous
+emitter, an enqueue for the others. "end-to-end" emits a batch of metrics and times it until
+close() returns, by which point every metric has been uploaded. The "profiled" case attaches a
+ProfileAggregator to the synchronous emitter, to show what profiling every flush and send costs.
+The "dimensioned gauges" case emits gauges spread over a few dimensions through the background
+emitter, which batches them by metadata and dimensions.
+
+Run with: python -m benchmarks.bench_emit
+"""
+import asyncio
+import time
+
+from metrics_publisher_with_dimensions.t2.emitters import T2Emitter
+from metrics_publisher_with_dimensions.t2.emitters.async_t2_emitter import AsyncT2Emitter
+from metrics_publisher_with_dimensions.t2.formatters import T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import GaugeMetric, MetricMetadata, TimerMetric
+from metrics_publisher_with_dimensions.t2.profiling import ProfileAggregator
+
+from .harness import LocalT2Server, report, result
+
+NAME = "emit"
+METADATA = MetricMetadata("bench", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+
+
+def make_metrics(count, names=50):
+    return [TimerMetric("bench.op{}.Time".format(i % names), float(i % 7)) for i in range(count)]
+
+
+def make_dimensioned_gauges(count, names=10, dimensions=4):
+    return [GaugeMetric("bench.disk{}.Free".format(i % names), float(i % 7),
+                        dimensions={"device": "sd{}".format(i % dimensions)}) for i in range(count)]
+
+
+def _emit_all(emitter, metrics):
+    start = time.perf_counter()
+    for m in metrics:
+        emitter.emit(m)
+    return time.perf_counter() - start
+
+
+def sync_emit(server, count, profiling_hooks=None):
+    emitter = T2Emitter(METADATA, endpoint=server.endpoint, synchronous=True, formatter=T2OverlayFormatter(),
+                        profiling_hooks=profiling_hooks)
+    seconds = _emit_all(emitter, make_metrics(count))
+    emitter.close()
+    assert len(server.bodies) == count
+    return seconds
+
+
+def background_emit(server, flusher_mode, count, metrics=None):
+    emitter = T2Emitter(METADATA, endpoint=server.endpoint, flusher_mode=flusher_mode,
+                        formatter=T2OverlayFormatter(), queue_size=count, max_wait_time=100, jitter=0)
+    start = time.perf_counter()
+    emit_seconds = _emit_all(emitter, metrics or make_metrics(count))
+    emitter.close()
+    if flusher_mode == "process":
+        emitter.watcher.join()
+    assert server.bodies
+    return emit_seconds, time.perf_counter() - start
+
+
+async def _async_emit(server, count):
+    emitter = AsyncT2Emitter(METADATA, endpoint=server.endpoint, formatter=T2OverlayFormatter(),
+                             queue_size=count, max_wait_time=100, jitter=0)
+    start = time.perf_counter()
+    emit_seconds = _emit_all(emitter, make_metrics(count))
+    await emitter.close()
+    assert server.bodies
+    return emit_seconds, time.perf_counter() - start
+
+
+def async_emit(server, count):
+    return asyncio.run(_async_emit(server, count))
+
+
+def run(quick=False):
+    sync_count = 100 if quick else 1000
+    count = 2000 if quick else 20000
+    results = []
+    with LocalT2Server() as server:
+        seconds = sync_emit(server, sync_count)
+        results.append(result(NAME, "synchronous emit latency", seconds / sync_count * 1e6, "us"))
+        server.reset()
+        seconds = sync_emit(server, sync_count, profiling_hooks=[ProfileAggregator()])
+        results.append(result(NAME, "synchronous emit latency profiled", seconds / sync_count * 1e6, "us"))
+
+        cases = (
+            ("thread", lambda: background_emit(server, "thread", count)),
+            ("process", lambda: background_emit(server, "process", count)),
+            ("asyncio", lambda: async_emit(server, count)),
+            ("thread dimensioned gauges", lambda: background_emit(server, "thread", count,
+                                                                  make_dimensioned_gauges(count))),
+        )
+        for case, fn in cases:
+            server.reset()
+            emit_seconds, total_seconds = fn()
+            results.append(result(NAME, "{} emit latency".format(case), emit_seconds / count * 1e6, "us"))
+            results.append(result(NAME, "{} end-to-end {} metrics".format(case, count), total_seconds * 1e3, "ms"))
+            results.append(result(NAME, "{} end-to-end throughput".format(case), count / total_seconds, "metrics/s"))
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
@@ -0,0 +1,63 @@
+"""
+Emit latency and CPU use of the T2Emitter flusher modes.
+
+Sends are replaced by a no-op so only the buffering and flushing pipeline is measured.
+CPU time includes the watcher process in "process" mode.
+
+Run with: python -m benchmarks.bench_flusher
+"""
+import resource
+import time
+
+from metrics_publisher_with_dimensions.t2.emitters import T2Emitter
+from metrics_publisher_with_dimensions.t2.formatters import T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata, TimerMetric
+
+from .harness import report, result
+
+NAME = "flusher"
+METADATA = MetricMetadata("bench", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+
+
+class NullSendEmitter(T2Emitter):
+    def send(self, payload):
+        pass
+
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def measure(flusher_mode, count, idle_seconds, columnar_buffer=False):
+    cpu_before = _cpu_seconds()
+    emitter = NullSendEmitter(METADATA, endpoint="http://localhost/", formatter=T2OverlayFormatter(),
+                              flusher_mode=flusher_mode, columnar_buffer=columnar_buffer,
+                              max_pending_metrics=100, queue_size=count, max_wait_time=1000, jitter=0)
+    metrics = [TimerMetric("bench.timer.{}".format(i % 50), float(i % 7)) for i in range(count)]
+    start = time.time()
+    for m in metrics:
+        emitter.emit(m)
+    emit_seconds = time.time() - start
+    time.sleep(idle_seconds)
+    emitter.close()
+    if flusher_mode == "process":
+        emitter.watcher.join()
+    return emit_seconds / count, _cpu_seconds() - cpu_before
+
+
+def run(quick=False):
+    count = 2000 if quick else 20000
+    idle_seconds = 0.5 if quick else 2
+    results = []
+    for mode, columnar in (("process", False), ("process", True), ("thread", False), ("thread", True)):
+        case = mode + (" columnar" if columnar else "")
+        latency, cpu = measure(mode, count, idle_seconds, columnar_buffer=columnar)
+        results.append(result(NAME, case + " emit latency", latency * 1e9, "ns"))
+        results.append(result(NAME, case + " cpu for {} emits".format(count), cpu, "s"))
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
@@ -0,0 +1,59 @@
+"""
+Formatter throughput by metric name and tag cardinality.
+
+Each flush holds the same number of metrics, spread over a number of distinct names and a number of
+distinct override_tags sets (each tag set becomes a payload of its own). T2Formatter and
+T2OverlayFormatter encode the whole flush into request bodies; T2MetricLogFormatter formats each
+metric as a log line.
+
+Run with: python -m benchmarks.bench_formatters
+"""
+import random
+
+from metrics_publisher_with_dimensions.t2.formatters import T2Formatter, T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.formatters.t2_metric_log_formatter import T2MetricLogFormatter
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata, TimerMetric, DeltaCounterMetric
+
+from .harness import report, result, seconds_per_call
+
+NAME = "formatters"
+METADATA = MetricMetadata("bench", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+TIMESTAMP = 1700000000000
+
+
+def make_metrics(count, names, tag_sets, seconds=10):
+    rng = random.Random(count * names * tag_sets)
+    tags = [None] if tag_sets == 1 else [{"hostname": "host{}".format(i)} for i in range(tag_sets)]
+    metrics = []
+    for i in range(count):
+        timestamp = TIMESTAMP + (i % seconds) * 1000
+        override_tags = tags[rng.randrange(tag_sets)]
+        if i % 2:
+            metrics.append(TimerMetric("bench.op{}.Time".format(rng.randrange(names)), rng.random() * 100,
+                                       timestamp=timestamp, override_tags=override_tags))
+        else:
+            metrics.append(DeltaCounterMetric("bench.op{}.Count".format(rng.randrange(names)), rng.randint(0, 3),
+                                              timestamp=timestamp, override_tags=override_tags))
+    return metrics
+
+
+def run(quick=False):
+    count = 1000 if quick else 10000
+    number = 3 if quick else 10
+    log_formatter = T2MetricLogFormatter()
+    results = []
+    for names in (10, 1000):
+        for tag_sets in (1, 20):
+            metrics = make_metrics(count, names, tag_sets)
+            case = "{} names x {} tag sets".format(names, tag_sets)
+            for formatter in (T2Formatter(), T2OverlayFormatter()):
+                seconds = seconds_per_call(lambda: formatter.encode(metrics, METADATA), number=number)
+                results.append(result(NAME, "{} encode {}".format(formatter.__class__.__name__, case),
+                                      count / seconds, "metrics/s"))
+            seconds = seconds_per_call(lambda: [log_formatter.format(m) for m in metrics], number=number)
+            results.append(result(NAME, "T2MetricLogFormatter format {}".format(case), count / seconds, "metrics/s"))
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
@@ -0,0 +1,89 @@
+"""
+Overhead of the instruments used as context managers, and of Client.submit.
+
+The instruments run against a client that drops what is submitted, so only the instruments
+are timed. Client.submit is timed with a single emitter that drops what it is given; it is
+skipped when the Client's own dependencies aren't installed.
+
+Run with: python -m benchmarks.bench_instruments
+"""
+from metrics_publisher_with_dimensions.t2.instrumentation.cumulative_counter import CumulativeCounter
+from metrics_publisher_with_dimensions.t2.instrumentation.delta_counter import DeltaCounter
+from metrics_publisher_with_dimensions.t2.instrumentation.gauge import Gauge
+from metrics_publisher_with_dimensions.t2.instrumentation.scope import Scope
+from metrics_publisher_with_dimensions.t2.instrumentation.timer import _Timer
+from metrics_publisher_with_dimensions.t2.models import TimerMetric
+
+from .harness import NullClient, report, result, seconds_per_call
+
+try:
+    from metrics_publisher_with_dimensions.t2.client import Client
+except ImportError:
+    Client = None
+
+NAME = "instruments"
+
+
+class NullEmitter(object):
+    def emit(self, metric_or_metrics, dimensions=None):
+        pass
+
+    def close(self):
+        pass
+
+
+def timer(client):
+    with _Timer(client, "Operation"):
+        pass
+
+
+def scope(client):
+    with Scope(client, "Operation") as s:
+        s.record_success()
+
+
+def delta_counter(client):
+    with DeltaCounter(client, "Rows") as d:
+        d.increment()
+        d.increment()
+        d.increment()
+
+
+def cumulative_counter(client):
+    with CumulativeCounter(client, "Total") as c:
+        c.value = 42
+
+
+def gauge(client):
+    with Gauge(client, "Depth") as g:
+        g.value = 42
+
+
+def nested(client):
+    with Scope(client, "Api"):
+        with _Timer(client, "Load"):
+            pass
+        with DeltaCounter(client, "Rows") as d:
+            d.increment()
+
+
+def run(quick=False):
+    number = 2000 if quick else 20000
+    client = NullClient()
+    results = []
+    for case, fn in (("timer", timer), ("scope", scope), ("delta counter x3", delta_counter),
+                     ("cumulative counter", cumulative_counter), ("gauge", gauge),
+                     ("scope with timer and counter", nested)):
+        results.append(result(NAME, case, seconds_per_call(lambda: fn(client), number=number) * 1e9, "ns"))
+
+    if Client is not None:
+        client = Client({"metricsConfig": {"project": "bench", "region": "r", "availabilityDomain": "ad-1"}})
+        client.add_emitter(NullEmitter())
+        metric = TimerMetric("bench.Time", 1.5)
+        per_call = seconds_per_call(lambda: client.submit(metric), number=number)
+        results.append(result(NAME, "client submit", per_call * 1e9, "ns"))
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
@@ -0,0 +1,80 @@
+"""
+Bytes per metric and construction cost of the metric models, and the cost of hashing and
+deriving MetricMetadata.
+
+The "legacy" cases reproduce the previous representation (a __dict__ object carrying a
+datetime.utcnow() that formatters converted to epoch milliseconds) for comparison.
+
+Run with: python -m benchmarks.bench_models
+"""
+import datetime
+
+from metrics_publisher_with_dimensions.t2.models import GaugeMetric, MetricMetadata, TimerMetric
+
+from .harness import bytes_per_object, report, result, seconds_per_call
+
+NAME = "models"
+EPOCH = datetime.datetime.utcfromtimestamp(0)
+
+
+class LegacyMetric(object):
+    def __init__(self, name, value, timestamp=None, override_tags=None):
+        self.name = name
+        self.value = value
+        self.timestamp = timestamp or datetime.datetime.utcnow()
+        self.override_tags = override_tags
+        self.metric_type = "gauge"
+
+
+class LegacyGaugeMetric(LegacyMetric):
+    def __init__(self, name, value, timestamp=None, override_tags=None):
+        super(LegacyGaugeMetric, self).__init__(name, value, timestamp, override_tags=override_tags)
+
+
+class LegacyUnitsOfWorkMetric(LegacyMetric):
+    def __init__(self, name, value, timestamp=None, units_of_work=1, override_tags=None):
+        super(LegacyUnitsOfWorkMetric, self).__init__(name, value, timestamp=timestamp, override_tags=override_tags)
+        self.units_of_work = units_of_work
+
+
+class LegacyTimerMetric(LegacyUnitsOfWorkMetric):
+    def __init__(self, name, value, timestamp=None, units_of_work=1, override_tags=None):
+        super(LegacyTimerMetric, self).__init__(name, value, timestamp=timestamp, units_of_work=units_of_work,
+                                                override_tags=override_tags)
+
+
+def run(quick=False):
+    number = 2000 if quick else 20000
+    results = []
+    for case, cls in (("legacy gauge", LegacyGaugeMetric), ("gauge", GaugeMetric),
+                      ("legacy timer", LegacyTimerMetric), ("timer", TimerMetric)):
+        results.append(result(NAME, case + " bytes/metric",
+                              bytes_per_object(lambda: cls("a.metric", 1.5), count=number), "bytes"))
+        results.append(result(NAME, case + " construction",
+                              seconds_per_call(lambda: cls("a.metric", 1.5), number=number) * 1e9, "ns"))
+
+    legacy, compact = LegacyMetric("a.metric", 1.5), GaugeMetric("a.metric", 1.5)
+    results.append(result(NAME, "legacy timestamp to epoch ms",
+                          seconds_per_call(lambda: (legacy.timestamp - EPOCH).total_seconds() * 1000,
+                                           number=number) * 1e9, "ns"))
+    results.append(result(NAME, "timestamp to epoch ms",
+                          seconds_per_call(lambda: compact.timestamp, number=number) * 1e9, "ns"))
+
+    metadata = MetricMetadata("bench", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+    by_metadata = {metadata: 1}
+    override_tags = {"hostname": "other"}
+    cases = (
+        ("metadata construct+hash", lambda: hash(MetricMetadata("bench", fleet="fleet", hostname="host",
+                                                                availabilityDomain="ad-1", region="r"))),
+        ("metadata hash", lambda: hash(metadata)),
+        ("metadata dict lookup", lambda: by_metadata[metadata]),
+        ("metadata copy_with (interned)", lambda: metadata.copy_with(override_tags)),
+        ("metadata md5_hash", lambda: metadata.md5_hash),
+    )
+    for case, fn in cases:
+        results.append(result(NAME, case, seconds_per_call(fn, number=number) * 1e9, "ns"))
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
@@ -0,0 +1,103 @@
+"""
+How building an OverlayPayload scales with the size of a flush.
+
+The "linear" cases reproduce the previous OverlayPayload, OverlayMetric and Series, which
+looked up names, timestamps and values by scanning lists, for comparison. Both are fed the
+same metrics: the number of names, seconds and distinct values grows with the flush size.
+
+Run with: python -m benchmarks.bench_overlay_payload
+"""
+import random
+
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata, OverlayPayload, TimerMetric
+from metrics_publisher_with_dimensions.t2.models.payload import Value
+
+from .harness import report, result, seconds_per_call
+
+NAME = "overlay_payload"
+METADATA = MetricMetadata("bench", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+TIMESTAMP = 1700000000000
+
+
+class LinearOverlayPayload(object):
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.metrics = []
+
+    def add_metric(self, new_metric):
+        for m in self.metrics:
+            if new_metric.name == m.name:
+                m.add_metric_values(new_metric)
+                return
+
+        m = LinearOverlayMetric(new_metric.name)
+        m.add_metric_values(new_metric)
+        self.metrics.append(m)
+
+
+class LinearOverlayMetric(object):
+    def __init__(self, name):
+        self.name = name
+        self.series = []
+
+    def add_metric_values(self, m):
+        for s in self.series:
+            if s.t2_timestamp == m.timestamp:
+                s.add_value(m.value)
+                return
+
+        new_series = LinearSeries(m.timestamp)
+        new_series.add_value(m.value)
+        self.series.append(new_series)
+
+
+class LinearSeries(object):
+    def __init__(self, timestamp):
+        self.t2_timestamp = timestamp
+        self.values = []
+
+    def add_value(self, raw_value, count=1):
+        for value in self.values:
+            if value.value == raw_value:
+                value.count += count
+                return
+
+        self.values.append(Value(count, raw_value))
+
+
+def make_metrics(count):
+    # Roughly sqrt(count) names, a dozen seconds, and values at 0.1ms resolution
+    rng = random.Random(count)
+    names = max(1, int(count ** 0.5))
+    return [TimerMetric("bench.op{}.Time".format(rng.randrange(names)), round(rng.expovariate(0.05), 1),
+                        timestamp=TIMESTAMP + rng.randrange(12) * 1000)
+            for _ in range(count)]
+
+
+def build(cls, metrics):
+    payload = cls(METADATA)
+    for m in metrics:
+        payload.add_metric(m)
+    return payload
+
+
+def _shape(payload):
+    return [(m.name, [(s.t2_timestamp, [(v.count, v.value) for v in s.values])
+                      for s in m.series])
+            for m in payload.metrics]
+
+
+def run(quick=False):
+    sizes = (1000, 5000) if quick else (1000, 5000, 10000, 20000)
+    results = []
+    for count in sizes:
+        metrics = make_metrics(count)
+        assert _shape(build(OverlayPayload, metrics)) == _shape(build(LinearOverlayPayload, metrics))
+        for case, cls in (("linear", LinearOverlayPayload), ("indexed", OverlayPayload)):
+            results.append(result(NAME, "{} build {} metrics".format(case, count),
+                                  seconds_per_call(lambda: build(cls, metrics), number=1, repeat=3) * 1e3, "ms"))
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
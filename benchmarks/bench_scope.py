@@ -0,0 +1,60 @@
+"""
+Cost of entering a scope, reading the scoped metric name and leaving it, by nesting depth.
+
+The "legacy" cases reproduce the previous Client scope stack (a list per thread ident,
+joined into the metric name on every read) for comparison.
+
+Run with: python -m benchmarks.bench_scope
+"""
+import threading
+from collections import defaultdict
+
+from metrics_publisher_with_dimensions.t2.instrumentation.scope_stack import ScopeStack
+
+from .harness import report, result, seconds_per_call
+
+NAME = "scope"
+
+
+class LegacyScopeStack(object):
+    def __init__(self):
+        self._scope = defaultdict(list)
+
+    def enter(self, name):
+        self._scope[threading.current_thread().ident].append(name)
+
+    def leave(self):
+        thread_id = threading.current_thread().ident
+        self._scope[thread_id].pop()
+        if len(self._scope[thread_id]) == 0:
+            del self._scope[thread_id]
+
+    @property
+    def prefix(self):
+        return ".".join(self._scope[threading.current_thread().ident])
+
+
+def _enter_read_leave(stack):
+    stack.enter("Operation")
+    stack.prefix
+    stack.leave()
+
+
+def run(quick=False):
+    number = 2000 if quick else 20000
+    results = []
+    for depth in (1, 4, 16):
+        for case, cls in (("legacy", LegacyScopeStack), ("context", ScopeStack)):
+            stack = cls()
+            for level in range(depth - 1):
+                stack.enter("Level{}".format(level))
+            assert stack.prefix == ".".join("Level{}".format(level) for level in range(depth - 1))
+            results.append(result(NAME, "{} enter+name+leave depth {}".format(case, depth),
+                                  seconds_per_call(lambda: _enter_read_leave(stack), number=number) * 1e9, "ns"))
+            for _ in range(depth - 1):
+                stack.leave()
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
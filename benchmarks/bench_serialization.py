@@ -0,0 +1,60 @@
+"""
+Time to turn a flush of metrics into request bodies: the dict path (format + json.dumps) against
+the formatters' direct-to-bytes encode().
+
+Run with: python -m benchmarks.bench_serialization
+"""
+import json
+import random
+
+from metrics_publisher_with_dimensions.t2.formatters import T2Formatter, T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata, TimerMetric, DeltaCounterMetric
+
+from .harness import report, result, seconds_per_call
+
+NAME = "serialization"
+METADATA = MetricMetadata("bench", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+TIMESTAMP = 1700000000000
+
+
+def make_metrics(count, names=100, seconds=10):
+    rng = random.Random(count)
+    metrics = []
+    for i in range(count):
+        timestamp = TIMESTAMP + (i % seconds) * 1000
+        if i % 2:
+            metrics.append(TimerMetric("bench.op{}.Time".format(i % names), rng.random() * 100, timestamp=timestamp))
+        else:
+            metrics.append(DeltaCounterMetric("bench.op{}.Count".format(i % names), rng.randint(0, 3),
+                                              timestamp=timestamp))
+    return metrics
+
+
+def run(quick=False):
+    count = 1000 if quick else 10000
+    number = 3 if quick else 10
+    metrics = make_metrics(count)
+    results = []
+    for formatter in (T2Formatter(), T2OverlayFormatter()):
+        case = formatter.__class__.__name__
+        payloads = formatter.group_payloads(metrics, METADATA)
+
+        def dict_path():
+            return [json.dumps(p, separators=(',', ':')).encode('utf-8')
+                    for p in formatter.serialize_payloads(payloads)]
+
+        def bytes_path():
+            return [formatter.encode_payload(p) for p in payloads]
+
+        assert dict_path() == bytes_path()
+        results.append(result(NAME, "{} serialize {} dicts+json".format(case, count),
+                              seconds_per_call(dict_path, number=number) * 1e3, "ms"))
+        results.append(result(NAME, "{} serialize {} direct".format(case, count),
+                              seconds_per_call(bytes_path, number=number) * 1e3, "ms"))
+        results.append(result(NAME, "{} format+serialize {} direct".format(case, count),
+                              seconds_per_call(lambda: formatter.encode(metrics, METADATA), number=number) * 1e3, "ms"))
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
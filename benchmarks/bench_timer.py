@@ -0,0 +1,47 @@
+"""
+Per-call overhead of a function decorated with a Timer, against the same function undecorated.
+
+The "context decorator" case reproduces the previous decorator, which ran the Timer's own
+__enter__/__exit__ (and so shared its start time between calls), for comparison. The "sampled"
+case records 1 in 100 calls. The client only keeps a scope stack (and sampler) and drops what is
+submitted, so only the decorator itself is timed.
+
+Run with: python -m benchmarks.bench_timer
+"""
+import contextdecorator
+
+from metrics_publisher_with_dimensions.t2.instrumentation.sampler import Sampler
+from metrics_publisher_with_dimensions.t2.instrumentation.timer import _Timer
+
+from .harness import NullClient, report, result, seconds_per_call
+
+NAME = "timer"
+
+
+def work(x):
+    return x + 1
+
+
+def run(quick=False):
+    number = 5000 if quick else 50000
+    client = NullClient()
+    cases = (
+        ("undecorated", work),
+        ("context decorator", contextdecorator.ContextDecorator.__call__(_Timer(client, "Work"), work)),
+        ("decorator", _Timer(client, "Work")(work)),
+        ("sampled decorator", _Timer(NullClient(sampler=Sampler(default_rate=0.01)), "Work")(work)),
+    )
+    results = []
+    baseline = None
+    for case, fn in cases:
+        ns = seconds_per_call(lambda: fn(1), number=number) * 1e9
+        results.append(result(NAME, case + " call", ns, "ns"))
+        if baseline is None:
+            baseline = ns
+        else:
+            results.append(result(NAME, case + " overhead", ns - baseline, "ns"))
+    return results
+
+
+if __name__ == "__main__":
+    report(run())
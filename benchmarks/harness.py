@@ -0,0 +1,117 @@
+"""
+Small helpers shared by the benchmarks in this directory.
+
+Every benchmark module exposes a run() function that returns a list of result dicts:
+{"benchmark": ..., "case": ..., "value": ..., "unit": ...}
+"""
+import sys
+import threading
+import timeit
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics_publisher_with_dimensions.t2.instrumentation.scope_stack import ScopeStack
+
+
+def result(benchmark, case, value, unit):
+    return {"benchmark": benchmark, "case": case, "value": value, "unit": unit}
+
+
+def seconds_per_call(fn, number=10000, repeat=5):
+    """
+    Best-of-`repeat` wall time of a single call to fn
+    :param fn: A callable taking no arguments
+    :param number: How many calls to make per repetition
+    :param repeat: How many repetitions to run
+    :return: float seconds
+    """
+    return min(timeit.Timer(fn).repeat(repeat=repeat, number=number)) / number
+
+
+def bytes_per_object(factory, count=10000):
+    """
+    Average number of bytes allocated by a call to factory, measured with tracemalloc
+    :param factory: A callable returning a new object
+    :param count: How many objects to allocate
+    :return: float bytes
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [factory() for _ in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (after - before - sys.getsizeof(objects)) / float(count)
+
+
+def report(results, out=sys.stdout):
+    for r in results:
+        out.write("{:<28} {:<44} {:>14.3f} {}\n".format(r["benchmark"], r["case"], r["value"], r["unit"]))
+
+
+class NullClient(object):
+    """
+    Stands in for a metrics Client: it keeps a scope stack and an optional Sampler, and drops whatever
+    is submitted, so that benchmarks of the instruments only time the instruments.
+    """
+    def __init__(self, sampler=None):
+        self._scope = ScopeStack()
+        self.sampler = sampler
+
+    def enter_scope(self, scope_name):
+        self._scope.enter(scope_name)
+
+    def leave_scope(self):
+        self._scope.leave()
+
+    def get_scoped_metric_name(self):
+        return self._scope.prefix
+
+    def submit(self, metric_or_metrics, dimensions=None):
+        pass
+
+
+class LocalT2Server(object):
+    def __init__(self):
+        """
+        A stand-in for the T2 endpoint on localhost: it accepts every PUT with a 200 and keeps the bodies.
+        Use it as a context manager; the server runs in a background thread until the block exits.
+        """
+        self.bodies = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server._lock:
+                    server.bodies.append(body)
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.endpoint = "http://127.0.0.1:{}/".format(self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever, name="local-t2-server")
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            del self.bodies[:]
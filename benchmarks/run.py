@@ -0,0 +1,139 @@
+"""
+Run the benchmarks, save the results as JSON and compare them against a saved baseline.
+
+    python -m benchmarks.run --quick --output baseline.json
+    python -m benchmarks.run --quick --compare baseline.json
+
+A comparison prints the change of every case the two runs share, and exits with status 1 if any
+case got worse by more than --threshold. Units ending in "/s" are throughputs (higher is better);
+every other unit is a time or a size (lower is better). Benchmarks are noisy, so compare runs made
+on the same machine, with the same --quick setting.
+"""
+import argparse
+import datetime
+import importlib
+import json
+import platform
+import sys
+import traceback
+
+from .harness import report
+
+FORMAT_VERSION = 1
+MODULES = (
+    "bench_models",
+    "bench_instruments",
+    "bench_scope",
+    "bench_timer",
+    "bench_formatters",
+    "bench_serialization",
+    "bench_overlay_payload",
+    "bench_metric_log",
+    "bench_emit",
+    "bench_flusher",
+)
+
+
+def run_modules(modules, quick=False, out=sys.stdout):
+    """
+    Run benchmark modules one after another. A module that fails is recorded in the errors and
+    doesn't stop the others.
+    :param modules: The names of the modules in this package to run
+    :param quick: Whether to run the short version of each benchmark
+    :param out: Where to report results as they come in
+    :return: (results, errors), where errors maps a module name to its traceback
+    """
+    results = []
+    errors = {}
+    for name in modules:
+        try:
+            module_results = importlib.import_module("." + name, __package__).run(quick=quick)
+        except Exception:
+            errors[name] = traceback.format_exc()
+            out.write("{} failed:\n{}".format(name, errors[name]))
+            continue
+        report(module_results, out=out)
+        results.extend(module_results)
+    return results, errors
+
+
+def higher_is_better(unit):
+    return unit.endswith("/s")
+
+
+def compare(baseline, current, threshold):
+    """
+    Compare the cases two runs share.
+    :param baseline: The results of the baseline run
+    :param current: The results of this run
+    :param threshold: The relative change beyond which a case counts as better or worse
+    :return: A list of (result, baseline value, relative change, verdict), verdict being "better",
+        "worse" or "" for a change within the threshold. A positive change is always an improvement.
+    """
+    baseline_values = dict(((r["benchmark"], r["case"], r["unit"]), r["value"]) for r in baseline)
+    rows = []
+    for r in current:
+        before = baseline_values.get((r["benchmark"], r["case"], r["unit"]))
+        if before is None:
+            continue
+        if before == 0:
+            change = 0.0
+        else:
+            change = (r["value"] - before) / abs(before)
+            if not higher_is_better(r["unit"]):
+                change = -change
+        verdict = "better" if change > threshold else "worse" if change < -threshold else ""
+        rows.append((r, before, change, verdict))
+    return rows
+
+
+def report_comparison(rows, out=sys.stdout):
+    for r, before, change, verdict in rows:
+        out.write("{:<28} {:<44} {:>14.3f} -> {:>14.3f} {:<10} {:>+8.1%} {}\n".format(
+            r["benchmark"], r["case"], before, r["value"], r["unit"], change, verdict))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the metrics client benchmarks.")
+    parser.add_argument("--quick", action="store_true", help="Run the short version of each benchmark")
+    parser.add_argument("--only", action="append", choices=MODULES, metavar="MODULE",
+                        help="Run only this module (may be repeated); one of " + ", ".join(MODULES))
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare the results with this saved JSON file")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative change that counts as a regression when comparing (default 0.1)")
+    args = parser.parse_args(argv)
+
+    results, errors = run_modules(args.only or MODULES, quick=args.quick)
+    document = {
+        "version": FORMAT_VERSION,
+        "created": datetime.datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": results,
+        "errors": errors,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+    status = 1 if errors else 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("quick") != args.quick:
+            sys.stdout.write("Warning: the baseline was run with quick={}\n".format(baseline.get("quick")))
+        rows = compare(baseline["results"], results, args.threshold)
+        sys.stdout.write("\n")
+        report_comparison(rows)
+        worse = [row for row in rows if row[3] == "worse"]
+        sys.stdout.write("\n{} cases compared, {} better, {} worse\n".format(
+            len(rows), len([row for row in rows if row[3] == "better"]), len(worse)))
+        if worse:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
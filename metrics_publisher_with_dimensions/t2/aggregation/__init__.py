@@ -0,0 +1,2 @@
+from .aggregator import MetricAggregator
+from .cardinality_limiter import CardinalityLimiter
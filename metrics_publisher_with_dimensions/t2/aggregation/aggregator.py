@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+
+from ..models import AggregatedMetric, DeltaCounterMetric, TimerMetric
+from ..models.metric import dimensions_key
+
+logger = logging.getLogger(__name__)
+
+
+class MetricAggregator(object):
+    AGGREGATED_TYPES = (TimerMetric, DeltaCounterMetric)
+
+    def __init__(self, bucket_ms=1000, flush_interval_ms=10000, max_cells=10000):
+        """
+        A MetricAggregator folds timers and delta counters in memory before they reach the emitters.
+        Metrics are grouped by (name, override tags, metric type, time bucket) and each group is kept as
+        a single :py:class: `t2.models.aggregated_metric.AggregatedMetric` cell. Only the cells are
+        handed to the emitters when the aggregator is drained. Metrics with dimensions are never aggregated.
+        This class is thread-safe.
+
+        :param bucket_ms: The width of a time bucket in milliseconds
+        :param flush_interval_ms: How often the aggregator should be drained, in milliseconds
+        :param max_cells: Drain early once this many distinct cells are held in memory
+        """
+        self.bucket_ms = int(bucket_ms)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_cells = max_cells
+        self._cells = {}
+        self._lock = threading.Lock()
+        self._next_flush = time.time() + self.flush_interval
+
+    def add(self, metric):
+        """
+        Fold a metric into its cell
+        :param metric: The metric to fold
+        :return: True if the metric was aggregated, False if it should be emitted as is
+        """
+        metric_class = type(metric)
+        if metric_class not in self.AGGREGATED_TYPES or metric.dimensions:
+            return False
+
+        bucket = metric.timestamp - metric.timestamp % self.bucket_ms
+        key = (metric.name, dimensions_key(metric.override_tags), metric_class, bucket)
+        with self._lock:
+            cell = self._cells.get(key)
+            if cell is None:
+                cell = AggregatedMetric(metric.name, metric_class,
+                                        timestamp=bucket,
+                                        override_tags=metric.override_tags)
+                self._cells[key] = cell
+            cell.fold(metric.value, metric.units_of_work, metric.sample_weight)
+        return True
+
+    def flush_due(self):
+        """
+        :return: True if the flush interval has elapsed or too many cells are held
+        """
+        return len(self._cells) >= self.max_cells or time.time() >= self._next_flush
+
+    def time_to_next_flush(self):
+        """
+        :return: The number of seconds until the flush interval elapses, 0 if it already has
+        """
+        return max(self._next_flush - time.time(), 0)
+
+    def drain(self):
+        """
+        Remove and return all of the cells aggregated so far
+        :return: list of AggregatedMetric
+        """
+        with self._lock:
+            cells, self._cells = self._cells, {}
+            self._next_flush = time.time() + self.flush_interval
+        logger.debug("Drained %d aggregated metric cells", len(cells))
+        return list(cells.values())
+
+    def __len__(self):
+        return len(self._cells)
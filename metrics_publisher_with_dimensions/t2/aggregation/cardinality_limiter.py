@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+
+from ..models.metric import AVAILABILTY_DOMAIN_KEY, FLEET_KEY, PROJECT_KEY, REGION_KEY, dimensions_key
+
+logger = logging.getLogger(__name__)
+
+# The value every tag (or dimension) of a combination over the limit is replaced with
+OVERFLOW_VALUE = "__other__"
+# Tags that decide where T2 files a metric. They are never folded: T2 doesn't know a project "__other__".
+ROUTING_TAGS = frozenset([PROJECT_KEY, FLEET_KEY, AVAILABILTY_DOMAIN_KEY, REGION_KEY])
+
+
+class CardinalityLimiter(object):
+    def __init__(self, max_combinations=1000, window_seconds=60, overflow_value=OVERFLOW_VALUE):
+        """
+        A CardinalityLimiter caps the number of distinct (override_tags, dimensions) combinations that reach the
+        emitters. Every distinct combination is a payload (and request) of its own in a T2 flush, and a file of
+        its own in a metric log tap, so a bug that puts e.g. a request id into a tag would otherwise make
+        both grow without bound.
+
+        The first max_combinations combinations seen in a window go through as they are. After that, a metric
+        with a combination that hasn't been seen in the window has every dimension value, and every tag value
+        but the routing tags (project, fleet, availabilityDomain and region), replaced with overflow_value,
+        e.g. {"hostname": "__other__"}, so all of the overflow lands in a few buckets. A new window starts
+        window_seconds after the previous one, with no combinations seen.
+
+        Metrics without override tags or dimensions are never limited. This class is thread-safe.
+
+        :param max_combinations: The number of distinct combinations allowed per window
+        :param window_seconds: How long a window lasts, in seconds
+        :param overflow_value: The value to replace the tags and dimensions of rejected combinations with
+        """
+        self.max_combinations = max_combinations
+        self.window_seconds = window_seconds
+        self.overflow_value = overflow_value
+        self._lock = threading.Lock()
+        self._seen = set()
+        self._window_end = time.time() + window_seconds
+        self._warned = False
+        self.rejected_combinations = 0
+        self.last_rejected = None
+
+    def limit(self, metric_or_metrics):
+        """
+        Fold the override tags and dimensions of metrics whose combination is over the limit, in place
+        :param metric_or_metrics: The metric(s) about to be submitted
+        :return: None
+        """
+        metrics = metric_or_metrics if isinstance(metric_or_metrics, list) else [metric_or_metrics]
+        for m in metrics:
+            if m.override_tags is None and m.dimensions is None:
+                continue
+            key = (dimensions_key(m.override_tags), dimensions_key(m.dimensions))
+            if not self._admit(key, m.override_tags, m.dimensions):
+                if m.override_tags:
+                    m.override_tags = self._fold(m.override_tags, keep=ROUTING_TAGS)
+                if m.dimensions:
+                    m.dimensions = self._fold(m.dimensions)
+
+    def _admit(self, key, override_tags, dimensions):
+        if key in self._seen:
+            return True
+        with self._lock:
+            now = time.time()
+            if now >= self._window_end:
+                self._seen = set()
+                self._window_end = now + self.window_seconds
+                self._warned = False
+            if key in self._seen:
+                return True
+            if len(self._seen) < self.max_combinations:
+                self._seen.add(key)
+                return True
+            self.rejected_combinations += 1
+            self.last_rejected = {"overrideTags": override_tags, "dimensions": dimensions}
+            warn = not self._warned
+            self._warned = True
+        if warn:
+            logger.warning("More than %d distinct tag and dimension combinations in %ss; folding new ones into %r. "
+                           "First rejected: override_tags=%r, dimensions=%r", self.max_combinations,
+                           self.window_seconds, self.overflow_value, override_tags, dimensions)
+        return False
+
+    def _fold(self, tags, keep=()):
+        return dict((name, value if name in keep else self.overflow_value) for name, value in tags.items())
+
+    def stats(self):
+        """
+        :return: A dict with the limit, the number of combinations seen in the current window, and the number
+            of metrics folded because their combination was over the limit (rejectedCombinations), ever
+        """
+        with self._lock:
+            return {
+                "maxCombinations": self.max_combinations,
+                "combinations": len(self._seen),
+                "rejectedCombinations": self.rejected_combinations,
+                "lastRejected": self.last_rejected,
+            }
@@ -0,0 +1,128 @@
+import asyncio
+import inspect
+import logging
+
+from .client import (Client, MAX_BUFFER_TIME_MS_NAME, DEFAULT_MAX_BUFFER_SIZE, MAX_JITTER_MS_NAME,
+                     DEFAULT_JITTER_TIME, MAX_METRICS_TO_BUFFER_NAME, DEFAULT_MAX_BUFFER_TIME,
+                     DESIRED_BATCH_SIZE_NAME, DEFAULT_BATCH_SIZE, MTLS_CLIENT_CERT_CONFIG_KEY_NAME,
+                     MTLS_CLIENT_KEY_CONFIG_KEY_NAME, CA_CERT_CONFIG_KEY_NAME, MAX_METRICS_PER_REQUEST_NAME,
+                     MAX_REQUEST_BYTES_NAME)
+from .emitters.async_t2_emitter import AsyncT2Emitter
+from .instrumentation.async_instruments import (AsyncCumulativeCounter, AsyncDeltaCounter, AsyncGauge, AsyncScope,
+                                                AsyncTimer)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncClient(Client):
+    def __init__(self, config_file_or_dict, authentication_provider=None, formatter=None):
+        """
+        A t2 Client for asyncio applications. It is configured exactly like :py:class: `t2.client.Client`,
+        but metrics are uploaded by an :py:class: `t2.emitters.async_t2_emitter.AsyncT2Emitter` task on
+        the running event loop, and its instruments can be used with `async with`:
+
+        metrics = AsyncClient("/path/to/typesafe/config/file.conf")
+
+        async def handle(request):
+            async with metrics.time("handle"):
+                ...
+
+        await metrics.close()
+
+        The "synchronous" config option is ignored; emits never block the event loop.
+        flush() and close() are coroutines and must be awaited.
+        """
+        self._aggregation_handle = None
+        super(AsyncClient, self).__init__(config_file_or_dict, authentication_provider=authentication_provider,
+                                          formatter=formatter)
+
+    def _make_t2_emitter(self, t2_config, authentication_provider, formatter):
+        return AsyncT2Emitter(
+            self.metric_metadata,
+            endpoint=self.get_t2_endpoint(t2_config),
+            max_pending_metrics=self.metrics_config.get(DESIRED_BATCH_SIZE_NAME, DEFAULT_BATCH_SIZE),
+            queue_size=self.metrics_config.get(MAX_METRICS_TO_BUFFER_NAME, DEFAULT_MAX_BUFFER_TIME),
+            max_wait_time=self.metrics_config.get(MAX_BUFFER_TIME_MS_NAME, DEFAULT_MAX_BUFFER_SIZE),
+            jitter=self.metrics_config.get(MAX_JITTER_MS_NAME, DEFAULT_JITTER_TIME),
+            mtls_client_cert_file=t2_config.get(MTLS_CLIENT_CERT_CONFIG_KEY_NAME, None),
+            mtls_client_key_file=t2_config.get(MTLS_CLIENT_KEY_CONFIG_KEY_NAME, None),
+            ca_cert_file=t2_config.get(CA_CERT_CONFIG_KEY_NAME, None),
+            authentication_provider=authentication_provider,
+            formatter=formatter,
+            payload_encoder=self._make_payload_encoder(),
+            max_metrics_per_request=self.metrics_config.get(MAX_METRICS_PER_REQUEST_NAME, None),
+            max_request_bytes=self.metrics_config.get(MAX_REQUEST_BYTES_NAME, None)
+        )
+
+    def _ensure_aggregation_timer(self):
+        # AsyncT2Emitter isn't thread-safe, so idle aggregates are drained by a timer on the event loop
+        if self._aggregation_handle is not None or self._closed.is_set():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not called from a coroutine; the aggregates are drained by the next submit or flush
+            return
+        self._aggregation_handle = loop.call_later(self.aggregator.time_to_next_flush(), self._on_aggregation_timer)
+
+    def _on_aggregation_timer(self):
+        self._aggregation_handle = None
+        if self.aggregator.flush_due():
+            self.flush_aggregates()
+        if len(self.aggregator):
+            self._ensure_aggregation_timer()
+
+    async def flush(self):
+        """
+        Emit any aggregated metrics and upload everything the emitters have buffered
+        :return: None
+        """
+        self.flush_aggregates()
+        for emitter in self.emitters:
+            flush = getattr(emitter, "flush", None)
+            if flush is not None and inspect.iscoroutinefunction(flush):
+                await flush()
+
+    async def close(self):
+        """
+        Upload everything that is buffered and close all emitters
+        :return: None
+        """
+        self._closed.set()
+        if self._aggregation_handle is not None:
+            self._aggregation_handle.cancel()
+            self._aggregation_handle = None
+        self.flush_aggregates()
+        for emitter in self.emitters:
+            closed = emitter.close()
+            if inspect.isawaitable(closed):
+                await closed
+
+    def time(self, name, override_tags=None):
+        return AsyncTimer(self, name, override_tags=override_tags)
+
+    def scope(self, name, override_tags=None):
+        return AsyncScope(self, name, override_tags=override_tags)
+
+    def delta_counter(self, name, override_tags=None):
+        return AsyncDeltaCounter(self, name, override_tags=override_tags)
+
+    def cumulative_counter(self, name, override_tags=None):
+        return AsyncCumulativeCounter(self, name, override_tags=override_tags)
+
+    def gauge(self, name, override_tags=None):
+        return AsyncGauge(self, name, override_tags=override_tags)
+
+
+class AsyncOverlayClient(AsyncClient):
+    def __init__(self, config_file_or_dict, authentication_provider):
+        """
+        An asyncio T2 Client for Overlay customers. See :py:class: `t2.client.OverlayClient`.
+        """
+        super(AsyncOverlayClient, self).__init__(
+            config_file_or_dict,
+            authentication_provider=authentication_provider
+        )
+
+    def _make_formatter(self):
+        return self._make_overlay_formatter()
@@ -2,21 +2,31 @@ import logging
 import os
 import socket
 import threading
-from collections import defaultdict
 
 import telemetry_endpoint_provider
 from pic.environment import environment
 from pyhocon import ConfigFactory
 
+from .aggregation import CardinalityLimiter, MetricAggregator
+from .emitters.payload_encoder import PayloadEncoder, DEFAULT_COMPRESSION_THRESHOLD
+from .emitters.spill_store import SpillStore, DEFAULT_MAX_BYTES as DEFAULT_SPILL_MAX_BYTES, \
+    DEFAULT_MAX_AGE as DEFAULT_SPILL_MAX_AGE
+from .emitters.retry_scheduler import (CircuitBreaker, RetryScheduler, DEFAULT_FAILURE_THRESHOLD,
+                                       DEFAULT_MAX_PENDING_RETRIES)
 from .emitters.t2_emitter import T2Emitter
 from .emitters.t2_metric_log_emitter import T2MetricLogEmitter
+from .emitters.log_tap_writer import LogTapWriter, DEFAULT_MAX_BUFFERED_LINES as DEFAULT_LOG_TAP_MAX_BUFFERED_LINES
 from .instrumentation.cumulative_counter import CumulativeCounter
 from .instrumentation.delta_counter import DeltaCounter
 from .instrumentation.gauge import Gauge
+from .instrumentation.sampler import Sampler
 from .instrumentation.timer import _Timer
 from .instrumentation.scope import Scope
-from .models.metric import MetricMetadata
+from .instrumentation.scope_stack import ScopeStack
+from .models.metric import MetricMetadata, set_dimensions
 from .formatters.t2_overlay_formatter import T2OverlayFormatter
+from .models.histogram import DEFAULT_MAX_BUCKETS
+from .profiling import ProfileAggregator
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +47,44 @@ MAX_BUFFER_TIME_MS_NAME = "maxBufferTimeMillis"
 DEFAULT_MAX_BUFFER_TIME = 10000  # 10 seconds
 MAX_JITTER_MS_NAME = "maxJitterMillis"
 DEFAULT_JITTER_TIME = 1000  # 1 second
+COLUMNAR_BUFFER_NAME = "columnarBuffer"
+FLUSHER_MODE_NAME = "flusherMode"
+DEFAULT_FLUSHER_MODE = "process"
+MAX_CONCURRENT_REQUESTS_NAME = "maxConcurrentRequests"
+DEFAULT_MAX_CONCURRENT_REQUESTS = 1
+COMPACT_JSON_NAME = "compactJson"
+COMPRESSION_NAME = "compression"
+COMPRESSION_THRESHOLD_BYTES_NAME = "compressionThresholdBytes"
+JSON_BACKEND_NAME = "jsonBackend"
+DEFAULT_JSON_BACKEND = "json"
+MAX_METRICS_PER_REQUEST_NAME = "maxMetricsPerRequest"
+MAX_REQUEST_BYTES_NAME = "maxRequestBytes"
+HISTOGRAM_RELATIVE_ACCURACY_NAME = "histogramRelativeAccuracy"
+HISTOGRAM_MAX_BUCKETS_NAME = "histogramMaxBuckets"
+SPILL_DIRECTORY_NAME = "spillDirectory"
+SPILL_MAX_BYTES_NAME = "spillMaxBytes"
+SPILL_MAX_AGE_SECONDS_NAME = "spillMaxAgeSeconds"
+MAX_PENDING_RETRIES_NAME = "maxPendingRetries"
+CIRCUIT_BREAKER_FAILURE_THRESHOLD_NAME = "circuitBreakerFailureThreshold"
+CIRCUIT_BREAKER_RESET_MS_NAME = "circuitBreakerResetMillis"
+DEFAULT_CIRCUIT_BREAKER_RESET = 30000  # 30 seconds
+SELF_TELEMETRY_NAME = "selfTelemetry"
+PROFILING_LOG_INTERVAL_SECONDS_NAME = "profilingLogIntervalSeconds"
+AGGREGATE_METRICS_NAME = "aggregateMetrics"
+AGGREGATION_BUCKET_MS_NAME = "aggregationBucketMillis"
+DEFAULT_AGGREGATION_BUCKET = 1000  # 1 second
+AGGREGATION_FLUSH_INTERVAL_MS_NAME = "aggregationFlushIntervalMillis"
+DEFAULT_AGGREGATION_FLUSH_INTERVAL = 10000  # 10 seconds
+MAX_AGGREGATION_CELLS_NAME = "maxAggregationCells"
+DEFAULT_MAX_AGGREGATION_CELLS = 10000
+SAMPLE_RATE_NAME = "sampleRate"
+SAMPLE_RATES_NAME = "sampleRates"
+SAMPLE_RATE_METRIC_KEY = 'metric'
+SAMPLE_RATE_PREFIX_KEY = 'prefix'
+SAMPLE_RATE_KEY = 'rate'
+MAX_TAG_COMBINATIONS_NAME = "maxTagCombinations"
+TAG_COMBINATIONS_WINDOW_MS_NAME = "tagCombinationsWindowMillis"
+DEFAULT_TAG_COMBINATIONS_WINDOW = 60000  # 1 minute
 
 FLEET_KEY_NAME = "fleet"
 METRIC_LOG_TAP_CONFIG_KEY_NAME = "metricLogTapConfig"
@@ -44,6 +92,10 @@ HOSTNAME_KEY_NAME = "hostname"
 AVAILABILITY_DOMAIN_KEY_NAME = "availabilityDomain"
 ENDPOINT_OVERRIDE_KEY_NAME = 'endpointOverride'
 LOG_DIR_KEY = 'logDirectory'
+LOG_TAP_MAX_LATENCY_MS_KEY = 'maxLatencyMillis'
+DEFAULT_LOG_TAP_MAX_LATENCY = 1000  # 1 second
+LOG_TAP_MAX_BUFFERED_LINES_KEY = 'maxBufferedLines'
+LOG_TAP_FLUSH_ON_CLOSE_KEY = 'flushOnClose'
 
 AVAILABILITY_DOMAIN_VARIABLE = "AVAILABILITY_DOMAIN"
 REGION_VARIABLE = "REGION"
@@ -69,9 +121,23 @@ class Client(object):
             typesafe_config = ConfigFactory.parse_file(config_file_or_dict)
 
         self.metrics_config = typesafe_config.get(METRICS_CONFIG_KEY_NAME)
+        if formatter is None:
+            formatter = self._make_formatter()
 
-        self._scope = defaultdict(list)
+        self._scope = ScopeStack()
+        self.sampler = self._make_sampler()
+        self.cardinality_limiter = self._make_cardinality_limiter()
         self.emitters = []
+        self.aggregator = None
+        self._aggregation_timer_pid = None
+        self._aggregation_timer_lock = threading.Lock()
+        self._closed = threading.Event()
+        if self.metrics_config.get(AGGREGATE_METRICS_NAME, False):
+            self.aggregator = MetricAggregator(
+                bucket_ms=self.metrics_config.get(AGGREGATION_BUCKET_MS_NAME, DEFAULT_AGGREGATION_BUCKET),
+                flush_interval_ms=self.metrics_config.get(AGGREGATION_FLUSH_INTERVAL_MS_NAME,
+                                                          DEFAULT_AGGREGATION_FLUSH_INTERVAL),
+                max_cells=self.metrics_config.get(MAX_AGGREGATION_CELLS_NAME, DEFAULT_MAX_AGGREGATION_CELLS))
 
         self.project = self.metrics_config.get(PROJECT_KEY_NAME)
         self.fleet = None
@@ -90,7 +156,8 @@ class Client(object):
         if t2_config:
             self.fleet = t2_config.get(FLEET_KEY_NAME)
             if METRIC_LOG_TAP_CONFIG_KEY_NAME in t2_config.keys():
-                logdir = t2_config[METRIC_LOG_TAP_CONFIG_KEY_NAME][LOG_DIR_KEY]
+                log_tap_config = t2_config[METRIC_LOG_TAP_CONFIG_KEY_NAME]
+                logdir = log_tap_config[LOG_DIR_KEY]
                 self.add_emitter(
                     T2MetricLogEmitter(
                         region=self.region,
@@ -98,26 +165,105 @@ class Client(object):
                         project=self.project,
                         fleet=self.fleet,
                         hostname=self.hostname,
-                        logdir=logdir
+                        logdir=logdir,
+                        writer=self._make_log_tap_writer(log_tap_config)
                     )
                 )
             else:
-                self.add_emitter(
-                    T2Emitter(
-                        self.metric_metadata,
-                        endpoint=self.get_t2_endpoint(t2_config),
-                        synchronous=self.metrics_config.get(SYNCHRONOUS_CONFIG_KEY_NAME, False),
-                        max_pending_metrics=self.metrics_config.get(DESIRED_BATCH_SIZE_NAME, DEFAULT_BATCH_SIZE),
-                        queue_size=self.metrics_config.get(MAX_METRICS_TO_BUFFER_NAME, DEFAULT_MAX_BUFFER_TIME),
-                        max_wait_time=self.metrics_config.get(MAX_BUFFER_TIME_MS_NAME, DEFAULT_MAX_BUFFER_SIZE),
-                        jitter=self.metrics_config.get(MAX_JITTER_MS_NAME, DEFAULT_JITTER_TIME),
-                        mtls_client_cert_file=t2_config.get(MTLS_CLIENT_CERT_CONFIG_KEY_NAME, None),
-                        mtls_client_key_file=t2_config.get(MTLS_CLIENT_KEY_CONFIG_KEY_NAME, None),
-                        ca_cert_file=t2_config.get(CA_CERT_CONFIG_KEY_NAME, None),
-                        authentication_provider=authentication_provider,
-                        formatter=formatter
-                    )
-                )
+                self.add_emitter(self._make_t2_emitter(t2_config, authentication_provider, formatter))
+
+    def _make_t2_emitter(self, t2_config, authentication_provider, formatter):
+        return T2Emitter(
+            self.metric_metadata,
+            endpoint=self.get_t2_endpoint(t2_config),
+            synchronous=self.metrics_config.get(SYNCHRONOUS_CONFIG_KEY_NAME, False),
+            max_pending_metrics=self.metrics_config.get(DESIRED_BATCH_SIZE_NAME, DEFAULT_BATCH_SIZE),
+            queue_size=self.metrics_config.get(MAX_METRICS_TO_BUFFER_NAME, DEFAULT_MAX_BUFFER_TIME),
+            max_wait_time=self.metrics_config.get(MAX_BUFFER_TIME_MS_NAME, DEFAULT_MAX_BUFFER_SIZE),
+            jitter=self.metrics_config.get(MAX_JITTER_MS_NAME, DEFAULT_JITTER_TIME),
+            mtls_client_cert_file=t2_config.get(MTLS_CLIENT_CERT_CONFIG_KEY_NAME, None),
+            mtls_client_key_file=t2_config.get(MTLS_CLIENT_KEY_CONFIG_KEY_NAME, None),
+            ca_cert_file=t2_config.get(CA_CERT_CONFIG_KEY_NAME, None),
+            authentication_provider=authentication_provider,
+            formatter=formatter,
+            columnar_buffer=self.metrics_config.get(COLUMNAR_BUFFER_NAME, False),
+            flusher_mode=self.metrics_config.get(FLUSHER_MODE_NAME, DEFAULT_FLUSHER_MODE),
+            max_concurrent_sends=self.metrics_config.get(MAX_CONCURRENT_REQUESTS_NAME, DEFAULT_MAX_CONCURRENT_REQUESTS),
+            payload_encoder=self._make_payload_encoder(),
+            max_metrics_per_request=self.metrics_config.get(MAX_METRICS_PER_REQUEST_NAME, None),
+            max_request_bytes=self.metrics_config.get(MAX_REQUEST_BYTES_NAME, None),
+            spill_store=self._make_spill_store(),
+            retry_scheduler=RetryScheduler(
+                max_pending=self.metrics_config.get(MAX_PENDING_RETRIES_NAME, DEFAULT_MAX_PENDING_RETRIES)),
+            circuit_breaker=CircuitBreaker(
+                failure_threshold=self.metrics_config.get(CIRCUIT_BREAKER_FAILURE_THRESHOLD_NAME,
+                                                          DEFAULT_FAILURE_THRESHOLD),
+                reset_timeout=self.metrics_config.get(CIRCUIT_BREAKER_RESET_MS_NAME,
+                                                      DEFAULT_CIRCUIT_BREAKER_RESET) / 1000.0),
+            self_telemetry=self.metrics_config.get(SELF_TELEMETRY_NAME, False),
+            profiling_hooks=self._make_profiling_hooks()
+        )
+
+    def _make_profiling_hooks(self):
+        # Profiling is off unless a log interval is configured
+        interval = self.metrics_config.get(PROFILING_LOG_INTERVAL_SECONDS_NAME, None)
+        if interval is None:
+            return []
+        return [ProfileAggregator(interval=interval)]
+
+    def _make_sampler(self):
+        # sampleRate is the default rate; sampleRates entries set the rate of a metric name, e.g.
+        # {"metric": "Api.GetWidget", "rate": 0.01}, or of every name starting with a prefix, e.g.
+        # {"prefix": "Cache.", "rate": 0.1}. Without either, nothing is sampled and instruments skip the sampler.
+        default_rate = self.metrics_config.get(SAMPLE_RATE_NAME, 1.0)
+        entries = self.metrics_config.get(SAMPLE_RATES_NAME, [])
+        if default_rate == 1 and not entries:
+            return None
+        rates = {}
+        prefix_rates = {}
+        for entry in entries:
+            prefix = entry.get(SAMPLE_RATE_PREFIX_KEY, None)
+            if prefix is not None:
+                prefix_rates[prefix] = entry.get(SAMPLE_RATE_KEY)
+            else:
+                rates[entry.get(SAMPLE_RATE_METRIC_KEY)] = entry.get(SAMPLE_RATE_KEY)
+        return Sampler(default_rate=default_rate, rates=rates, prefix_rates=prefix_rates)
+
+    def _make_log_tap_writer(self, log_tap_config):
+        return LogTapWriter(
+            max_latency=log_tap_config.get(LOG_TAP_MAX_LATENCY_MS_KEY, DEFAULT_LOG_TAP_MAX_LATENCY) / 1000.0,
+            max_buffered_lines=log_tap_config.get(LOG_TAP_MAX_BUFFERED_LINES_KEY, DEFAULT_LOG_TAP_MAX_BUFFERED_LINES),
+            flush_on_close=log_tap_config.get(LOG_TAP_FLUSH_ON_CLOSE_KEY, True)
+        )
+
+    def _make_spill_store(self):
+        spill_directory = self.metrics_config.get(SPILL_DIRECTORY_NAME, None)
+        if spill_directory is None:
+            return None
+        return SpillStore(
+            spill_directory,
+            max_bytes=self.metrics_config.get(SPILL_MAX_BYTES_NAME, DEFAULT_SPILL_MAX_BYTES),
+            max_age=self.metrics_config.get(SPILL_MAX_AGE_SECONDS_NAME, DEFAULT_SPILL_MAX_AGE)
+        )
+
+    def _make_formatter(self):
+        # None lets the emitter use its default formatter
+        return None
+
+    def _make_overlay_formatter(self):
+        return T2OverlayFormatter(
+            histogram_relative_accuracy=self.metrics_config.get(HISTOGRAM_RELATIVE_ACCURACY_NAME, None),
+            histogram_max_buckets=self.metrics_config.get(HISTOGRAM_MAX_BUCKETS_NAME, DEFAULT_MAX_BUCKETS)
+        )
+
+    def _make_payload_encoder(self):
+        return PayloadEncoder(
+            compact=self.metrics_config.get(COMPACT_JSON_NAME, True),
+            compression=self.metrics_config.get(COMPRESSION_NAME, None),
+            compression_threshold=self.metrics_config.get(COMPRESSION_THRESHOLD_BYTES_NAME,
+                                                          DEFAULT_COMPRESSION_THRESHOLD),
+            json_backend=self.metrics_config.get(JSON_BACKEND_NAME, DEFAULT_JSON_BACKEND)
+        )
 
     def get_t2_endpoint(self, t2_config):
         # Use the configured endpoint if there is one, otherwise use the endpoint provider
@@ -130,41 +276,117 @@ class Client(object):
 
         return endpoint
 
-    # see https://docs.python.org/2/library/threading.html#threading.Thread.ident
-    # (and then https://docs.python.org/2/library/thread.html#thread.get_ident)
+    # Scopes are tracked per thread, and per asyncio task where contextvars are available
     def enter_scope(self, scope_name):
-        self._scope[threading.current_thread().ident].append(scope_name)
+        self._scope.enter(scope_name)
 
     def leave_scope(self):
-        thread_id = threading.current_thread().ident
-        self._scope[thread_id].pop()
-        # Clean up after ourselves; no telling how big this dictionary will get.
-        if len(self._scope[thread_id]) == 0:
-            del self._scope[thread_id]
+        self._scope.leave()
 
     def get_scoped_metric_name(self):
-        return ".".join(self._scope[threading.current_thread().ident])
+        return self._scope.prefix
 
     @property
     def metric_metadata(self):
         return MetricMetadata(self.project, fleet=self.fleet, hostname=self.hostname,
                               availabilityDomain=self.availabilityDomain, region=self.region)
 
+    def _make_cardinality_limiter(self):
+        # Distinct override tag and dimension combinations are only limited if maxTagCombinations is set
+        max_combinations = self.metrics_config.get(MAX_TAG_COMBINATIONS_NAME, None)
+        if max_combinations is None:
+            return None
+        return CardinalityLimiter(
+            max_combinations=max_combinations,
+            window_seconds=self.metrics_config.get(TAG_COMBINATIONS_WINDOW_MS_NAME,
+                                                   DEFAULT_TAG_COMBINATIONS_WINDOW) / 1000.0)
+
     def add_emitter(self, emitter):
         self.emitters.append(emitter)
 
+    def stats(self):
+        """
+        A snapshot of the emitters' self-telemetry: metrics emitted and dropped, queue depth, flush sizes,
+        format and request times, retries and spills; and of the cardinality limiter, if enabled
+        :return: A dict with the stats of every emitter that keeps them, in the order they were added
+        """
+        stats = {"emitters": [emitter.stats() for emitter in self.emitters if hasattr(emitter, "stats")]}
+        if self.cardinality_limiter is not None:
+            stats["cardinality"] = self.cardinality_limiter.stats()
+        return stats
+
     def close(self):
+        self._closed.set()
+        self.flush_aggregates()
         for emitter in self.emitters:
             emitter.close()
 
     def submit(self, metric_or_metrics, dimensions=None):
         """
-        Submit given metric(s) to all emitters
+        Submit given metric(s) to all emitters. If aggregation is enabled, timers and delta
+        counters are folded into the aggregator instead and emitted when it is next drained.
+        If the cardinality limiter is enabled, metrics whose override tags and dimensions are a
+        combination over its limit have their dimensions and non-routing tags (such as hostname)
+        folded into an "__other__" bucket first.
         :param metric_or_metrics: A metric (or metrics) to emit
+        :param dimensions: Optional dimensions to give the metric(s), replacing their own. Metrics
+            with dimensions are never aggregated.
+        :return: None
+        """
+        set_dimensions(metric_or_metrics, dimensions)
+        if self.cardinality_limiter is not None:
+            self.cardinality_limiter.limit(metric_or_metrics)
+        if self.aggregator is not None:
+            self._ensure_aggregation_timer()
+            metric_or_metrics = self._aggregate(metric_or_metrics)
+            if self.aggregator.flush_due():
+                self.flush_aggregates()
+            if not metric_or_metrics:
+                return
+
+        for emitter in self.emitters:
+            emitter.emit(metric_or_metrics)
+
+    def flush_aggregates(self):
+        """
+        Drain the aggregator (if enabled) and emit the aggregated metrics to all emitters
         :return: None
         """
+        if self.aggregator is None:
+            return
+        aggregates = self.aggregator.drain()
+        if not aggregates:
+            return
         for emitter in self.emitters:
-            emitter.emit(metric_or_metrics, dimensions)
+            emitter.emit(aggregates)
+
+    def _ensure_aggregation_timer(self):
+        # submit() drains the aggregator when it is due, but once submits stop nothing would: a daemon thread
+        # drains it every flush interval. Started lazily, and again in a forked child.
+        pid = os.getpid()
+        if self._aggregation_timer_pid == pid:
+            return
+        with self._aggregation_timer_lock:
+            if self._aggregation_timer_pid == pid:
+                return
+            thread = threading.Thread(target=self._run_aggregation_timer, name="t2-aggregation-timer")
+            thread.daemon = True
+            thread.start()
+            self._aggregation_timer_pid = pid
+
+    def _run_aggregation_timer(self):
+        while not self._closed.wait(self.aggregator.time_to_next_flush()):
+            if not self.aggregator.flush_due():
+                continue
+            try:
+                self.flush_aggregates()
+            except Exception:
+                logger.exception("Encountered exception flushing aggregated metrics!")
+
+    def _aggregate(self, metric_or_metrics):
+        if not isinstance(metric_or_metrics, list):
+            return None if self.aggregator.add(metric_or_metrics) else metric_or_metrics
+        return [m for m in metric_or_metrics if not self.aggregator.add(m)]
 
     def time(self, name, override_tags=None):
         """
@@ -253,6 +475,8 @@ class OverlayClient(Client):
         """
         super(OverlayClient, self).__init__(
             config_file_or_dict,
-            authentication_provider=authentication_provider,
-            formatter=T2OverlayFormatter()
+            authentication_provider=authentication_provider
         )
+
+    def _make_formatter(self):
+        return self._make_overlay_formatter()
@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import os.path
+import random
+from uuid import uuid4
+
+import requests
+
+from .base_emitter import BaseEmitter
+from .payload_encoder import PayloadEncoder, JSON_BACKEND_JSON
+from .retry_scheduler import CircuitBreaker, RetryScheduler
+from ..formatters import T2Formatter
+from ..models import Metric
+from ..models.metric import set_dimensions
+
+logger = logging.getLogger(__name__)
+
+MINIMUM_FLUSH_WAIT_TIME = 0.01  # seconds
+MAX_SEND_ATTEMPTS = 7
+RETRY_WAIT_MULTIPLIER = 1.0  # seconds
+MAX_RETRY_WAIT = 10.0  # seconds
+
+
+class AsyncT2Emitter(BaseEmitter):
+    HEADERS = {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+    }
+
+    def __init__(
+            self,
+            metadata,
+            endpoint=None,
+            retry=True,
+            formatter=None,
+            max_pending_metrics=100,
+            queue_size=None,
+            max_wait_time=500,
+            jitter=1000,
+            request_id=None,
+            mtls_client_cert_file=None,
+            mtls_client_key_file=None,
+            authentication_provider=None,
+            ca_cert_file=None,
+            executor=None,
+            payload_encoder=None,
+            direct_serialization=True,
+            max_metrics_per_request=None,
+            max_request_bytes=None,
+            retry_scheduler=None,
+            circuit_breaker=None):
+        """
+        An asyncio-native counterpart to T2Emitter. emit() is a non-blocking append to an in-memory
+        buffer; batches are formatted and uploaded by a background task on the running event loop, which
+        is started lazily on the first emit made from inside the loop. Uploads go through a pooled
+        requests.Session in an executor so they never block the loop, and the payloads of a flush are
+        uploaded concurrently. Metrics discarded because the buffer was full are reported as
+        <project>-failed-attempts with the next flush.
+
+        flush() and close() are coroutines and must be awaited.
+
+        :param metadata: The default metric metadata
+        :param endpoint: The T2 endpoint to upload to
+        :param retry: Whether to retry failed uploads, with exponential backoff. Failed payloads wait in the
+            retry scheduler and are sent again by a later flush, so retries never hold up the background task.
+        :param max_pending_metrics: Flush once this many metrics are buffered
+        :param queue_size: The maximum number of metrics to buffer; further metrics are discarded
+        :param max_wait_time: Flush buffered metrics at least this often, in milliseconds
+        :param jitter: Random jitter applied to max_wait_time, in milliseconds
+        :param executor: The concurrent.futures executor to run uploads in. Defaults to the loop's default executor.
+        :param payload_encoder: The PayloadEncoder that turns payloads into request bodies
+        :param direct_serialization: If True and the formatter supports it, batches are serialized straight to
+            compact JSON bytes by the formatter (see T2Emitter)
+        :param max_metrics_per_request: Split payloads so that no request carries more than this many series entries
+        :param max_request_bytes: Split payloads so that no request body is bigger than this many bytes
+        :param retry_scheduler: The RetryScheduler holding payloads whose upload failed
+        :param circuit_breaker: The CircuitBreaker that stops uploads to T2 while it keeps failing. Payloads
+            flushed while the circuit is open go straight to the retry scheduler.
+        """
+        super(AsyncT2Emitter, self).__init__()
+        self.retry = retry
+        self._jitter = jitter
+        self.log = logging.getLogger(__name__)
+        self.default_metadata = metadata
+        self._endpoint = endpoint
+        if self._endpoint is None:
+            raise ValueError("You must provide a T2 endpoint")
+        self.formatter = formatter or T2Formatter()
+        self.encoder = payload_encoder if payload_encoder is not None else PayloadEncoder()
+        self._direct_serialization = (direct_serialization and hasattr(self.formatter, "encode")
+                                      and self.encoder.compact and self.encoder.json_backend == JSON_BACKEND_JSON)
+        self.max_metrics_per_request = max_metrics_per_request
+        self.max_request_bytes = max_request_bytes
+        if max_metrics_per_request is not None or max_request_bytes is not None:
+            if not hasattr(self.formatter, "encode"):
+                raise ValueError("Splitting payloads requires a formatter that can encode them")
+            self._direct_serialization = True
+        self._session = requests.Session()
+        self._session.headers.update(self.HEADERS)
+        self._session.auth = authentication_provider
+        self.request_id = request_id
+        self._executor = executor
+        self.retry_scheduler = retry_scheduler if retry_scheduler is not None else RetryScheduler()
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        self._accepting_retries = True
+
+        if mtls_client_key_file and mtls_client_cert_file:
+            if not (os.path.isfile(mtls_client_key_file) and os.path.isfile(mtls_client_cert_file)):
+                raise ValueError("Both the certificate and key must be valid files!")
+            self._session.cert = (mtls_client_cert_file, mtls_client_key_file)
+
+        if ca_cert_file:
+            self._session.verify = ca_cert_file
+
+        self.flush_size_threshold = max_pending_metrics
+        self.flush_age_threshold = max_wait_time / 1000.0
+        self._max_buffered_metrics = queue_size or self.flush_size_threshold * 10
+        self._pending = []
+        self._failed_metric_submissions = 0
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+        self._closing = False
+
+    def emit(self, metric_or_metrics, dimensions=None):
+        """
+        Buffer a metric (or metrics) for upload by the background task. This never blocks.
+        :param metric_or_metrics: The metric(s) to send
+        :param dimensions: Optional dimensions to give the metric(s), replacing their own
+        :return: None
+        """
+        set_dimensions(metric_or_metrics, dimensions)
+        if len(self._pending) >= self._max_buffered_metrics:
+            self._failed_metric_submissions += 1
+            self.log.warning("Buffer is full! Discarding metric!")
+            return
+        if isinstance(metric_or_metrics, list):
+            self._pending.extend(metric_or_metrics)
+        else:
+            self._pending.append(metric_or_metrics)
+
+        self._ensure_task()
+        if len(self._pending) >= self.flush_size_threshold:
+            self._wake()
+
+    def format(self, metric_or_metrics):
+        formatted_metrics = self.formatter.format(metric_or_metrics, default_metadata=self.default_metadata)
+        self.log.debug("Formatted metrics are %s", formatted_metrics)
+        return formatted_metrics
+
+    def encode(self, metric_or_metrics):
+        if not self._direct_serialization:
+            return self.format(metric_or_metrics)
+        return self.formatter.encode(metric_or_metrics, default_metadata=self.default_metadata,
+                                     max_metrics=self.max_metrics_per_request, max_bytes=self.max_request_bytes)
+
+    async def flush(self):
+        """
+        Upload everything that is currently buffered, and the retries that are due.
+        :return: None
+        """
+        metrics, self._pending = self._pending, []
+        if metrics:
+            self.log.debug("%d metrics have been drained from the buffer", len(metrics))
+        metrics.extend(self._self_metrics())
+        if metrics:
+            await asyncio.gather(*[self._send_or_complain(payload) for payload in self.encode(metrics)])
+        await self._send_due_retries()
+
+    async def close(self):
+        """
+        Stop the background task, upload everything that is still buffered and make a last attempt at the
+        payloads waiting for a retry.
+        :return: None
+        """
+        self._closing = True
+        if self._task is not None:
+            self._wake()
+            await self._task
+            self._task = None
+        await self.flush()
+        await self._send_pending_retries()
+
+    async def send(self, payload):
+        """
+        Make a single attempt at uploading a payload. Failed uploads are retried by _send_or_complain.
+        :param payload: The payload to send
+        :return: The response
+        """
+        body, headers = self.encoder.encode(payload)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._put, body, headers)
+
+    def _put(self, body, headers):
+        request_id = self.request_id or self.default_metadata.project + "-" + uuid4().hex
+        self.log.debug("Sending %s to T2 with request id %s", body, request_id)
+        headers = dict(headers, **{"opc-request-id": request_id})
+        resp = self._session.put(self._endpoint, data=body, headers=headers)
+        self.log.debug("Received response from T2: %s - %s", resp.headers, resp.content)
+        if resp.status_code >= 500 or resp.status_code == 429:
+            # Worth retrying, unlike a rejected payload
+            resp.raise_for_status()
+        return resp
+
+    async def _send_or_complain(self, payload, attempt=1):
+        if not self.circuit_breaker.allow():
+            self._retry_later(payload, attempt, self.circuit_breaker.time_to_probe())
+            return
+        try:
+            self.log.debug("Attempting to send payload")
+            await self.send(payload)
+        except Exception as e:
+            self.circuit_breaker.record_failure()
+            self._retry_later(payload, attempt + 1, self._retry_delay(attempt), e)
+        else:
+            self.circuit_breaker.record_success()
+
+    def _retry_later(self, payload, attempt, delay, error=None):
+        if (self.retry and attempt <= MAX_SEND_ATTEMPTS and self._accepting_retries and
+                self.retry_scheduler.schedule(payload, attempt, delay)):
+            self.log.debug("Sending to T2 failed, making attempt %d of %d in %ss", attempt, MAX_SEND_ATTEMPTS, delay)
+            return
+        if error is not None:
+            self.log.error("Encountered exception sending metrics!")
+            self.log.exception(error)
+        else:
+            self.log.error("Sends to T2 are failing and no more retries can be scheduled!")
+
+    def _retry_delay(self, attempt):
+        return min(RETRY_WAIT_MULTIPLIER * 2 ** attempt, MAX_RETRY_WAIT)
+
+    async def _send_due_retries(self):
+        due = self.retry_scheduler.pop_due()
+        if due:
+            await asyncio.gather(*[self._send_or_complain(payload, attempt) for payload, attempt in due])
+
+    async def _send_pending_retries(self):
+        # On close, make one last attempt at everything that is waiting for a retry, whatever the state of the
+        # circuit, until a send fails. What is left is dropped.
+        self._accepting_retries = False
+        error = None
+        for payload, attempt in self.retry_scheduler.pop_all():
+            if error is None:
+                try:
+                    await self.send(payload)
+                    self.circuit_breaker.record_success()
+                    continue
+                except Exception as e:
+                    self.circuit_breaker.record_failure()
+                    error = e
+            self._retry_later(payload, attempt, 0, error)
+
+    def _self_metrics(self):
+        dropped, self._failed_metric_submissions = self._failed_metric_submissions, 0
+        if not dropped:
+            return []
+        return [Metric(self.default_metadata.project + "-failed-attempts", dropped)]
+
+    def _ensure_task(self):
+        if self._task is not None or self._closing:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not called from a coroutine; the metrics stay buffered until the next flush
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    def _wake(self):
+        if self._wakeup is None:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._time_to_next_flush())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                self.log.error("Encountered exception flushing metrics!")
+                self.log.exception(e)
+
+    def _time_to_next_flush(self):
+        jitter = random.randint(-1 * abs(self._jitter), abs(self._jitter)) / 1000.0
+        wait_time = self.flush_age_threshold + jitter
+        time_to_next_retry = self.retry_scheduler.time_to_next_due()
+        if time_to_next_retry is not None:
+            wait_time = min(wait_time, time_to_next_retry)
+        return max(wait_time, MINIMUM_FLUSH_WAIT_TIME)
@@ -0,0 +1,223 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_LATENCY = 1.0  # seconds
+DEFAULT_MAX_BUFFERED_LINES = 10000
+DEFAULT_MAX_PENDING_LINES = 1000000
+# Log tap files are rotated every hour, and rotated files are named the way TimedRotatingFileHandler(when="h")
+# names them, so that whatever picks them up keeps finding them
+ROTATION_INTERVAL = 60 * 60  # seconds
+ROTATED_SUFFIX_FORMAT = "%Y-%m-%d_%H"
+
+
+class LogTapWriter(object):
+    def __init__(self, max_latency=DEFAULT_MAX_LATENCY, max_buffered_lines=DEFAULT_MAX_BUFFERED_LINES,
+                 max_pending_lines=DEFAULT_MAX_PENDING_LINES, flush_on_close=True):
+        """
+        A LogTapWriter writes lines to log tap files from a background thread. Callers append lines to an
+        in-memory buffer per file (see open), and the thread writes each file's buffer in a single write call.
+        Files are rotated hourly, like a TimedRotatingFileHandler(when="h") would.
+
+        :param max_latency: The longest a line waits in memory before the thread writes it, in seconds
+        :param max_buffered_lines: Wake the thread early once this many lines are waiting
+        :param max_pending_lines: Drop lines once this many are waiting, so that a stuck disk can't take all
+            the memory
+        :param flush_on_close: Write the lines still waiting when the writer is closed (or the interpreter
+            exits). If False, they are dropped.
+        """
+        self.max_latency = max_latency
+        self.max_buffered_lines = max_buffered_lines
+        self.max_pending_lines = max_pending_lines
+        self.flush_on_close = flush_on_close
+
+        self._files = {}
+        self._pending = 0
+        # Guards the buffers, and _io_lock the files: appending never waits for a write to finish
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._closed = False
+
+        self.lines_written = 0
+        self.batches_written = 0
+        self.lines_dropped = 0
+        self.rotations = 0
+
+    def open(self, path):
+        """
+        :param path: The path of a log tap file. It is created (or opened for appending) right away.
+        :return: The LogTapFile to write lines to. Opening the same path twice returns the same LogTapFile.
+        """
+        with self._lock:
+            log_tap_file = self._files.get(path)
+            if log_tap_file is None:
+                log_tap_file = LogTapFile(self, path)
+                self._files[path] = log_tap_file
+        return log_tap_file
+
+    def _append(self, log_tap_file, line):
+        if self._thread_pid != os.getpid():
+            self._ensure_thread()
+        with self._lock:
+            if self._pending >= self.max_pending_lines:
+                self.lines_dropped += 1
+                return
+            log_tap_file.lines.append(line)
+            self._pending += 1
+            pending = self._pending
+        if self._closed:
+            # There's no thread left to write it
+            self.flush()
+        elif pending >= self.max_buffered_lines:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._thread_pid == pid or self._closed:
+                return
+            if self._thread_pid is not None:
+                # We're in a forked child: what was buffered before the fork is the parent's to write, and
+                # a lock held by another thread at fork time would never be released here
+                self._io_lock = threading.Lock()
+                self._wakeup = threading.Event()
+                for log_tap_file in self._files.values():
+                    log_tap_file.lines = []
+                self._pending = 0
+            else:
+                atexit.register(self.close)
+            self._thread = threading.Thread(target=self._run, name="log-tap-writer")
+            self._thread.daemon = True
+            self._thread.start()
+            self._thread_pid = pid
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.max_latency)
+            self._wakeup.clear()
+            if self._closed:
+                break
+            self.flush()
+
+    def flush(self):
+        """
+        Write every line waiting in memory
+        :return: None
+        """
+        with self._io_lock:
+            with self._lock:
+                batches = [(log_tap_file, log_tap_file.lines) for log_tap_file in self._files.values()
+                           if log_tap_file.lines]
+                for log_tap_file, _ in batches:
+                    log_tap_file.lines = []
+                self._pending = 0
+            now = time.time()
+            for log_tap_file, lines in batches:
+                try:
+                    log_tap_file.write_batch(lines, now)
+                except Exception:
+                    logger.exception("Failed to write %d lines to %s", len(lines), log_tap_file.path)
+                    self.lines_dropped += len(lines)
+                    continue
+                self.lines_written += len(lines)
+                self.batches_written += 1
+
+    def close(self):
+        """
+        Stop the writer thread, write what's waiting (if flush_on_close) and close every file
+        :return: None
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join()
+        if not self.flush_on_close:
+            with self._lock:
+                for log_tap_file in self._files.values():
+                    self.lines_dropped += len(log_tap_file.lines)
+                    log_tap_file.lines = []
+                self._pending = 0
+        self.flush()
+        with self._io_lock:
+            for log_tap_file in self._files.values():
+                log_tap_file.close()
+
+    def stats(self):
+        """
+        :return: A dict of counters describing the lines written so far
+        """
+        return {
+            "linesPending": self._pending,
+            "linesWritten": self.lines_written,
+            "batchesWritten": self.batches_written,
+            "linesDropped": self.lines_dropped,
+            "rotations": self.rotations,
+        }
+
+
+class LogTapFile(object):
+    def __init__(self, writer, path):
+        """
+        A log tap file, and the lines waiting to be written to it. Use LogTapWriter.open to get one.
+        :param writer: The LogTapWriter that writes this file
+        :param path: The path of the file
+        """
+        self.writer = writer
+        self.path = path
+        self.lines = []
+        self._stream = None
+        self._rollover_at = None
+        self._open()
+
+    def write(self, line):
+        """
+        Queue a line (without its trailing newline) to be written by the writer thread
+        :param line: The line to write
+        :return: None
+        """
+        self.writer._append(self, line)
+
+    def write_batch(self, lines, now):
+        # Called by the writer with its _io_lock held
+        if self._stream is None:
+            self._open()
+        if now >= self._rollover_at:
+            self._rotate(now)
+        self._stream.write("\n".join(lines) + "\n")
+        self._stream.flush()
+
+    def _open(self):
+        # Like TimedRotatingFileHandler, an existing file is rotated an interval after it was last modified
+        if os.path.exists(self.path):
+            started = os.stat(self.path).st_mtime
+        else:
+            started = time.time()
+        self._stream = open(self.path, "a")
+        self._rollover_at = int(started) + ROTATION_INTERVAL
+
+    def _rotate(self, now):
+        self._stream.close()
+        self._stream = None
+        rotated_path = "{}.{}".format(
+            self.path, time.strftime(ROTATED_SUFFIX_FORMAT, time.localtime(self._rollover_at - ROTATION_INTERVAL)))
+        if os.path.exists(rotated_path):
+            os.remove(rotated_path)
+        if os.path.exists(self.path):
+            os.rename(self.path, rotated_path)
+        self._stream = open(self.path, "a")
+        self._rollover_at = int(now) + ROTATION_INTERVAL
+        self.writer.rotations += 1
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
@@ -0,0 +1,154 @@
+try:  # pragma: nocover
+    import orjson
+except ImportError:  # pragma: nocover
+    orjson = None
+
+try:  # pragma: nocover
+    import ujson
+except ImportError:  # pragma: nocover
+    ujson = None
+
+import json
+import logging
+import threading
+import timeit
+import zlib
+
+from ..profiling import STAGE_COMPRESS, STAGE_JSON
+
+logger = logging.getLogger(__name__)
+
+JSON_BACKEND_JSON = "json"
+JSON_BACKEND_ORJSON = "orjson"
+JSON_BACKEND_UJSON = "ujson"
+JSON_BACKEND_AUTO = "auto"
+JSON_BACKENDS = (JSON_BACKEND_JSON, JSON_BACKEND_ORJSON, JSON_BACKEND_UJSON, JSON_BACKEND_AUTO)
+
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_DEFLATE = "deflate"
+COMPRESSIONS = (None, COMPRESSION_GZIP, COMPRESSION_DEFLATE)
+
+DEFAULT_COMPRESSION_THRESHOLD = 1024  # bytes
+DEFAULT_COMPRESSION_LEVEL = 6
+
+
+class PayloadEncoder(object):
+    def __init__(self, compact=True, compression=None, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+                 compression_level=DEFAULT_COMPRESSION_LEVEL, json_backend=JSON_BACKEND_JSON):
+        """
+        A PayloadEncoder turns formatted payloads into request bodies, and keeps track of how
+        many bytes went on the wire and how long encoding took. This class is thread-safe.
+
+        :param compact: Serialize without whitespace after separators
+        :param compression: None, "gzip" or "deflate". Compressed bodies are sent with a Content-Encoding header.
+        :param compression_threshold: Only compress bodies of at least this many bytes
+        :param compression_level: The zlib compression level (1-9)
+        :param json_backend: "json", "orjson", "ujson", or "auto" to use the fastest one that is installed.
+            orjson and ujson always produce compact output.
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError("compression must be one of {}".format(COMPRESSIONS))
+        if json_backend not in JSON_BACKENDS:
+            raise ValueError("json_backend must be one of {}".format(JSON_BACKENDS))
+        self.compact = compact
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+        self.json_backend = self._resolve_backend(json_backend)
+        self._separators = (',', ':') if compact else None
+
+        self._lock = threading.Lock()
+        self.payloads_encoded = 0
+        self.payloads_compressed = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.encode_seconds = 0.0
+        self.last_raw_bytes = 0
+        self.last_wire_bytes = 0
+        self.last_encode_seconds = 0.0
+
+    @staticmethod
+    def _resolve_backend(json_backend):
+        if json_backend == JSON_BACKEND_AUTO:
+            if orjson is not None:
+                return JSON_BACKEND_ORJSON
+            if ujson is not None:
+                return JSON_BACKEND_UJSON
+            return JSON_BACKEND_JSON
+        if json_backend == JSON_BACKEND_ORJSON and orjson is None:
+            raise ValueError("The orjson JSON backend is not installed")
+        if json_backend == JSON_BACKEND_UJSON and ujson is None:
+            raise ValueError("The ujson JSON backend is not installed")
+        return json_backend
+
+    def dumps(self, payload):
+        """
+        Serialize a payload to JSON bytes, without compressing it
+        :param payload: A formatted payload, or bytes that have already been serialized
+        :return: bytes
+        """
+        if isinstance(payload, bytes):
+            return payload
+        if self.json_backend == JSON_BACKEND_ORJSON:
+            return orjson.dumps(payload)
+        if self.json_backend == JSON_BACKEND_UJSON:
+            return ujson.dumps(payload).encode('utf-8')
+        return json.dumps(payload, separators=self._separators).encode('utf-8')
+
+    def encode(self, payload, profile=None):
+        """
+        Serialize (and possibly compress) a payload into a request body
+        :param payload: A formatted payload, or bytes that have already been serialized
+        :param profile: An optional SendProfile to record the serialization and compression times and the body
+            sizes in
+        :return: A tuple of (body bytes, dict of extra request headers)
+        """
+        start = timeit.default_timer()
+        raw = self.dumps(payload)
+        body, headers = raw, {}
+        if profile is not None:
+            serialized = timeit.default_timer()
+            profile.record(STAGE_JSON, serialized - start)
+        if self.compression is not None and len(raw) >= self.compression_threshold:
+            body = self._compress(raw)
+            headers["Content-Encoding"] = self.compression
+        elapsed = timeit.default_timer() - start
+        if profile is not None:
+            profile.record(STAGE_COMPRESS, start + elapsed - serialized)
+            profile.raw_bytes = len(raw)
+            profile.wire_bytes = len(body)
+
+        with self._lock:
+            self.payloads_encoded += 1
+            if headers:
+                self.payloads_compressed += 1
+            self.raw_bytes += len(raw)
+            self.wire_bytes += len(body)
+            self.encode_seconds += elapsed
+            self.last_raw_bytes = len(raw)
+            self.last_wire_bytes = len(body)
+            self.last_encode_seconds = elapsed
+        return body, headers
+
+    def _compress(self, raw):
+        if self.compression == COMPRESSION_GZIP:
+            compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            compressor = zlib.compressobj(self.compression_level)
+        return compressor.compress(raw) + compressor.flush()
+
+    def stats(self):
+        """
+        :return: A dict of counters describing the payloads encoded so far
+        """
+        with self._lock:
+            return {
+                "payloadsEncoded": self.payloads_encoded,
+                "payloadsCompressed": self.payloads_compressed,
+                "rawBytes": self.raw_bytes,
+                "wireBytes": self.wire_bytes,
+                "encodeSeconds": self.encode_seconds,
+                "lastRawBytes": self.last_raw_bytes,
+                "lastWireBytes": self.last_wire_bytes,
+                "lastEncodeSeconds": self.last_encode_seconds,
+            }
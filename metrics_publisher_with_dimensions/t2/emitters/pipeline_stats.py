@@ -0,0 +1,170 @@
+import multiprocessing
+import threading
+
+METRICS_EMITTED = "metricsEmitted"
+METRICS_DROPPED = "metricsDropped"
+METRICS_SPILLED = "metricsSpilled"
+FLUSHES = "flushes"
+PAYLOADS_SENT = "payloadsSent"
+PAYLOADS_FAILED = "payloadsFailed"
+BYTES_SENT = "bytesSent"
+RETRIES_SCHEDULED = "retriesScheduled"
+COUNTERS = (METRICS_EMITTED, METRICS_DROPPED, METRICS_SPILLED, FLUSHES, PAYLOADS_SENT, PAYLOADS_FAILED, BYTES_SENT,
+            RETRIES_SCHEDULED)
+
+QUEUE_DEPTH_HIGH_WATER = "queueDepthHighWater"
+HIGH_WATER_MARKS = (QUEUE_DEPTH_HIGH_WATER,)
+
+METRICS_PER_FLUSH = "metricsPerFlush"
+FORMAT_SECONDS = "formatSeconds"
+ENCODE_SECONDS = "encodeSeconds"
+HTTP_SECONDS = "httpSeconds"
+HISTOGRAMS = (METRICS_PER_FLUSH, FORMAT_SECONDS, ENCODE_SECONDS, HTTP_SECONDS)
+
+# Each histogram takes four slots: count, sum, min, max
+_HISTOGRAM_SLOTS = 4
+# Shared stats have a slice for the process that creates them and one for its flusher process
+_SHARED_SLICES = 2
+
+
+class PipelineStats(object):
+    def __init__(self, shared=False):
+        """
+        PipelineStats are the counters, high-water marks and histograms an emitter keeps about itself: how
+        many metrics went in, how many were dropped, how big and how slow flushes and requests were. Every
+        update is a single write into a flat array, so they are cheap enough for the emit path.
+
+        Histograms keep the count, sum, min and max of the observed values. Counters and histograms also
+        remember how much of them has already been reported (see unreported), so that whichever process
+        reports next only reports what is new.
+
+        :param shared: Keep the values in shared memory, so that updates made by a forked flusher
+            process are visible to its parent. Must be created before forking. The flusher process then
+            calls use_own_slice() before it updates anything.
+        """
+        self._index = {}
+        size = 0
+        for name in COUNTERS + HIGH_WATER_MARKS:
+            self._index[name] = size
+            size += 1
+        for name in HISTOGRAMS:
+            self._index[name] = size
+            size += _HISTOGRAM_SLOTS
+        # The reported part of a counter, or the reported count and sum of a histogram
+        self._reported_index = {}
+        for name in COUNTERS:
+            self._reported_index[name] = size
+            size += 1
+        for name in HISTOGRAMS:
+            self._reported_index[name] = size
+            size += 2
+
+        # Every process writes to its own slice of the values and reads combine the slices. Updates only need
+        # a lock between the threads of a process: a lock shared with the flusher process would be left held
+        # forever if that process were terminated while updating.
+        self._slice_size = size
+        if shared:
+            self._values = multiprocessing.RawArray('d', size * _SHARED_SLICES)
+            self._offsets = tuple(range(0, size * _SHARED_SLICES, size))
+        else:
+            self._values = [0.0] * size
+            self._offsets = (0,)
+        self._offset = 0
+        self._lock = threading.Lock()
+        for offset in self._offsets:
+            for name in HISTOGRAMS:
+                self._values[offset + self._index[name] + 2] = float('inf')
+
+    def use_own_slice(self):
+        """
+        Make every later update from this process go to the flusher process's slice of shared stats. Must
+        be called by the forked flusher process before it updates anything.
+        :return: None
+        """
+        if len(self._offsets) < 2:
+            raise ValueError("Only shared PipelineStats have a slice for a flusher process")
+        self._offset = self._offsets[1]
+        # A thread of the parent may have held the lock when the flusher process was forked
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1):
+        i = self._offset + self._index[name]
+        with self._lock:
+            self._values[i] += amount
+
+    def record_high_water(self, name, value):
+        i = self._offset + self._index[name]
+        with self._lock:
+            if value > self._values[i]:
+                self._values[i] = value
+
+    def observe(self, name, value):
+        i = self._offset + self._index[name]
+        values = self._values
+        with self._lock:
+            values[i] += 1
+            values[i + 1] += value
+            if value < values[i + 2]:
+                values[i + 2] = value
+            if value > values[i + 3]:
+                values[i + 3] = value
+
+    def get(self, name):
+        return self._combine(list(self._values), name)
+
+    def unreported(self, name):
+        """
+        Mark a counter or histogram as reported up to its current value
+        :param name: A counter or histogram name
+        :return: For a counter, how much it grew since the last call. For a histogram, the (count, sum) of
+            the values observed since the last call.
+        """
+        i = self._index[name]
+        r = self._reported_index[name]
+        values = self._values
+        own = self._offset + r
+        with self._lock:
+            # What this process reports is added to the reported part of its own slice, so that the reported
+            # parts of all slices together are what has been reported by any process
+            if name in HISTOGRAMS:
+                delta = (self._sum(i) - self._sum(r), self._sum(i + 1) - self._sum(r + 1))
+                values[own] += delta[0]
+                values[own + 1] += delta[1]
+            else:
+                delta = self._sum(i) - self._sum(r)
+                values[own] += delta
+        return delta
+
+    def snapshot(self):
+        """
+        :return: A dict of every counter and high-water mark, and a dict of count/sum/min/max/mean per histogram
+        """
+        values = list(self._values)
+        result = {}
+        for name in COUNTERS + HIGH_WATER_MARKS:
+            result[name] = int(self._combine(values, name))
+        for name in HISTOGRAMS:
+            count, total, minimum, maximum = self._combine(values, name)
+            result[name] = {
+                "count": int(count),
+                "sum": total,
+                "min": minimum if count else None,
+                "max": maximum if count else None,
+                "mean": total / count if count else None,
+            }
+        return result
+
+    def _sum(self, i):
+        values = self._values
+        return sum(values[offset + i] for offset in self._offsets)
+
+    def _combine(self, values, name):
+        i = self._index[name]
+        if name in HIGH_WATER_MARKS:
+            return max(values[offset + i] for offset in self._offsets)
+        if name in HISTOGRAMS:
+            return (sum(values[offset + i] for offset in self._offsets),
+                    sum(values[offset + i + 1] for offset in self._offsets),
+                    min(values[offset + i + 2] for offset in self._offsets),
+                    max(values[offset + i + 3] for offset in self._offsets))
+        return sum(values[offset + i] for offset in self._offsets)
@@ -0,0 +1,195 @@
+import heapq
+import itertools
+import logging
+import threading
+
+import monotonic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PENDING_RETRIES = 1000
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0  # seconds
+# How long sends wait while a probe is deciding whether the circuit closes
+PROBE_WAIT = 1.0  # seconds
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending while the circuit to T2 is open
+    """
+
+
+class RetryScheduler(object):
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING_RETRIES):
+        """
+        A RetryScheduler holds payloads that are waiting to be sent again, ordered by the time they are due.
+        Nothing here sleeps: whoever flushes the emitter asks for the payloads that are due and sends them
+        alongside new ones. This class is thread-safe.
+
+        :param max_pending: The maximum number of payloads waiting for a retry. Payloads scheduled beyond
+            this are refused.
+        """
+        self.max_pending = max_pending
+        self._heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+        self.scheduled = 0
+        self.dispatched = 0
+        self.refused = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, payload, attempt, delay):
+        """
+        :param payload: The payload to send again
+        :param attempt: The number of the attempt that will be made when it is due
+        :param delay: How long from now the payload is due, in seconds
+        :return: True if the payload was scheduled, False if the scheduler is full
+        """
+        with self._lock:
+            if len(self._heap) >= self.max_pending:
+                self.refused += 1
+                return False
+            # The sequence number keeps payloads due at the same time in order and never compares payloads
+            heapq.heappush(self._heap, (monotonic.monotonic() + delay, next(self._sequence), payload, attempt))
+            self.scheduled += 1
+        return True
+
+    def pop_due(self):
+        """
+        :return: A list of (payload, attempt) tuples for every payload that is due
+        """
+        now = monotonic.monotonic()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, payload, attempt = heapq.heappop(self._heap)
+                due.append((payload, attempt))
+            self.dispatched += len(due)
+        return due
+
+    def pop_all(self):
+        """
+        :return: A list of (payload, attempt) tuples for every scheduled payload, due or not
+        """
+        with self._lock:
+            entries, self._heap = sorted(self._heap), []
+            self.dispatched += len(entries)
+        return [(payload, attempt) for _, _, payload, attempt in entries]
+
+    def time_to_next_due(self):
+        """
+        :return: Seconds until the next payload is due (0 if one is already due), or None if nothing is scheduled
+        """
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(self._heap[0][0] - monotonic.monotonic(), 0.0)
+
+    def stats(self):
+        """
+        :return: A dict of counters describing the retries scheduled so far
+        """
+        return {
+            "retriesPending": len(self._heap),
+            "retriesScheduled": self.scheduled,
+            "retriesDispatched": self.dispatched,
+            "retriesRefused": self.refused,
+        }
+
+
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        """
+        A CircuitBreaker stops sends to an endpoint that keeps failing. After failure_threshold consecutive
+        failures the circuit opens, and allow() refuses every send for reset_timeout seconds. Then a single
+        probe is let through: if it succeeds the circuit closes again, otherwise it stays open for another
+        reset_timeout. This class is thread-safe.
+
+        :param failure_threshold: How many consecutive failures open the circuit
+        :param reset_timeout: How long the circuit stays open before a probe is let through, in seconds
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT_CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self.probes = 0
+
+    def allow(self):
+        """
+        :return: True if a send may be attempted now
+        """
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return True
+            if self.state == CIRCUIT_OPEN and monotonic.monotonic() >= self._opened_at + self.reset_timeout:
+                self.state = CIRCUIT_HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == CIRCUIT_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self.probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self._consecutive_failures = 0
+            if self.state != CIRCUIT_CLOSED:
+                logger.info("T2 is reachable again, closing the circuit")
+            self.state = CIRCUIT_CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            if self.state == CIRCUIT_HALF_OPEN or (self.state == CIRCUIT_CLOSED and
+                                                   self._consecutive_failures >= self.failure_threshold):
+                if self.state == CIRCUIT_CLOSED:
+                    logger.warning("%d consecutive sends to T2 failed, opening the circuit for %ss",
+                                   self._consecutive_failures, self.reset_timeout)
+                self.state = CIRCUIT_OPEN
+                self._opened_at = monotonic.monotonic()
+                self._probe_in_flight = False
+                self.opened += 1
+
+    def time_to_probe(self):
+        """
+        :return: Seconds until the circuit may let a send through, 0 if it is closed
+        """
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return 0.0
+            if self.state == CIRCUIT_HALF_OPEN:
+                return PROBE_WAIT
+            return max(self._opened_at + self.reset_timeout - monotonic.monotonic(), 0.0)
+
+    def stats(self):
+        """
+        :return: A dict of counters describing the sends seen so far
+        """
+        return {
+            "circuitState": self.state,
+            "sendSuccesses": self.successes,
+            "sendFailures": self.failures,
+            "sendsRejected": self.rejected,
+            "circuitOpened": self.opened,
+            "circuitProbes": self.probes,
+        }
@@ -0,0 +1,357 @@
+try:  # pragma: nocover
+    import fcntl
+except ImportError:  # pragma: nocover
+    # Not available on Windows; replays are then not serialized across processes
+    fcntl = None
+
+import errno
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+import monotonic
+
+from ..models.metric import epoch_millis
+
+logger = logging.getLogger(__name__)
+
+# Every frame is: payload length, crc32 of the payload, epoch milliseconds it was spilled at, payload
+FRAME_HEADER = struct.Struct(">IIQ")
+
+SEGMENT_PREFIX = "spill-"
+OPEN_SEGMENT_SUFFIX = ".open"
+SEALED_SEGMENT_SUFFIX = ".seg"
+CURSOR_SUFFIX = ".cursor"
+REPLAY_LOCK_FILE_NAME = "replay.lock"
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 60 * 60  # seconds
+DEFAULT_SEGMENT_BYTES = 4 * 1024 * 1024
+DEFAULT_SEGMENT_AGE = 30  # seconds
+DEFAULT_FSYNC_INTERVAL = 1.0  # seconds
+DEFAULT_FSYNC_BYTES = 1024 * 1024
+
+
+class SpillStore(object):
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE,
+                 segment_bytes=DEFAULT_SEGMENT_BYTES, segment_age=DEFAULT_SEGMENT_AGE,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL, fsync_bytes=DEFAULT_FSYNC_BYTES):
+        """
+        A SpillStore is an append-only queue of request bodies on local disk, used to hold on to
+        payloads that could not be sent (or buffered) until T2 is reachable again.
+
+        Bodies are appended as checksummed frames to a segment file owned by the writing process, so
+        that a forked flusher and its parent can spill into the same directory. Writes are fsync'd in
+        batches: at most every fsync_interval seconds or fsync_bytes bytes, and whenever a segment is
+        sealed. A segment is sealed once it reaches segment_bytes or segment_age seconds, and only
+        sealed segments are replayed. Replay reads segments through mmap, oldest first, and records its
+        progress in a cursor file next to the segment so a crash replays at most one body twice.
+
+        When the store would grow past max_bytes, the oldest sealed segments are discarded. Bodies
+        older than max_age seconds are discarded instead of being replayed.
+
+        This class is thread-safe.
+
+        :param directory: The directory to keep segments in. It is created if it doesn't exist.
+        :param max_bytes: The maximum size of all segments together
+        :param max_age: The maximum age of a spilled body, in seconds
+        :param segment_bytes: Seal a segment once it is this big
+        :param segment_age: Seal a segment once it is this old, in seconds
+        :param fsync_interval: The longest time appended bodies may go without being fsync'd, in seconds
+        :param fsync_bytes: fsync once this many bytes have been appended since the last fsync
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.fsync_interval = fsync_interval
+        self.fsync_bytes = fsync_bytes
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._segment_path = None
+        self._segment_size = 0
+        self._segment_opened = 0
+        self._sequence = 0
+        self._unsynced_bytes = 0
+        self._last_sync = monotonic.monotonic()
+        self._total_bytes = self._disk_usage()
+
+        self.frames_spilled = 0
+        self.frames_replayed = 0
+        self.frames_discarded = 0
+        self.segments_evicted = 0
+
+    def append(self, body):
+        """
+        Spill a request body
+        :param body: bytes
+        :return: True if the body was stored, False if it was discarded because the store is full
+        """
+        frame = FRAME_HEADER.pack(len(body), zlib.crc32(body) & 0xffffffff, epoch_millis()) + body
+        with self._lock:
+            if self._total_bytes + len(frame) > self.max_bytes:
+                self._total_bytes = self._disk_usage()
+                self._evict(len(frame))
+                if self._total_bytes + len(frame) > self.max_bytes:
+                    self.frames_discarded += 1
+                    logger.warning("Spill store %s is full! Discarding payload!", self.directory)
+                    return False
+            self._ensure_segment()
+            self._file.write(frame)
+            self._segment_size += len(frame)
+            self._total_bytes += len(frame)
+            self._unsynced_bytes += len(frame)
+            self.frames_spilled += 1
+            if (self._unsynced_bytes >= self.fsync_bytes or
+                    monotonic.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+            if self._segment_size >= self.segment_bytes:
+                self._seal()
+        return True
+
+    def seal_if_stale(self):
+        """
+        Seal this process's segment if it is old enough, so that it can be replayed
+        :return: None
+        """
+        if self._file is None or monotonic.monotonic() - self._segment_opened < self.segment_age:
+            return
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._seal()
+
+    def close(self):
+        """
+        Seal this process's segment
+        :return: None
+        """
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._seal()
+
+    def replay(self, send, max_bodies=None):
+        """
+        Hand sealed bodies to send(), oldest first, until the store is empty, send() raises, or
+        max_bodies have been sent. A body is only removed from the store once send() has returned;
+        if send() raises, the body is kept and replay stops until the next call. If another process
+        is already replaying, this does nothing.
+
+        :param send: A callable taking a body (bytes)
+        :param max_bodies: The maximum number of bodies to send, or None
+        :return: The number of bodies sent
+        """
+        self.seal_if_stale()
+        lock_file = self._try_lock_replay()
+        if lock_file is None:
+            return 0
+        sent = 0
+        try:
+            self._adopt_orphaned_segments()
+            for path in self._sealed_segments():
+                remaining = None if max_bodies is None else max_bodies - sent
+                if remaining == 0:
+                    break
+                replayed, finished = self._replay_segment(path, send, remaining)
+                sent += replayed
+                if not finished:
+                    break
+        finally:
+            self._unlock_replay(lock_file)
+        return sent
+
+    def stats(self):
+        """
+        :return: A dict of counters describing this store
+        """
+        return {
+            "spillBytes": self._total_bytes,
+            "framesSpilled": self.frames_spilled,
+            "framesReplayed": self.frames_replayed,
+            "framesDiscarded": self.frames_discarded,
+            "segmentsEvicted": self.segments_evicted,
+        }
+
+    def _ensure_segment(self):
+        # Must be called with self._lock held
+        pid = os.getpid()
+        if self._pid != pid:
+            # A forked child never writes to (or seals) its parent's segment
+            self._file = None
+            self._pid = pid
+        if self._file is not None and monotonic.monotonic() - self._segment_opened >= self.segment_age:
+            self._seal()
+        if self._file is None:
+            self._sequence += 1
+            # Zero-padded, so that segment names sort oldest first
+            name = "{}{:013d}-{}-{:06d}{}".format(SEGMENT_PREFIX, epoch_millis(), pid, self._sequence,
+                                                 OPEN_SEGMENT_SUFFIX)
+            self._segment_path = os.path.join(self.directory, name)
+            # Unbuffered, so each frame is a single append and a forked child never holds unwritten bytes
+            self._file = open(self._segment_path, "ab", 0)
+            self._segment_size = 0
+            self._segment_opened = monotonic.monotonic()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced_bytes = 0
+        self._last_sync = monotonic.monotonic()
+
+    def _seal(self):
+        # Must be called with self._lock held
+        self._sync()
+        self._file.close()
+        self._file = None
+        os.rename(self._segment_path, self._segment_path[:-len(OPEN_SEGMENT_SUFFIX)] + SEALED_SEGMENT_SUFFIX)
+
+    def _segment_names(self):
+        return sorted(n for n in os.listdir(self.directory) if n.startswith(SEGMENT_PREFIX))
+
+    def _sealed_segments(self):
+        return [os.path.join(self.directory, n) for n in self._segment_names() if n.endswith(SEALED_SEGMENT_SUFFIX)]
+
+    def _adopt_orphaned_segments(self):
+        # Seal the segments of processes that died without sealing them, e.g. a terminated flusher process
+        for name in self._segment_names():
+            if not name.endswith(OPEN_SEGMENT_SUFFIX):
+                continue
+            try:
+                pid = int(name[len(SEGMENT_PREFIX):].split("-")[1])
+            except (IndexError, ValueError):
+                continue
+            if pid == os.getpid() or _process_exists(pid):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                os.rename(path, path[:-len(OPEN_SEGMENT_SUFFIX)] + SEALED_SEGMENT_SUFFIX)
+            except OSError:
+                pass
+
+    def _disk_usage(self):
+        total = 0
+        for name in self._segment_names():
+            try:
+                total += os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                pass  # Replayed and removed by another process
+        return total
+
+    def _evict(self, needed):
+        # Must be called with self._lock held. Discards the oldest sealed segments until needed bytes fit.
+        for path in self._sealed_segments():
+            if self._total_bytes + needed <= self.max_bytes:
+                return
+            try:
+                size = os.path.getsize(path)
+                self._remove_segment(path)
+            except OSError:
+                continue
+            self._total_bytes -= size
+            self.segments_evicted += 1
+            logger.warning("Spill store %s is full! Discarded segment %s (%d bytes)", self.directory, path, size)
+
+    def _remove_segment(self, path):
+        os.remove(path)
+        try:
+            os.remove(path + CURSOR_SUFFIX)
+        except OSError:
+            pass
+
+    def _replay_segment(self, path, send, max_bodies):
+        """
+        :return: A tuple of (bodies sent, whether the segment was fully replayed)
+        """
+        offset = self._read_cursor(path)
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size <= offset:
+                    self._remove_segment(path)
+                    return 0, True
+                segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError):
+            return 0, True  # Replayed and removed by another process
+
+        sent = 0
+        oldest = epoch_millis() - self.max_age * 1000
+        try:
+            while offset + FRAME_HEADER.size <= size:
+                length, checksum, spilled_at = FRAME_HEADER.unpack_from(segment, offset)
+                end = offset + FRAME_HEADER.size + length
+                body = segment[offset + FRAME_HEADER.size:end]
+                if length == 0 or end > size or zlib.crc32(body) & 0xffffffff != checksum:
+                    logger.warning("Spill segment %s is corrupt after offset %d, discarding the rest", path, offset)
+                    self.frames_discarded += 1
+                    break
+                if spilled_at < oldest:
+                    self.frames_discarded += 1
+                else:
+                    if max_bodies is not None and sent >= max_bodies:
+                        self._write_cursor(path, offset)
+                        return sent, False
+                    try:
+                        send(body)
+                    except Exception as e:
+                        logger.debug("Replaying spilled payload failed, will retry later: %s", e)
+                        self._write_cursor(path, offset)
+                        return sent, False
+                    sent += 1
+                    self.frames_replayed += 1
+                offset = end
+                self._write_cursor(path, offset)
+        finally:
+            segment.close()
+        self._remove_segment(path)
+        with self._lock:
+            self._total_bytes = max(0, self._total_bytes - size)
+        return sent, True
+
+    def _read_cursor(self, path):
+        try:
+            with open(path + CURSOR_SUFFIX, "r") as f:
+                return int(f.read() or 0)
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def _write_cursor(self, path, offset):
+        tmp = path + CURSOR_SUFFIX + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+        os.rename(tmp, path + CURSOR_SUFFIX)
+
+    def _try_lock_replay(self):
+        lock_file = open(os.path.join(self.directory, REPLAY_LOCK_FILE_NAME), "a")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _unlock_replay(self, lock_file):
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def _process_exists(pid):
+    if os.name != "posix":
+        # os.kill() would terminate the process rather than probe it
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
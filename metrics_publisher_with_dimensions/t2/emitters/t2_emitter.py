@@ -4,24 +4,50 @@ except ImportError:  # pragma: nocover
     # Python 3.5
     from queue import Full, Empty
 
+try:  # pragma: nocover
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # pragma: nocover
+    # Python 2 without the futures backport
+    ThreadPoolExecutor = None
+
 import datetime
+import inspect
 from uuid import uuid4
 import os.path
-import json
 import logging
 import multiprocessing
 import random
+import threading
+import time
+import timeit
 
 import requests
-from retrying import retry as backoff
+from requests.adapters import HTTPAdapter
 
 from .base_emitter import BaseEmitter
+from .payload_encoder import PayloadEncoder, JSON_BACKEND_JSON
+from .pipeline_stats import (PipelineStats, BYTES_SENT, ENCODE_SECONDS, FLUSHES, FORMAT_SECONDS, HTTP_SECONDS,
+                             METRICS_DROPPED, METRICS_EMITTED, METRICS_PER_FLUSH, METRICS_SPILLED, PAYLOADS_FAILED,
+                             PAYLOADS_SENT, QUEUE_DEPTH_HIGH_WATER, RETRIES_SCHEDULED)
+from .retry_scheduler import CircuitBreaker, CircuitOpenError, RetryScheduler
 from ..formatters import T2Formatter
-from ..models import Metric
+from ..models import ColumnarBatch, ColumnarMetricBuffer, DeltaCounterMetric, GaugeMetric, Metric, TimerMetric
+from ..models.metric import set_dimensions
+from ..profiling import FlushProfile, SendProfile, STAGE_HTTP, STAGE_SIGN
 
 logger = logging.getLogger(__name__)
 
 MINIMUM_QUEUE_WAIT_TIME = 3  # seconds
+MINIMUM_THREAD_WAIT_TIME = 0.01  # seconds
+CLOSE_DRAIN_TIMEOUT = 5  # seconds
+
+FLUSHER_MODE_PROCESS = "process"
+FLUSHER_MODE_THREAD = "thread"
+FLUSHER_MODES = (FLUSHER_MODE_PROCESS, FLUSHER_MODE_THREAD)
+DEFAULT_SPILL_REPLAY_BATCH = 100
+MAX_SEND_ATTEMPTS = 7
+RETRY_WAIT_MULTIPLIER = 1.0  # seconds
+MAX_RETRY_WAIT = 10.0  # seconds
 
 
 class T2Emitter(BaseEmitter):
@@ -46,11 +72,62 @@ class T2Emitter(BaseEmitter):
             mtls_client_key_file=None,
             flusher=None,
             authentication_provider=None,
-            ca_cert_file=None):
+            ca_cert_file=None,
+            columnar_buffer=False,
+            flusher_mode=FLUSHER_MODE_PROCESS,
+            max_concurrent_sends=1,
+            payload_encoder=None,
+            direct_serialization=True,
+            max_metrics_per_request=None,
+            max_request_bytes=None,
+            spill_store=None,
+            spill_replay_batch=DEFAULT_SPILL_REPLAY_BATCH,
+            retry_scheduler=None,
+            circuit_breaker=None,
+            self_telemetry=False,
+            profiling_hooks=None):
         """
 
         :param metadata:
         :param request_id:
+        :param columnar_buffer: If True, pending metrics are held column-wise in a ColumnarMetricBuffer
+            and handed to the flusher as one compact batch instead of one object per metric. In "process"
+            flusher mode the batch is handed to the watcher process once it reaches the batch size or age
+            threshold, by a daemon thread of this process if no emit comes along to do it.
+        :param flusher_mode: How metrics are flushed when not running synchronously.
+            "process" (the default) forks a watcher process at construction and hands metrics to it
+            through a multiprocessing.Queue. "thread" keeps metrics in memory and flushes them from a
+            daemon thread in this process, which is started lazily on the first emit and woken when the
+            batch size or age threshold is reached.
+        :param max_concurrent_sends: How many payloads of a single flush may be uploaded concurrently over the
+            pooled session. Each payload is still sent, retried and logged independently.
+        :param payload_encoder: The PayloadEncoder that turns payloads into request bodies (JSON backend,
+            compaction and compression). Its stats() report bytes on the wire and encode time.
+        :param direct_serialization: If True and the formatter supports it, flushed batches are serialized straight
+            to compact JSON bytes by the formatter instead of being built as dicts and passed through json.dumps.
+            Only used with a compact encoder on the standard json backend, whose output it matches byte for byte.
+        :param max_metrics_per_request: Split payloads so that no request carries more than this many series
+            entries. None means no limit.
+        :param max_request_bytes: Split payloads so that no request body is bigger than this many bytes (before
+            compression). None means no limit. Each request is sent and retried on its own. Splitting needs the
+            formatter to serialize payloads itself, so when a limit is set bodies are always compact JSON
+            written by the formatter, whatever the encoder's JSON backend.
+        :param spill_store: An optional SpillStore. Payloads that still fail after retrying, and metrics that
+            don't fit in the buffer, are spilled to it instead of being dropped, and are replayed from it as
+            part of later flushes.
+        :param spill_replay_batch: The maximum number of spilled payloads to replay per flush
+        :param retry_scheduler: The RetryScheduler holding payloads whose send failed. A failed payload is sent
+            again by a later flush (or synchronous emit) once its exponential backoff has passed, so retries
+            never block the flusher or the caller.
+        :param circuit_breaker: The CircuitBreaker that stops sends to T2 while it keeps failing. Payloads
+            flushed while the circuit is open go straight to the retry scheduler (or the spill store).
+        :param self_telemetry: If True, every flush also sends metrics about the emitter itself (metrics emitted,
+            spilled and sent, bytes sent, queue depth, format and request times), named <project>-client-*.
+            In synchronous mode they are sent with at most one emit per max_wait_time, rather than with every
+            one. Whatever the setting, stats() returns the same numbers, and metrics dropped because the buffer
+            was full are reported as <project>-failed-attempts in the next batch.
+        :param profiling_hooks: ProfilingHooks (see t2.profiling) to tell about the timings and sizes of every flush
+            and send, stage by stage. With no hooks attached nothing is timed.
         """
         super(T2Emitter, self).__init__()
         self.retry = retry
@@ -62,12 +139,33 @@ class T2Emitter(BaseEmitter):
         if self._endpoint is None:
             raise ValueError("You must provide a T2 endpoint")
         self.formatter = formatter or T2Formatter()
+        self.encoder = payload_encoder if payload_encoder is not None else PayloadEncoder()
+        self._direct_serialization = (direct_serialization and hasattr(self.formatter, "encode")
+                                      and self.encoder.compact and self.encoder.json_backend == JSON_BACKEND_JSON)
+        self.max_metrics_per_request = max_metrics_per_request
+        self.max_request_bytes = max_request_bytes
+        if max_metrics_per_request is not None or max_request_bytes is not None:
+            if not hasattr(self.formatter, "encode"):
+                raise ValueError("Splitting payloads requires a formatter that can encode them")
+            self._direct_serialization = True
         self._session = requests.Session()
         self._session.headers.update(self.HEADERS)
         self._session.auth = authentication_provider
         self.request_id = request_id
 
-        self._failed_metric_submissions = 0
+        # Shared with the flusher process, so that it can report what was emitted and dropped in this one
+        self.pipeline_stats = PipelineStats(shared=not synchronous and flusher_mode == FLUSHER_MODE_PROCESS)
+        self.self_telemetry = self_telemetry
+        self._telemetry_interval = max_wait_time / 1000.0
+        self._next_telemetry = 0
+        self.profiling_hooks = list(profiling_hooks or [])
+        self._formatter_profiles = _takes_profile(self.formatter.encode if self._direct_serialization
+                                                  else self.formatter.format)
+        self.spill_store = spill_store
+        self.spill_replay_batch = spill_replay_batch
+        self.retry_scheduler = retry_scheduler if retry_scheduler is not None else RetryScheduler()
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        self._accepting_retries = True
         self.mtls_client_cert_file = mtls_client_cert_file
         self.mtls_client_key_file = mtls_client_key_file
         self.ca_cert_file = ca_cert_file
@@ -80,22 +178,57 @@ class T2Emitter(BaseEmitter):
         if self.ca_cert_file:
             self._session.verify = self.ca_cert_file
 
+        if max_concurrent_sends < 1:
+            raise ValueError("max_concurrent_sends must be at least 1")
+        if max_concurrent_sends > 1 and ThreadPoolExecutor is None:
+            raise ValueError("Concurrent sends require concurrent.futures (pip install futures)")
+        self.max_concurrent_sends = max_concurrent_sends
+        self._send_executor = None
+        self._send_executor_pid = None
+        if self.max_concurrent_sends > 1:
+            # Keep a pooled connection around for every concurrent send
+            adapter = HTTPAdapter(pool_maxsize=self.max_concurrent_sends)
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+
+        if flusher_mode not in FLUSHER_MODES:
+            raise ValueError("flusher_mode must be one of {}".format(", ".join(FLUSHER_MODES)))
+        self._flusher_mode = flusher_mode
+
         if not self._synchronous:
             self.q_size_flush_threshold = max_pending_metrics
             self.q_age_flush_threshold = datetime.timedelta(milliseconds=max_wait_time)
-            self.q = multiprocessing.Queue(
-                maxsize=queue_size or self.q_size_flush_threshold * 10)  # Some breathing room
+            self._max_buffered_metrics = queue_size or self.q_size_flush_threshold * 10  # Some breathing room
+            self._buffer = ColumnarMetricBuffer() if columnar_buffer else None
+            self._buffer_lock = threading.Lock()
+            self._buffer_started = None
+            self._closing = False
             self.last_flush = datetime.datetime.utcnow()
-            self.condition = multiprocessing.Condition()
             # We allow a flusher to be passed in to help with unit testing.
             # Because of the multiprocess fork() call, mocking doesn't work right.
             self.flusher = flusher or self.flush
-            self.watcher = multiprocessing.Process(target=self._watch_queue)
-            self.watcher.daemon = True
-            self.watcher.start()
+            if self._flusher_mode == FLUSHER_MODE_THREAD:
+                self._pending = []
+                self._flush_thread = None
+                self._flush_thread_pid = None
+                self._wakeup = threading.Event()
+            else:
+                max_queued_metrics = self._max_buffered_metrics
+                if self._buffer is not None:
+                    # Each queue item is a whole batch, so size the queue in batches
+                    max_queued_metrics = max(1, max_queued_metrics // max(1, self.q_size_flush_threshold))
+                self._hand_off_thread_pid = None
+                self._hand_off_wakeup = threading.Event()
+                self.q = multiprocessing.Queue(maxsize=max_queued_metrics)
+                self.condition = multiprocessing.Condition()
+                self._stop_watcher = multiprocessing.Event()
+                self.watcher = multiprocessing.Process(target=self._watch_queue)
+                self.watcher.daemon = True
+                self.watcher.start()
 
     def _watch_queue(self):
-        while True:
+        self.pipeline_stats.use_own_slice()
+        while not self._stop_watcher.is_set():
             self.log.debug("[watcher] Attempting to acquire lock")
             if self.condition.acquire(False):
                 self.log.debug("[watcher] waiting %s to flush the queue", self._time_to_next_flush())
@@ -107,30 +240,114 @@ class T2Emitter(BaseEmitter):
                     self.condition.release()
             else:
                 self.log.debug("[watcher] I couldn't acquire the lock")
+        # The payloads waiting for a retry in this process would be lost with it, so make a last attempt at them
+        # and spill (or drop) what still fails before exiting
+        self.log.debug("[watcher] Stopping")
+        try:
+            self.flusher()
+        finally:
+            self._send_pending_retries()
+            if self.spill_store is not None:
+                self.spill_store.close()
+
+    def _ensure_flush_thread(self):
+        pid = os.getpid()
+        if self._flush_thread_pid == pid:
+            return
+        with self._buffer_lock:
+            if self._flush_thread_pid == pid:
+                return
+            if self._flush_thread_pid is not None:
+                # We're in a forked child. The parent owns (and will flush) what was buffered before the fork,
+                # and any lock held by another thread at fork time will never be released here.
+                self._buffer_lock = threading.Lock()
+                self._wakeup = threading.Event()
+                self._pending = []
+                if self._buffer is not None:
+                    self._buffer.drain()
+            self._flush_thread = threading.Thread(target=self._run_flush_thread, name="t2-emitter-flusher")
+            self._flush_thread.daemon = True
+            self._flush_thread.start()
+            self._flush_thread_pid = pid
+
+    def _ensure_hand_off_thread(self):
+        pid = os.getpid()
+        if self._hand_off_thread_pid == pid:
+            return
+        with self._buffer_lock:
+            if self._hand_off_thread_pid == pid:
+                return
+            if self._hand_off_thread_pid is not None:
+                # We're in a forked child; see _ensure_flush_thread
+                self._buffer_lock = threading.Lock()
+                self._hand_off_wakeup = threading.Event()
+                self._buffer.drain()
+            thread = threading.Thread(target=self._run_hand_off_thread, name="t2-emitter-hand-off")
+            thread.daemon = True
+            thread.start()
+            self._hand_off_thread_pid = pid
+
+    def _run_hand_off_thread(self):
+        # Emits hand the columnar buffer to the watcher when it is full or old enough, but once emits stop
+        # nothing would, so this thread hands it off when it gets too old.
+        while not self._closing:
+            with self._buffer_lock:
+                wait_time = self.q_age_flush_threshold.total_seconds()
+                if len(self._buffer):
+                    age = datetime.datetime.utcnow() - self._buffer_started
+                    wait_time = (self.q_age_flush_threshold - age).total_seconds()
+                    if wait_time <= 0:
+                        self._hand_off_buffer()
+            if wait_time <= 0:
+                self._notify_watcher()
+                continue
+            self._hand_off_wakeup.wait(max(wait_time, MINIMUM_THREAD_WAIT_TIME))
+            self._hand_off_wakeup.clear()
+
+    def _run_flush_thread(self):
+        while not self._closing:
+            self._wakeup.wait(self._time_to_next_thread_flush())
+            self._wakeup.clear()
+            if self._closing:
+                break
+            try:
+                self.log.debug("[flusher] Flushing buffered metrics")
+                self.flusher()
+            except Exception as e:
+                self.log.error("Encountered exception flushing metrics!")
+                self.log.exception(e)
 
     def _generate_request_id(self):
         generated_id = self.default_metadata.project + "-" + uuid4().hex
         request_id = self.request_id or generated_id
         self.log.debug("Request id is %s", request_id)
-        self._session.headers.update({"opc-request-id": request_id})
+        return request_id
 
     def emit(self, metric_or_metrics, dimensions=None):
         """
         Emit a metric. The metric will either be recorded immediately or queued
         for later, based on whether we're running in synchronous mode or not.
+        Metrics keep their dimensions through the queue, and are sent in a payload
+        with the other metrics of the same metadata and dimensions.
         :param metric_or_metrics: The metric(s) to send
+        :param dimensions: Optional dimensions to give the metric(s), replacing their own
         :return: None
         """
+        set_dimensions(metric_or_metrics, dimensions)
+        self.pipeline_stats.increment(METRICS_EMITTED, _count(metric_or_metrics))
         if self._synchronous:
             # Send the metric immediately.
             self.log.debug("Sending metric(s) synchronously: %s", metric_or_metrics)
-            for payload in self.format(metric_or_metrics):
-                if dimensions is not None:
-                    payload['metrics'][0]['config'] = dimensions
-                self._send_or_complain(payload)
+            metrics = metric_or_metrics if isinstance(metric_or_metrics, list) else [metric_or_metrics]
+            self._send_payloads(self.encode(metrics + self._self_metrics(telemetry=self._telemetry_due())))
+            self._send_due_retries()
+            self._replay_spilled()
             return
 
-        self._emit_async(metric_or_metrics)
+        if self._flusher_mode == FLUSHER_MODE_THREAD:
+            self._emit_threaded(metric_or_metrics)
+        else:
+            self._emit_async(metric_or_metrics)
 
     def flush(self):
         """
@@ -138,11 +355,78 @@ class T2Emitter(BaseEmitter):
         into a format appropriate for the wire, then sends them all.
         :return: None
         """
+        if self._flusher_mode == FLUSHER_MODE_THREAD:
+            metrics = self._drain_buffer()
+        else:
+            metrics = self._drain_queue()
+        self.last_flush = datetime.datetime.utcnow()
+        if metrics:
+            self.pipeline_stats.increment(FLUSHES)
+            self.pipeline_stats.observe(METRICS_PER_FLUSH, len(metrics))
+        # An idle flush only reports drops, or self-telemetry would keep every idle emitter sending
+        metrics.extend(self._self_metrics(telemetry=bool(metrics)))
+        if metrics:
+            if self.profiling_hooks:
+                self._profiled_flush(metrics)
+            else:
+                self._send_payloads(self.encode(metrics))
+        self._send_due_retries()
+        self._replay_spilled()
+
+    def _profiled_flush(self, metrics):
+        profile = FlushProfile(len(metrics))
+        start = timeit.default_timer()
+        payloads = self.encode(metrics, profile=profile)
+        profile.payloads = len(payloads)
+        profile.body_bytes = sum([len(p) for p in payloads if isinstance(p, bytes)])
+        self._send_payloads(payloads)
+        profile.seconds = timeit.default_timer() - start
+        self._report_profile("flush_profiled", profile)
+
+    def add_profiling_hook(self, hook):
+        """
+        :param hook: A ProfilingHook to tell about every flush and send from now on
+        :return: None
+        """
+        self.profiling_hooks.append(hook)
+
+    def _report_profile(self, method, profile):
+        for hook in self.profiling_hooks:
+            try:
+                getattr(hook, method)(profile)
+            except Exception as e:
+                self.log.error("Profiling hook %r failed!", hook)
+                self.log.exception(e)
+
+    def _send_payloads(self, payloads):
+        if self.max_concurrent_sends == 1 or len(payloads) < 2:
+            for payload in payloads:
+                self._send_or_complain(payload)
+            return
+        # _send_or_complain never raises, so one failing payload can't affect the others
+        list(self._get_send_executor().map(self._send_or_complain, payloads))
+
+    def _get_send_executor(self):
+        # Executor threads don't survive a fork, so each process gets its own executor
+        pid = os.getpid()
+        if self._send_executor_pid != pid:
+            self._send_executor = ThreadPoolExecutor(max_workers=self.max_concurrent_sends)
+            self._send_executor_pid = pid
+        return self._send_executor
+
+    def _drain_buffer(self):
+        with self._buffer_lock:
+            if self._buffer is not None:
+                return self._buffer.drain().to_metrics() if len(self._buffer) else []
+            metrics, self._pending = self._pending, []
+        self.log.debug("%d metrics have been drained from the buffer", len(metrics))
+        return metrics
+
+    def _drain_queue(self):
         self.log.debug("Current size of %s: %d", self.q, self.q.qsize())
         if self.q.empty():
             self.log.debug("Queue %s is empty!!!", self.q)
-            self.last_flush = datetime.datetime.utcnow()
-            return
+            return []
         metrics = []
         maximum_metrics_to_send = self.q.qsize()
         # Attempt to retrieve up to the current length of the queue. It's okay if we get less. That just means some
@@ -151,83 +435,381 @@ class T2Emitter(BaseEmitter):
             for _ in range(maximum_metrics_to_send):
                 metric = self.q.get(False)
                 self.log.debug("Grabbed metric %s from the queue", metric)
-                metrics.append(metric)
+                if isinstance(metric, ColumnarBatch):
+                    metrics.extend(metric.to_metrics())
+                elif isinstance(metric, list):
+                    metrics.extend(metric)
+                else:
+                    metrics.append(metric)
         except Empty:
             self.log.debug("Concurrent flush in progress. Batched writes may not be optimally packed.")
         self.log.debug("%d metrics have been read from the queue", len(metrics))
-        self.last_flush = datetime.datetime.utcnow()
-        for payload in self.format(metrics):
-            self._send_or_complain(payload)
+        return metrics
 
-    def format(self, metric_or_metrics):
-        formatted_metrics = self.formatter.format(metric_or_metrics, default_metadata=self.default_metadata)
+    def format(self, metric_or_metrics, profile=None):
+        formatted_metrics = self.formatter.format(metric_or_metrics, default_metadata=self.default_metadata,
+                                                  **self._profile_kwargs(profile))
         self.log.debug("Formatted metrics are %s", formatted_metrics)
         return formatted_metrics
 
+    def encode(self, metric_or_metrics, profile=None):
+        """
+        Format metrics into payloads ready for send(): serialized JSON bytes when direct serialization is
+        enabled, formatted dicts otherwise.
+        :param metric_or_metrics: The metric(s) to format
+        :param profile: An optional FlushProfile for the formatter to record its stages in
+        :return: A list of payloads
+        """
+        start = timeit.default_timer()
+        if not self._direct_serialization:
+            encoded = self.format(metric_or_metrics, profile=profile)
+        else:
+            encoded = self.formatter.encode(metric_or_metrics, default_metadata=self.default_metadata,
+                                            max_metrics=self.max_metrics_per_request,
+                                            max_bytes=self.max_request_bytes, **self._profile_kwargs(profile))
+            self.log.debug("Encoded metrics are %s", encoded)
+        self.pipeline_stats.observe(FORMAT_SECONDS, timeit.default_timer() - start)
+        return encoded
+
+    def _profile_kwargs(self, profile):
+        # Formatters written before profiling existed don't take a profile
+        if profile is None or not self._formatter_profiles:
+            return {}
+        return {"profile": profile}
+
+    def stats(self):
+        """
+        A snapshot of this emitter's self-telemetry. In "process" flusher mode, only the "pipeline" section
+        includes what the flusher process did; the other sections describe this process.
+        :return: A dict with a "pipeline" section (PipelineStats counters and histograms, plus the current
+            queue depth) and a section each for the encoder, retry scheduler, circuit breaker and spill store
+        """
+        pipeline = self.pipeline_stats.snapshot()
+        pipeline["queueDepth"] = self._queue_depth()
+        result = {
+            "pipeline": pipeline,
+            "encoder": self.encoder.stats(),
+            "retries": self.retry_scheduler.stats(),
+            "circuitBreaker": self.circuit_breaker.stats(),
+        }
+        if self.spill_store is not None:
+            result["spill"] = self.spill_store.stats()
+        return result
+
+    def _queue_depth(self):
+        if self._synchronous:
+            return 0
+        depth = len(self._buffer) if self._buffer is not None else 0
+        if self._flusher_mode == FLUSHER_MODE_THREAD:
+            return depth + len(self._pending)
+        try:
+            return depth + self.q.qsize()
+        except NotImplementedError:
+            # multiprocessing.Queue.qsize() isn't available on macOS
+            return depth
+
     def close(self):
+        try:
+            self._close()
+        finally:
+            self._send_pending_retries()
+            if self._send_executor is not None and self._send_executor_pid == os.getpid():
+                self._send_executor.shutdown()
+            if self.spill_store is not None:
+                self.spill_store.close()
+
+    def _close(self):
+        if self._synchronous:
+            return
+        if self._flusher_mode == FLUSHER_MODE_THREAD:
+            self.log.debug("Stopping the flusher thread and flushing buffered metrics")
+            self._closing = True
+            self._wakeup.set()
+            if self._flush_thread is not None and self._flush_thread_pid == os.getpid():
+                self._flush_thread.join()
+            self.flusher()
+            return
         self.log.debug("Closing and flushing queue %s", self.q)
-        if not self._synchronous:
+        if self._buffer is not None:
+            self._closing = True
+            self._hand_off_wakeup.set()
+            with self._buffer_lock:
+                self._hand_off_buffer()
+        self.flusher()
+        # Metrics put on the queue reach its pipe through a feeder thread, so a flush can find the queue empty while
+        # the feeder still holds some. Keep flushing until every metric has been taken: a feeder left blocked on a
+        # full pipe once the watcher is gone would also hang the interpreter at exit.
+        deadline = timeit.default_timer() + CLOSE_DRAIN_TIMEOUT
+        while self.q.qsize() > 0 and self.watcher.is_alive() and timeit.default_timer() < deadline:
+            time.sleep(MINIMUM_THREAD_WAIT_TIME)
             self.flusher()
+        # Let the watcher stop by itself so that it hands over the retries it is holding. It is only terminated if
+        # it doesn't stop in time.
+        self._stop_watcher.set()
+        deadline = timeit.default_timer() + CLOSE_DRAIN_TIMEOUT
+        while self.watcher.is_alive() and timeit.default_timer() < deadline:
+            self._notify_watcher()
+            self.watcher.join(MINIMUM_THREAD_WAIT_TIME)
+        if self.watcher.is_alive():
+            self.log.warning("The queue watcher didn't stop in %ss, terminating it", CLOSE_DRAIN_TIMEOUT)
             self.watcher.terminate()
+        if self.q.qsize() > 0:
+            self.log.warning("%d queued items could not be flushed before closing", self.q.qsize())
+            # Don't let the feeder thread's pending writes keep the interpreter from exiting
+            self.q.cancel_join_thread()
 
     def send(self, payload):
-        self._generate_request_id()
-        self._submit_failed_attempts()
-        if self.retry:
-            return self._send_and_retry(payload)
-        return self._send(payload)
+        """
+        Make a single attempt at sending a payload. Failed sends are retried by _send_or_complain.
+        :param payload: The payload to send
+        :return: None
+        """
+        return self._send(payload, self._generate_request_id())
 
-    def _send(self, payload):
+    def _send(self, payload, request_id=None):
         # This code will change when we use a real swagger client
-        self.log.debug("Sending %s to T2 (without retrying)", payload)
-        resp = self._session.put(self._endpoint, data=json.dumps(payload))
+        self.log.debug("Sending %s to T2", payload)
+        resp = self._put(payload, request_id or self._generate_request_id())
         self.log.info("Received response from T2: %s - %s", resp.headers, resp.content)
+        if resp.status_code >= 500 or resp.status_code == 429:
+            # Worth retrying, unlike a rejected payload
+            resp.raise_for_status()
+
+    def _put(self, payload, request_id):
+        # The request id is passed per request rather than set on the shared session,
+        # because payloads may be sent concurrently
+        profile = SendProfile() if self.profiling_hooks else None
+        start = timeit.default_timer()
+        body, headers = self.encoder.encode(payload, profile=profile)
+        sending = timeit.default_timer()
+        self.pipeline_stats.observe(ENCODE_SECONDS, sending - start)
+        headers["opc-request-id"] = request_id
+        try:
+            if profile is not None:
+                return self._profiled_put(body, headers, profile)
+            return self._session.put(self._endpoint, data=body, headers=headers)
+        finally:
+            self.pipeline_stats.observe(HTTP_SECONDS, timeit.default_timer() - sending)
+            self.pipeline_stats.increment(BYTES_SENT, len(body))
+
+    def _profiled_put(self, body, headers, profile):
+        # What Session.put does, with request preparation (where the authentication provider signs the request)
+        # timed apart from the round trip
+        start = timeit.default_timer()
+        try:
+            request = self._session.prepare_request(requests.Request("PUT", self._endpoint, data=body, headers=headers))
+            sending = timeit.default_timer()
+            profile.record(STAGE_SIGN, sending - start)
+            settings = self._session.merge_environment_settings(request.url, {}, None, None, None)
+            try:
+                resp = self._session.send(request, **settings)
+            finally:
+                profile.record(STAGE_HTTP, timeit.default_timer() - sending)
+            profile.status_code = resp.status_code
+            return resp
+        finally:
+            self._report_profile("send_profiled", profile)
 
-    def _send_or_complain(self, payload):
+    def _send_or_complain(self, payload, attempt=1):
+        if not self.circuit_breaker.allow():
+            self._retry_later(payload, attempt, self.circuit_breaker.time_to_probe())
+            return
         try:
             self.log.debug("Attempting to send payload")
             self.send(payload)
         except Exception as e:
+            self.circuit_breaker.record_failure()
+            self.pipeline_stats.increment(PAYLOADS_FAILED)
+            self._retry_later(payload, attempt + 1, self._retry_delay(attempt), e)
+        else:
+            self.circuit_breaker.record_success()
+            self.pipeline_stats.increment(PAYLOADS_SENT)
+
+    def _retry_later(self, payload, attempt, delay, error=None):
+        if (self.retry and attempt <= MAX_SEND_ATTEMPTS and self._accepting_retries and
+                self.retry_scheduler.schedule(payload, attempt, delay)):
+            self.pipeline_stats.increment(RETRIES_SCHEDULED)
+            self.log.debug("Sending to T2 failed, making attempt %d of %d in %ss", attempt, MAX_SEND_ATTEMPTS, delay)
+            return
+        if error is not None:
             self.log.error("Encountered exception sending metrics!")
+            self.log.exception(error)
+        else:
+            self.log.error("Sends to T2 are failing and no more retries can be scheduled!")
+        if self.spill_store is not None and self._spill(payload):
+            self.log.warning("Spilled the payload to %s", self.spill_store.directory)
+
+    def _retry_delay(self, attempt):
+        return min(RETRY_WAIT_MULTIPLIER * 2 ** attempt, MAX_RETRY_WAIT)
+
+    def _send_due_retries(self):
+        for payload, attempt in self.retry_scheduler.pop_due():
+            self._send_or_complain(payload, attempt)
+
+    def _send_pending_retries(self):
+        # On close, make one last attempt at everything that is waiting for a retry, whatever the state of the
+        # circuit, until a send fails. What is left is spilled or dropped.
+        self._accepting_retries = False
+        error = None
+        for payload, attempt in self.retry_scheduler.pop_all():
+            if error is None:
+                try:
+                    self.send(payload)
+                    self.circuit_breaker.record_success()
+                    continue
+                except Exception as e:
+                    self.circuit_breaker.record_failure()
+                    error = e
+            self._retry_later(payload, attempt, 0, error)
+
+    def _spill(self, payload):
+        return self.spill_store.append(self.encoder.dumps(payload))
+
+    def _spill_metrics(self, metric_or_metrics):
+        """
+        Spill metrics that don't fit in the buffer
+        :return: True if they were spilled, False if they have to be dropped
+        """
+        if self.spill_store is None:
+            return False
+        try:
+            spilled = all([self._spill(payload) for payload in self.encode(metric_or_metrics)])
+            if spilled:
+                self.pipeline_stats.increment(METRICS_SPILLED, _count(metric_or_metrics))
+            return spilled
+        except Exception as e:
+            self.log.error("Encountered exception spilling metrics!")
             self.log.exception(e)
+            return False
+
+    def _replay_spilled(self):
+        if self.spill_store is None:
+            return
+        replayed = self.spill_store.replay(self._send_spilled, max_bodies=self.spill_replay_batch)
+        if replayed:
+            self.log.info("Replayed %d spilled payloads", replayed)
+
+    def _send_spilled(self, body):
+        if not self.circuit_breaker.allow():
+            raise CircuitOpenError()
+        try:
+            self._send(body)
+        except Exception:
+            self.circuit_breaker.record_failure()
+            raise
+        self.circuit_breaker.record_success()
 
     def _emit_async(self, metric_or_metrics):
+        if self._buffer is not None:
+            self._emit_columnar(metric_or_metrics)
+            return
+
         try:
             self.log.debug("Placing metric %s on queue %s", metric_or_metrics, self.q)
             self.q.put(metric_or_metrics, block=False)
-            self.log.debug("Current queue size: %d", self.q.qsize())
+            depth = self.q.qsize()
+            self.log.debug("Current queue size: %d", depth)
+            self.pipeline_stats.record_high_water(QUEUE_DEPTH_HIGH_WATER, depth)
         except Full:
-            self._failed_metric_submissions += 1
-            self.log.warning("Queue is full! Discarding metric!")
+            if self._spill_metrics(metric_or_metrics):
+                self.log.warning("Queue is full! Spilled metric to disk")
+            else:
+                self._record_dropped(metric_or_metrics)
+                self.log.warning("Queue is full! Discarding metric!")
         finally:
+            if self.spill_store is not None:
+                self.spill_store.seal_if_stale()
             if self._queue_too_full() or self._queue_too_old():
                 self.log.debug("Trying to notify queue watcher that it's time to empty the queue")
-                if self.condition.acquire(False):
-                    try:
-                        self.log.debug("Acquired lock. Notifying queue watcher")
-                        self.condition.notify_all()
-                    finally:
-                        self.condition.release()
-
-    @backoff(
-        stop_max_attempt_number=7,
-        wait_exponential_multiplier=1000,
-        wait_exponential_max=10000,
-    )
-    def _send_and_retry(self, payload):
-        # This code will change when we use a real swagger client
-        self.log.debug("Sending %s to T2 (and potentially retrying)", payload)
-        resp = self._session.put(self._endpoint, data=json.dumps(payload))
-        self.log.debug("Received response from T2: %s - %s", resp.headers, resp.content)
+                self._notify_watcher()
+
+    def _emit_threaded(self, metric_or_metrics):
+        self._ensure_flush_thread()
+        with self._buffer_lock:
+            pending = self._pending if self._buffer is None else self._buffer
+            full = len(pending) >= self._max_buffered_metrics
+            if not full:
+                if isinstance(metric_or_metrics, list):
+                    pending.extend(metric_or_metrics)
+                else:
+                    pending.append(metric_or_metrics)
+                size = len(pending)
+        if full:
+            if self._spill_metrics(metric_or_metrics):
+                self.log.warning("Buffer is full! Spilled metric to disk")
+            else:
+                self._record_dropped(metric_or_metrics)
+                self.log.warning("Buffer is full! Discarding metric!")
+            return
+        self.pipeline_stats.record_high_water(QUEUE_DEPTH_HIGH_WATER, size)
+        if size >= self.q_size_flush_threshold:
+            self._wakeup.set()
+
+    def _emit_columnar(self, metric_or_metrics):
+        self._ensure_hand_off_thread()
+        with self._buffer_lock:
+            if len(self._buffer) == 0:
+                self._buffer_started = datetime.datetime.utcnow()
+            if isinstance(metric_or_metrics, list):
+                self._buffer.extend(metric_or_metrics)
+            else:
+                self._buffer.append(metric_or_metrics)
+            self.pipeline_stats.record_high_water(QUEUE_DEPTH_HIGH_WATER, len(self._buffer))
+            if (len(self._buffer) < self.q_size_flush_threshold and
+                    datetime.datetime.utcnow() - self._buffer_started < self.q_age_flush_threshold):
+                return
+            self._hand_off_buffer()
+        self._notify_watcher()
 
-    def _submit_failed_attempts(self):
-        if self._failed_metric_submissions == 0:
+    def _hand_off_buffer(self):
+        # Must be called with self._buffer_lock held
+        if len(self._buffer) == 0:
             return
-        metric_name = self.default_metadata.project + "-failed-attempts"
-        self.log.debug("Submitting %s failed attempts to T2...", self._failed_metric_submissions)
-        self._send(self.format(
-            Metric(metric_name, self._failed_metric_submissions)))
-        self._failed_metric_submissions = 0
+        batch = self._buffer.drain()
+        try:
+            self.log.debug("Placing a batch of %d metrics on queue %s", len(batch), self.q)
+            self.q.put(batch, block=False)
+        except Full:
+            if self._spill_metrics(batch.to_metrics()):
+                self.log.warning("Queue is full! Spilled %d metrics to disk", len(batch))
+            else:
+                self.pipeline_stats.increment(METRICS_DROPPED, len(batch))
+                self.log.warning("Queue is full! Discarding %d metrics!", len(batch))
+
+    def _notify_watcher(self):
+        if self.condition.acquire(False):
+            try:
+                self.log.debug("Acquired lock. Notifying queue watcher")
+                self.condition.notify_all()
+            finally:
+                self.condition.release()
+
+    def _record_dropped(self, metric_or_metrics):
+        self.pipeline_stats.increment(METRICS_DROPPED, _count(metric_or_metrics))
+
+    def _self_metrics(self, telemetry=True):
+        """
+        The metrics this emitter reports about itself, to be sent along with the next batch: the number of
+        metrics dropped since the last report and, with self_telemetry, the pipeline stats for the interval.
+        :param telemetry: False to leave out the pipeline stats, which are then reported with a later batch
+        :return: A list of metrics, often empty
+        """
+        metrics = []
+        project = self.default_metadata.project
+        dropped = int(self.pipeline_stats.unreported(METRICS_DROPPED))
+        if dropped:
+            metrics.append(Metric(project + "-failed-attempts", dropped))
+        if telemetry and self.self_telemetry:
+            metrics.extend(_telemetry_metrics(project + "-client-", self.pipeline_stats))
+        return metrics
+
+    def _telemetry_due(self):
+        # Synchronous emits have no flush interval of their own, so pace the pipeline stats by max_wait_time
+        now = timeit.default_timer()
+        if now < self._next_telemetry:
+            return False
+        self._next_telemetry = now + self._telemetry_interval
+        return True
 
     def _queue_too_old(self):
         return datetime.datetime.utcnow() >= self._time_of_next_flush
@@ -239,7 +821,17 @@ class T2Emitter(BaseEmitter):
         wait_time = ((self.last_flush + self.q_age_flush_threshold) - datetime.datetime.utcnow()).total_seconds()
         self.log.debug("Last flush was %s, flush threshold is %s, current time is %s",
                        self.last_flush, self.q_age_flush_threshold, datetime.datetime.utcnow())
-        return max(wait_time, MINIMUM_QUEUE_WAIT_TIME)
+        return max(self._until_next_retry(wait_time), MINIMUM_QUEUE_WAIT_TIME)
+
+    def _time_to_next_thread_flush(self):
+        wait_time = ((self.last_flush + self.q_age_flush_threshold) - datetime.datetime.utcnow()).total_seconds()
+        return max(self._until_next_retry(wait_time + self.jitter / 1000.0), MINIMUM_THREAD_WAIT_TIME)
+
+    def _until_next_retry(self, wait_time):
+        time_to_next_retry = self.retry_scheduler.time_to_next_due()
+        if time_to_next_retry is None:
+            return wait_time
+        return min(wait_time, time_to_next_retry)
 
     @property
     def _time_of_next_flush(self):
@@ -254,3 +846,36 @@ class T2Emitter(BaseEmitter):
         :return: int
         """
         return random.randint(-1 * abs(self._jitter), abs(self._jitter))
+
+
+def _takes_profile(fn):
+    try:
+        return "profile" in inspect.signature(fn).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _count(metric_or_metrics):
+    return len(metric_or_metrics) if isinstance(metric_or_metrics, list) else 1
+
+
+def _telemetry_metrics(prefix, pipeline_stats):
+    """
+    :param prefix: The prefix of the metric names
+    :param pipeline_stats: The PipelineStats to report
+    :return: A list of metrics describing the pipeline since the last report
+    """
+    metrics = []
+    for name, key in (("metrics-emitted", METRICS_EMITTED), ("metrics-spilled", METRICS_SPILLED),
+                      ("payloads-sent", PAYLOADS_SENT), ("payloads-failed", PAYLOADS_FAILED),
+                      ("bytes-sent", BYTES_SENT), ("retries", RETRIES_SCHEDULED)):
+        metrics.append(DeltaCounterMetric(prefix + name, pipeline_stats.unreported(key)))
+    metrics.append(GaugeMetric(prefix + "queue-depth-high-water", pipeline_stats.get(QUEUE_DEPTH_HIGH_WATER)))
+    for name, key, scale, metric_class in (("metrics-per-flush", METRICS_PER_FLUSH, 1, GaugeMetric),
+                                           ("format-time", FORMAT_SECONDS, 1000, TimerMetric),
+                                           ("encode-time", ENCODE_SECONDS, 1000, TimerMetric),
+                                           ("request-time", HTTP_SECONDS, 1000, TimerMetric)):
+        count, total = pipeline_stats.unreported(key)
+        if count:
+            metrics.append(metric_class(prefix + name, total / count * scale))
+    return metrics
@@ -1,27 +1,33 @@
 import logging
 import os
 
-from logging.handlers import TimedRotatingFileHandler
 from ..models.metric import MetricMetadata
 from .log_emitter import LogEmitter
+from .log_tap_writer import LogTapWriter
 from ..formatters import T2MetricLogFormatter
 
 log = logging.getLogger(__name__)
 
-METRIC_LOGGER_PREFIX = "Metric-Logger"
 METADATA_FILENAME_PREFIX = "metric-log-tap"
 METRIC_LOG_FILE_PREFIX = "Metrics_v1.0"
 
-METRIC_LOG_LEVEL = 100
-
 
 class T2MetricLogEmitter(LogEmitter):
-    def __init__(self, region, availabilityDomain, project, fleet, hostname, logdir):
+    def __init__(self, region, availabilityDomain, project, fleet, hostname, logdir, writer=None):
+        """
+        A T2MetricLogEmitter writes metrics to log tap files, one per metadata, for an agent to pick up.
+        :param logdir: The directory the log tap files are written to
+        :param writer: The LogTapWriter that writes the files in the background. Defaults to one with
+            the default latency and buffer sizes.
+        """
         self.default_metadata = MetricMetadata(region=region, availabilityDomain=availabilityDomain, project=project,
                                                fleet=fleet, hostname=hostname)
         super(T2MetricLogEmitter, self).__init__(self.default_metadata)
         self.logdir = logdir
         self.formatter = T2MetricLogFormatter()
+        self.writer = writer if writer is not None else LogTapWriter()
+        # Log tap files by metadata. Metadata from copy_with is interned, so this is a single lookup per metric.
+        self._log_tap_files = {}
 
     def emit(self, metric_or_metrics, dimensions=None):
         if isinstance(metric_or_metrics, list):
@@ -29,44 +35,41 @@ class T2MetricLogEmitter(LogEmitter):
         else:
             metrics = [metric_or_metrics]
 
+        log_tap_files = self._log_tap_files
         for metric in metrics:
             metric_metadata = self.default_metadata.copy_with(metric.override_tags)
-
-            # Create the logger if it doesn't exist
-            if self._logger_name_for_metric(metric_metadata) not in logging.Logger.manager.loggerDict:
-                self.create_metric_logger(metric_metadata)
-
-                # If we created a new logger, we also need to create the metadata file
-                # if it doesn't already exist
-                if not os.path.exists(os.path.join(self.logdir, self._filename_for_metadata(metric_metadata))):
-                    self.create_metadata_file(metric_metadata)
-
-            metric_logger = logging.getLogger(self._logger_name_for_metric(metric_metadata))
-            metric_logger.log(METRIC_LOG_LEVEL, self.format(metric))
+            log_tap_file = log_tap_files.get(metric_metadata)
+            if log_tap_file is None:
+                log_tap_file = self._log_tap_file_for(metric_metadata)
+            log_tap_file.write(self.format(metric))
+
+    def _log_tap_file_for(self, metric_metadata):
+        # Every log file comes with a metadata file, for the agent to know what the metrics in it are about
+        if not os.path.exists(os.path.join(self.logdir, self._filename_for_metadata(metric_metadata))):
+            self.create_metadata_file(metric_metadata)
+
+        log_tap_file = self.writer.open(os.path.join(self.logdir, self._filename_for_metric_log(metric_metadata)))
+        log.debug("Metrics logging to {}".format(log_tap_file.path))
+        if len(self._log_tap_files) >= MetricMetadata.MAX_INTERNED_COPIES:
+            self._log_tap_files.clear()
+        self._log_tap_files[metric_metadata] = log_tap_file
+        return log_tap_file
 
     def create_metadata_file(self, metric_metadata):
         with open(os.path.join(self.logdir, self._filename_for_metadata(metric_metadata)), "w") as metadata_fp:
             metadata_fp.write(metric_metadata.json_string)
 
-    def create_metric_logger(self, metric_metadata):
-        metric_logger = logging.getLogger(self._logger_name_for_metric(metric_metadata))
-        metric_logger.propagate = False
-        metric_logger.setLevel(METRIC_LOG_LEVEL)
+    def flush(self):
+        self.writer.flush()
 
-        rolling_handler = TimedRotatingFileHandler(
-            filename=os.path.join(self.logdir, self._filename_for_metric_log(metric_metadata)),
-            when="h")
-        log.debug("Metrics logging to {}".format(rolling_handler.baseFilename))
-        formatter = logging.Formatter('%(message)s')
-        rolling_handler.setFormatter(formatter)
+    def close(self):
+        self.writer.close()
 
-        metric_logger.addHandler(rolling_handler)
+    def stats(self):
+        return {"logTap": self.writer.stats()}
 
     def _filename_for_metadata(self, metadata):
         return "{}-{}.metadata".format(METADATA_FILENAME_PREFIX, metadata.md5_hash)
 
     def _filename_for_metric_log(self, metadata):
         return "{}-{}.log".format(METRIC_LOG_FILE_PREFIX, metadata.md5_hash)
-
-    def _logger_name_for_metric(self, metadata):
-        return "{}-{}".format(METRIC_LOGGER_PREFIX, metadata.md5_hash)
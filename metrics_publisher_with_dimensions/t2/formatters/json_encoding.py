@@ -0,0 +1,166 @@
+"""
+Helpers for writing wire JSON directly, without building intermediate dicts.
+
+Everything here produces exactly what json.dumps(..., separators=(',', ':')) would
+produce for the same value, so payloads encoded directly are byte-for-byte identical
+to payloads serialized from the formatters' dicts.
+"""
+import json
+
+# Upper bound on the number of metric names kept by a StringCache
+MAX_CACHED_STRINGS = 10000
+
+
+def encode_number(v):
+    """
+    :param v: A number (or any other JSON-serializable value)
+    :return: The compact JSON text for v
+    """
+    t = type(v)
+    if t is float:
+        if v - v == 0.0:
+            return float.__repr__(v)
+        if v != v:
+            return 'NaN'
+        return 'Infinity' if v > 0 else '-Infinity'
+    if t is int:
+        return int.__repr__(v)
+    if t is bool:
+        return 'true' if v else 'false'
+    if v is None:
+        return 'null'
+    return json.dumps(v, separators=(',', ':'))
+
+
+def encode_config(dimensions):
+    """
+    :param dimensions: The dimensions of a payload's metrics, or None
+    :return: The compact JSON text of the "config" member of each of the payload's metric entries, starting with
+        a comma, or an empty string if there are no dimensions
+    """
+    if not dimensions:
+        return ''
+    return ',"config":' + json.dumps(dimensions, separators=(',', ':'))
+
+
+class StringCache(object):
+    def __init__(self, max_size=MAX_CACHED_STRINGS):
+        """
+        Caches the JSON text of strings that are encoded over and over, such as metric names.
+        """
+        self.max_size = max_size
+        self._cache = {}
+
+    def encode(self, s):
+        encoded = self._cache.get(s)
+        if encoded is None:
+            encoded = json.dumps(s)
+            if len(self._cache) >= self.max_size:
+                self._cache.clear()
+            self._cache[s] = encoded
+        return encoded
+
+
+class ChunkWriter(object):
+    def __init__(self, prefix, suffix, max_items=None, max_bytes=None):
+        """
+        Writes a JSON document made of nested sections (objects or arrays) holding pre-encoded items,
+        starting a new document whenever the next item would take the current one over max_items items
+        or max_bytes bytes. Every document gets the same prefix and suffix, and the sections that are
+        open when a document is cut are re-opened in the next one, so each document is complete and
+        valid on its own. Sections are only written once they hold an item, so no document ends up
+        with empty sections.
+
+        A single item that is bigger than max_bytes is still written, alone in its own document.
+
+        :param prefix: The text every document starts with
+        :param suffix: The text every document ends with
+        :param max_items: The maximum number of items per document, or None
+        :param max_bytes: The maximum size of a document in bytes, or None
+        """
+        self.prefix = prefix
+        self.suffix = suffix
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.documents = []
+        # Each open section is [head, tail, written, has_children]
+        self._sections = []
+        self._start_document()
+
+    def _start_document(self):
+        self._out = [self.prefix]
+        self._size = len(self.prefix)
+        self._items = 0
+        for section in self._sections:
+            section[2] = False
+            section[3] = False
+
+    def _end_document(self):
+        for section in reversed(self._sections):
+            if section[2]:
+                self._out.append(section[1])
+        self._out.append(self.suffix)
+        self.documents.append(''.join(self._out).encode('ascii'))
+
+    def open(self, head, tail):
+        """
+        Open a section. Top-level sections are written as-is; nested ones are comma-separated.
+        :param head: The text opening the section, e.g. '{"name":"x","series":['
+        :param tail: The text closing the section, e.g. ']}'
+        """
+        self._sections.append([head, tail, False, False])
+
+    def close(self):
+        section = self._sections.pop()
+        if section[2]:
+            self._out.append(section[1])
+            self._size += len(section[1])
+
+    def item(self, fragment):
+        """
+        Write an item into the innermost open section
+        :param fragment: The item's JSON text
+        """
+        if self._items and self._over_limit(fragment):
+            self._end_document()
+            self._start_document()
+
+        parent = None
+        for section in self._sections:
+            if not section[2]:
+                head = ',' + section[0] if parent is not None and parent[3] else section[0]
+                self._out.append(head)
+                self._size += len(head)
+                section[2] = True
+                if parent is not None:
+                    parent[3] = True
+            parent = section
+        if parent is not None and parent[3]:
+            fragment = ',' + fragment
+        self._out.append(fragment)
+        self._size += len(fragment)
+        self._items += 1
+        if parent is not None:
+            parent[3] = True
+
+    def _over_limit(self, fragment):
+        if self.max_items is not None and self._items >= self.max_items:
+            return True
+        if self.max_bytes is None:
+            return False
+        size = self._size + len(fragment) + 1 + len(self.suffix)
+        for section in self._sections:
+            size += len(section[1])
+            if not section[2]:
+                size += len(section[0]) + 1
+        return size > self.max_bytes
+
+    def finish(self):
+        """
+        :return: The list of documents written, as bytes. There is always at least one.
+        """
+        while self._sections:
+            self.close()
+        if self._items or not self.documents:
+            self._end_document()
+        return self.documents
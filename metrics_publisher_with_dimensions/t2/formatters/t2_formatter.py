@@ -1,6 +1,7 @@
-import datetime
-
 from .. import models
+from ..models.metric import dimensions_key
+from .json_encoding import ChunkWriter, StringCache, encode_config, encode_number
+from ..profiling import STAGE_GROUP, STAGE_SERIALIZE, clock
 
 import logging
 
@@ -8,9 +9,10 @@ logger = logging.getLogger(__name__)
 
 
 class T2Formatter(object):
-    epoch = datetime.datetime.utcfromtimestamp(0)
+    def __init__(self):
+        self._names = StringCache()
 
-    def format(self, metric_or_metrics, default_metadata=None):
+    def format(self, metric_or_metrics, default_metadata=None, profile=None):
         """
         This will format a list of metric payloads suitable for
         JSON-serialization. Different emitters will need their formatters
@@ -38,11 +40,58 @@ class T2Formatter(object):
 
          In the case of a single metric, the "metrics" list above will have only one entry.
 
+        Metrics with dimensions are also grouped by their dimensions, and each entry of their payload
+        carries the dimensions as its "config".
+
         :param metric_or_metrics:  The metric or metrics to format
         :param default_metadata: The metric metadata common to all metrics being sent. Metadata attached
             to a metric will override any of the default_metadata values.
+        :param profile: An optional FlushProfile to record the time spent grouping and serializing in
         :return: List of payloads ready for serialization to the T2 service
         """
+        if profile is None:
+            return self.serialize_payloads(self.group_payloads(metric_or_metrics, default_metadata))
+        start = clock()
+        payloads = self.group_payloads(metric_or_metrics, default_metadata)
+        grouped = clock()
+        serialized = self.serialize_payloads(payloads)
+        profile.record(STAGE_GROUP, grouped - start)
+        profile.record(STAGE_SERIALIZE, clock() - grouped)
+        return serialized
+
+    def encode(self, metric_or_metrics, default_metadata=None, max_metrics=None, max_bytes=None, profile=None):
+        """
+        Like format(), but writes each payload straight to compact JSON bytes in a single pass, reusing
+        the pre-encoded metadata of each payload. The result is byte-for-byte what
+        json.dumps(payload, separators=(',', ':')) produces for the payloads format() returns.
+
+        If max_metrics or max_bytes is given, payloads that are too big are split into several request
+        bodies with the same metadata, each holding a subset of the series.
+
+        :param metric_or_metrics:  The metric or metrics to format
+        :param default_metadata: The metric metadata common to all metrics being sent
+        :param max_metrics: The maximum number of series entries per request body, or None
+        :param max_bytes: The maximum size of a request body, or None. A single series entry bigger than
+            this is sent in a body of its own.
+        :param profile: An optional FlushProfile to record the time spent grouping and serializing in
+        :return: List of request bodies (bytes)
+        """
+        start = clock() if profile is not None else None
+        payloads = self.group_payloads(metric_or_metrics, default_metadata)
+        if profile is not None:
+            grouped = clock()
+            profile.record(STAGE_GROUP, grouped - start)
+        if max_metrics is None and max_bytes is None:
+            bodies = [self.encode_payload(p) for p in payloads]
+        else:
+            bodies = []
+            for payload in payloads:
+                bodies.extend(self.encode_payload_chunks(payload, max_metrics, max_bytes))
+        if profile is not None:
+            profile.record(STAGE_SERIALIZE, clock() - grouped)
+        return bodies
+
+    def group_payloads(self, metric_or_metrics, default_metadata):
         indexed_metric_payloads = {}
         # If we get a single metric, make it a list with one element
         if not isinstance(metric_or_metrics, list):
@@ -52,14 +101,17 @@ class T2Formatter(object):
 
         for metric in metrics:
             payload_metadata = default_metadata.copy_with(metric.override_tags)
+            key = payload_metadata
+            if metric.dimensions:
+                key = (payload_metadata, dimensions_key(metric.dimensions))
 
-            if payload_metadata not in indexed_metric_payloads:
-                payload = models.Payload(payload_metadata)
-                indexed_metric_payloads[payload_metadata] = payload
+            if key not in indexed_metric_payloads:
+                payload = models.Payload(payload_metadata, dimensions=metric.dimensions or None)
+                indexed_metric_payloads[key] = payload
 
-            indexed_metric_payloads[payload_metadata].add_metric(metric)
+            indexed_metric_payloads[key].add_metric(metric)
 
-        return self.serialize_payloads(indexed_metric_payloads.values())
+        return list(indexed_metric_payloads.values())
 
     def serialize_payloads(self, metric_payloads):
         all_serialized_payloads = []
@@ -72,16 +124,75 @@ class T2Formatter(object):
                     datapoints = []
                     for metric in payload.metrics[metric_type][metric_name]:
                         datapoints.append(self._format_single_metric(metric))
-                    payload_body[metric_type].append({'name': metric_name, 'series': datapoints})
+                    entry = {'name': metric_name, 'series': datapoints}
+                    if payload.dimensions:
+                        entry['config'] = payload.dimensions
+                    payload_body[metric_type].append(entry)
 
             all_serialized_payloads.append(payload_body)
 
         return all_serialized_payloads
 
+    def encode_payload(self, payload):
+        out = [payload.metadata.json_prefix()]
+        append = out.append
+        encode_name = self._names.encode
+        entry_suffix = ']' + encode_config(payload.dimensions) + '}'
+        for metric_type in payload.metrics.keys():
+            append(',"')
+            append(metric_type)
+            append('":[')
+            for i, metric_name in enumerate(payload.metrics[metric_type].keys()):
+                append('{"name":' if i == 0 else ',{"name":')
+                append(encode_name(metric_name))
+                append(',"series":[')
+                append(','.join([self._encode_single_metric(metric)
+                                 for metric in payload.metrics[metric_type][metric_name]]))
+                append(entry_suffix)
+            append(']')
+        append('}')
+        return ''.join(out).encode('ascii')
+
+    def encode_payload_chunks(self, payload, max_metrics=None, max_bytes=None):
+        writer = ChunkWriter(payload.metadata.json_prefix(), '}', max_metrics, max_bytes)
+        encode_name = self._names.encode
+        entry_suffix = ']' + encode_config(payload.dimensions) + '}'
+        for metric_type in payload.metrics.keys():
+            writer.open(',"' + metric_type + '":[', ']')
+            for metric_name in payload.metrics[metric_type].keys():
+                writer.open('{"name":' + encode_name(metric_name) + ',"series":[', entry_suffix)
+                for metric in payload.metrics[metric_type][metric_name]:
+                    writer.item(self._encode_single_metric(metric))
+                writer.close()
+            writer.close()
+        return writer.finish()
+
+    def _encode_single_metric(self, metric):
+        if type(metric) not in self._encodable_types:
+            return 'null'
+        if isinstance(metric, models.AggregatedMetric):
+            values = ','.join(['{"value":' + encode_number(value) + ',"count":' + encode_number(count) + '}'
+                               for value, count in metric.value_counts()])
+        else:
+            weight = getattr(metric, 'sample_weight', 1)
+            values = '{"value":' + encode_number(metric.value) + (
+                ',"count":1}' if weight == 1 else ',"count":' + encode_number(weight) + '}')
+        return '{"second":' + encode_number(metric.timestamp) + ',"values":[' + values + ']}'
+
+    _encodable_types = frozenset([
+        models.TimerMetric,
+        models.DeltaCounterMetric,
+        models.AggregatedMetric,
+        models.GaugeMetric,
+        models.CumulativeCounterMetric,
+        models.Metric,
+    ])
+
     def _format_single_metric(self, metric):
         dispatch_table = {
             models.TimerMetric: self._format_single_uow_metric,
             models.DeltaCounterMetric: self._format_single_uow_metric,
+            models.AggregatedMetric: self._format_single_uow_metric,
 
             models.GaugeMetric: self._format_single_raw_metric,
             models.CumulativeCounterMetric: self._format_single_raw_metric,
@@ -95,20 +206,21 @@ class T2Formatter(object):
         return self._format_series_metric(metric)
 
     def _format_series_metric(self, metric):
-        return {'second': metric.timestamp, 'values': [{'value': metric.value, 'count': 1}]}
+        if isinstance(metric, models.AggregatedMetric):
+            values = [{'value': value, 'count': count} for value, count in metric.value_counts()]
+            return {'second': metric.timestamp, 'values': values}
+        return {'second': metric.timestamp,
+                'values': [{'value': metric.value, 'count': getattr(metric, 'sample_weight', 1)}]}
 
     def _format_single_raw_metric(self, metric):
         return {
-                    "timestamp": self._get_t2_timestamp(metric.timestamp),
+                    "timestamp": metric.timestamp,
                     "value": metric.value,
                }
 
     def _format_single_uow_metric(self, metric):
         return {
-                    "timestamp": self._get_t2_timestamp(metric.timestamp),
+                    "timestamp": metric.timestamp,
                     "value": metric.value,
                     "uowCount": metric.units_of_work,
                }
-
-    def _get_t2_timestamp(self, timestamp):
-        return (timestamp - self.epoch).total_seconds() * 1000  # timestamps are in ms, monotonic() returns ns
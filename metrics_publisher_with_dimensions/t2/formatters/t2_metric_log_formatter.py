@@ -1,13 +1,12 @@
 import logging
 import json
-import datetime
+
+from ..models import AggregatedMetric
 
 logger = logging.getLogger(__name__)
 
 
 class T2MetricLogFormatter(object):
-    epoch = datetime.datetime.utcfromtimestamp(0)
-
     def format(self, metric):
         """
         Formats a metric for writing to the metric log
@@ -22,12 +21,14 @@ class T2MetricLogFormatter(object):
             "series":
                 [
                     {
-                        "second": self._get_t2_timestamp(metric.timestamp),
-                        "values": [{"value": metric.value, "count": 1}]
+                        "second": metric.timestamp,
+                        "values": self._format_values(metric)
                     }
 
                 ]
         }, sort_keys=True)
 
-    def _get_t2_timestamp(self, timestamp):
-        return (timestamp - self.epoch).total_seconds() * 1000
+    def _format_values(self, metric):
+        if isinstance(metric, AggregatedMetric):
+            return [{"value": value, "count": count} for value, count in metric.value_counts()]
+        return [{"value": metric.value, "count": getattr(metric, 'sample_weight', 1)}]
@@ -1,4 +1,8 @@
 from .. import models
+from ..models.metric import dimensions_key
+from ..models.histogram import LogLinearQuantizer, DEFAULT_MAX_BUCKETS
+from .json_encoding import ChunkWriter, StringCache, encode_config, encode_number
+from ..profiling import STAGE_GROUP, STAGE_SERIALIZE, clock
 
 import logging
 
@@ -6,7 +10,19 @@ logger = logging.getLogger(__name__)
 
 
 class T2OverlayFormatter(object):
-    def format(self, metric_or_metrics, default_metadata=None):
+    def __init__(self, histogram_relative_accuracy=None, histogram_max_buckets=DEFAULT_MAX_BUCKETS):
+        """
+        :param histogram_relative_accuracy: If set, timer values are quantized into log-linear buckets that
+            report every value within this relative error, so each series carries a bounded number of
+            (value, count) pairs whatever the sample volume. By default values are only merged when equal.
+        :param histogram_max_buckets: The maximum number of (value, count) pairs per timer series in histogram mode
+        """
+        self._names = StringCache()
+        self.quantizer = None
+        if histogram_relative_accuracy is not None:
+            self.quantizer = LogLinearQuantizer(histogram_relative_accuracy, max_buckets=histogram_max_buckets)
+
+    def format(self, metric_or_metrics, default_metadata=None, profile=None):
         """
         Formatter for Overlay metrics.
 
@@ -40,11 +56,58 @@ class T2OverlayFormatter(object):
             ],
         }
 
+        Metrics are grouped into payloads by metadata and dimensions. Each entry of a payload of metrics with
+        dimensions carries them as its "config".
+
         :param metric_or_metrics:  The metric or metrics to format
         :param default_metadata: The metric metadata common to all metrics being sent. Metadata attached
             to a metric will override any of the default_metadata values.
+        :param profile: An optional FlushProfile to record the time spent grouping and serializing in
         :return: List of payloads ready for serialization to the T2 service
         """
+        if profile is None:
+            return self.serialize_payloads(self.group_payloads(metric_or_metrics, default_metadata))
+        start = clock()
+        payloads = self.group_payloads(metric_or_metrics, default_metadata)
+        grouped = clock()
+        serialized = self.serialize_payloads(payloads)
+        profile.record(STAGE_GROUP, grouped - start)
+        profile.record(STAGE_SERIALIZE, clock() - grouped)
+        return serialized
+
+    def encode(self, metric_or_metrics, default_metadata=None, max_metrics=None, max_bytes=None, profile=None):
+        """
+        Like format(), but writes each payload straight to compact JSON bytes in a single pass, reusing
+        the pre-encoded metadata of each payload. The result is byte-for-byte what
+        json.dumps(payload, separators=(',', ':')) produces for the payloads format() returns.
+
+        If max_metrics or max_bytes is given, payloads that are too big are split into several request
+        bodies with the same metadata, each holding a subset of the series.
+
+        :param metric_or_metrics:  The metric or metrics to format
+        :param default_metadata: The metric metadata common to all metrics being sent
+        :param max_metrics: The maximum number of series (one per metric name and second) per request body, or None
+        :param max_bytes: The maximum size of a request body, or None. A single series bigger than this is
+            sent in a body of its own.
+        :param profile: An optional FlushProfile to record the time spent grouping and serializing in
+        :return: List of request bodies (bytes)
+        """
+        start = clock() if profile is not None else None
+        payloads = self.group_payloads(metric_or_metrics, default_metadata)
+        if profile is not None:
+            grouped = clock()
+            profile.record(STAGE_GROUP, grouped - start)
+        if max_metrics is None and max_bytes is None:
+            bodies = [self.encode_payload(p) for p in payloads]
+        else:
+            bodies = []
+            for payload in payloads:
+                bodies.extend(self.encode_payload_chunks(payload, max_metrics, max_bytes))
+        if profile is not None:
+            profile.record(STAGE_SERIALIZE, clock() - grouped)
+        return bodies
+
+    def group_payloads(self, metric_or_metrics, default_metadata):
         metrics_by_metadata = {}
 
         # If we get a single metric, make it a list with one element
@@ -55,14 +118,18 @@ class T2OverlayFormatter(object):
 
         for metric in metrics:
             payload_metadata = default_metadata.copy_with(metric.override_tags, include_region=True)
+            key = payload_metadata
+            if metric.dimensions:
+                key = (payload_metadata, dimensions_key(metric.dimensions))
 
-            if payload_metadata not in metrics_by_metadata:
-                payload = models.OverlayPayload(payload_metadata)
-                metrics_by_metadata[payload_metadata] = payload
+            if key not in metrics_by_metadata:
+                payload = models.OverlayPayload(payload_metadata, quantizer=self.quantizer,
+                                                dimensions=metric.dimensions or None)
+                metrics_by_metadata[key] = payload
 
-            metrics_by_metadata[payload_metadata].add_metric(metric)
+            metrics_by_metadata[key].add_metric(metric)
 
-        return self.serialize_payloads(metrics_by_metadata.values())
+        return list(metrics_by_metadata.values())
 
     def serialize_payloads(self, metric_payloads):
         all_serialized_payloads = []
@@ -75,7 +142,11 @@ class T2OverlayFormatter(object):
         return all_serialized_payloads
 
     def serialize_payload(self, payload):
-        return [self.serialize_overlay_metric(m) for m in payload.metrics]
+        metrics = [self.serialize_overlay_metric(m) for m in payload.metrics]
+        if payload.dimensions:
+            for m in metrics:
+                m["config"] = payload.dimensions
+        return metrics
 
     def serialize_overlay_metric(self, metric):
         return {
@@ -94,3 +165,35 @@ class T2OverlayFormatter(object):
             "count": value.count,
             "value": value.value
         }
+
+    def encode_payload(self, payload):
+        out = [payload.metadata.json_prefix(include_region=True), ',"metrics":[']
+        append = out.append
+        encode_name = self._names.encode
+        entry_suffix = ']' + encode_config(payload.dimensions) + '}'
+        for i, metric in enumerate(payload.metrics):
+            append('{"name":' if i == 0 else ',{"name":')
+            append(encode_name(metric.name))
+            append(',"series":[')
+            append(','.join([self._encode_series(series) for series in metric.series]))
+            append(entry_suffix)
+        append(']}')
+        return ''.join(out).encode('ascii')
+
+    def encode_payload_chunks(self, payload, max_metrics=None, max_bytes=None):
+        writer = ChunkWriter(payload.metadata.json_prefix(include_region=True), '}', max_metrics, max_bytes)
+        encode_name = self._names.encode
+        entry_suffix = ']' + encode_config(payload.dimensions) + '}'
+        writer.open(',"metrics":[', ']')
+        for metric in payload.metrics:
+            writer.open('{"name":' + encode_name(metric.name) + ',"series":[', entry_suffix)
+            for series in metric.series:
+                writer.item(self._encode_series(series))
+            writer.close()
+        writer.close()
+        return writer.finish()
+
+    def _encode_series(self, series):
+        return '{"second":' + encode_number(series.t2_timestamp) + ',"values":[' + ','.join(
+            ['{"count":' + encode_number(v.count) + ',"value":' + encode_number(v.value) + '}'
+             for v in series.values]) + ']}'
@@ -0,0 +1,67 @@
+import copy
+import functools
+import inspect
+
+from .cumulative_counter import CumulativeCounter
+from .delta_counter import DeltaCounter
+from .gauge import Gauge
+from .scope import Scope
+from .timer import _Timer
+
+
+class AsyncContextMixin(object):
+    """
+    Lets an instrument be used with `async with`, and as a decorator of coroutine functions.
+    The instrument's synchronous __enter__/__exit__ do the actual work; none of them block.
+    Each call of a decorated coroutine function uses a copy of the instrument, so calls running
+    concurrently on the event loop don't overwrite each other's start time, counts or values.
+    """
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return self.__exit__(exc_type, exc_val, exc_tb)
+
+    def __call__(self, f):
+        if not inspect.iscoroutinefunction(f):
+            return super(AsyncContextMixin, self).__call__(f)
+
+        @functools.wraps(f)
+        async def decorated(*args, **kwargs):
+            async with copy.copy(self):
+                return await f(*args, **kwargs)
+
+        return decorated
+
+
+class AsyncTimer(AsyncContextMixin, _Timer):
+    def __call__(self, f):
+        if not inspect.iscoroutinefunction(f):
+            return super(AsyncTimer, self).__call__(f)
+
+        # Like _Timer.__call__, each call keeps its own start time
+        @functools.wraps(f)
+        async def timed(*args, **kwargs):
+            start = self._enter_call()
+            try:
+                return await f(*args, **kwargs)
+            finally:
+                self._exit_call(start)
+
+        return timed
+
+
+class AsyncScope(AsyncContextMixin, Scope):
+    pass
+
+
+class AsyncDeltaCounter(AsyncContextMixin, DeltaCounter):
+    pass
+
+
+class AsyncGauge(AsyncContextMixin, Gauge):
+    pass
+
+
+class AsyncCumulativeCounter(AsyncContextMixin, CumulativeCounter):
+    pass
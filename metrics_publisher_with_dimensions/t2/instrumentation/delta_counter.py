@@ -53,10 +53,13 @@ class DeltaCounter(contextdecorator.ContextDecorator, UnitOfWorkMixin):
 
     def submit(self, units_of_work=None):
         """
-        Submit the metric from this counter
+        Submit the metric from this counter, unless the client's sampler skips it
         :param units_of_work: And alternate value to submit for units of work
         :return: None -- side-effect is to submit the metric to the client.
         """
+        weight = self._sample()
+        if not weight:
+            return
         uow = units_of_work or self.units_of_work
-        self.client.submit(DeltaCounterMetric(self.metric_name, self._value, units_of_work=uow,
-                                              override_tags=self.override_tags))
+        self.client.submit(DeltaCounterMetric(self.metric_name, self._value, units_of_work=uow * weight,
+                                              override_tags=self.override_tags, sample_weight=weight))
@@ -72,4 +72,5 @@ class Gauge(contextdecorator.ContextDecorator, InstrumentationBase):
         Submit the result to the metric client
         :return: None -- side-effect is to submit the metric to the client.
         """
-        self.client.submit(GaugeMetric(self.metric_name, self.value, override_tags=self.override_tags), self.dimensions)
+        self.client.submit(GaugeMetric(self.metric_name, self.value, override_tags=self.override_tags,
+                                       dimensions=self.dimensions))
@@ -1,11 +1,28 @@
 import monotonic
 
+try:
+    from time import perf_counter_ns as clock_ns
+except ImportError:  # Python < 3.7
+    def clock_ns():
+        return int(monotonic.monotonic() * 1e9)
+
 
 class InstrumentationBase(object):
     @property
     def metric_name(self):
         return self.client.get_scoped_metric_name()
 
+    def _sample(self):
+        """
+        :return: The sample weight to record this call's metric with, or 0 if the client's sampler skips the call
+        """
+        sampler = getattr(self.client, "sampler", None)
+        return 1 if sampler is None else sampler.sample(self.client.get_scoped_metric_name())
+
+    def _sample_weight(self, name):
+        sampler = getattr(self.client, "sampler", None)
+        return 1 if sampler is None else sampler.interval(name)
+
 
 class UnitOfWorkMixin(InstrumentationBase):
     @property
@@ -0,0 +1,73 @@
+import random
+
+# Upper bound on the number of metric names whose sampling interval is cached
+MAX_CACHED_NAMES = 10000
+
+
+class Sampler(object):
+    def __init__(self, default_rate=1.0, rates=None, prefix_rates=None):
+        """
+        A Sampler decides which calls of an instrument are recorded, so that instruments on very hot code paths
+        cost next to nothing most of the time. Every metric name gets a sampling rate: its own, or that of the
+        longest prefix it starts with, or the default. A rate is rounded to "1 in N" calls, and each call is
+        recorded with probability 1/N.
+
+        A recorded metric stands for N calls: its sample_weight is N, which is the count the formatters report
+        for it, and its units of work are multiplied by N. Counts, sums and units of work in T2 are therefore
+        correct on average.
+
+        The interval of a name is looked up once and cached. This class is thread-safe.
+
+        :param default_rate: The rate of names that no other rate applies to, from 0 (record nothing) to 1
+            (record everything)
+        :param rates: Optional dictionary of metric name to rate
+        :param prefix_rates: Optional dictionary of metric name prefix to rate, e.g. {"Api.GetWidget": 0.01}
+        """
+        self.default_interval = _one_in(default_rate)
+        self._intervals_by_name = dict((name, _one_in(rate)) for name, rate in (rates or {}).items())
+        # Longest prefixes first, so that the first match is the most specific one
+        self._intervals_by_prefix = sorted([(prefix, _one_in(rate)) for prefix, rate in (prefix_rates or {}).items()],
+                                           key=lambda item: -len(item[0]))
+        self._intervals = {}
+        self._random = random.random
+
+    def interval(self, name):
+        """
+        :param name: A metric name
+        :return: N if metrics named name are sampled 1 in N calls, or 0 if they are never recorded
+        """
+        n = self._intervals.get(name)
+        if n is None:
+            n = self._resolve(name)
+            if len(self._intervals) >= MAX_CACHED_NAMES:
+                self._intervals.clear()
+            self._intervals[name] = n
+        return n
+
+    def sample(self, name):
+        """
+        Decide whether to record a call
+        :param name: The name of the metric the call would produce
+        :return: The sample weight (N) to record the call's metric with, or 0 if the call isn't recorded
+        """
+        n = self.interval(name)
+        if n == 1 or (n and self._random() * n < 1.0):
+            return n
+        return 0
+
+    def _resolve(self, name):
+        n = self._intervals_by_name.get(name)
+        if n is not None:
+            return n
+        for prefix, n in self._intervals_by_prefix:
+            if name.startswith(prefix):
+                return n
+        return self.default_interval
+
+
+def _one_in(rate):
+    if not 0 <= rate <= 1:
+        raise ValueError("Sampling rates must be between 0 and 1, got {}".format(rate))
+    if rate == 0:
+        return 0
+    return max(1, int(round(1.0 / rate)))
@@ -1,8 +1,8 @@
-from t2.models import Metric
+from ..models import Metric
 
 import contextdecorator
 
-from t2.models import TimerMetric
+from ..models import TimerMetric
 from .mixins import MonotonicTimerMixin, UnitOfWorkMixin
 
 
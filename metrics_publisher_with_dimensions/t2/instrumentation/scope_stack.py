@@ -0,0 +1,57 @@
+import threading
+
+try:
+    import contextvars
+except ImportError:  # Python < 3.7
+    contextvars = None
+
+
+class ScopeStack(object):
+    def __init__(self):
+        """
+        A ScopeStack holds the names of the scopes a piece of code is in, and the metric name prefix
+        they make, e.g. "Api.GetWidget". Each frame is an immutable (parent frame, prefix) pair, so
+        entering or leaving a scope and reading the prefix all take constant time, however deep the
+        nesting.
+
+        The current frame lives in a ContextVar: every thread starts with an empty stack, and every
+        asyncio task starts with the stack of the code that created it, so concurrent coroutines on
+        one thread don't see each other's scopes. Without contextvars (before Python 3.7) it lives in
+        a threading.local instead.
+        """
+        if contextvars is not None:
+            self._frame = contextvars.ContextVar("metrics_scope_stack", default=None)
+            self._get = self._frame.get
+            self._set = self._frame.set
+        else:
+            self._frame = threading.local()
+            self._get = self._get_thread_local
+            self._set = self._set_thread_local
+
+    def enter(self, name):
+        """
+        :param name: The name of the scope being entered
+        :return: None
+        """
+        frame = self._get()
+        self._set((frame, name if frame is None else frame[1] + "." + name))
+
+    def leave(self):
+        frame = self._get()
+        if frame is None:
+            raise IndexError("Left a scope that was never entered")
+        self._set(frame[0])
+
+    @property
+    def prefix(self):
+        """
+        :return: The names of the scopes the caller is in, joined by dots, or "" outside of any scope
+        """
+        frame = self._get()
+        return "" if frame is None else frame[1]
+
+    def _get_thread_local(self):
+        return getattr(self._frame, "frame", None)
+
+    def _set_thread_local(self, frame):
+        self._frame.frame = frame
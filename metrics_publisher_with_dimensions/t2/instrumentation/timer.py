@@ -1,7 +1,9 @@
+import functools
+
 import contextdecorator
 
-from t2.models import TimerMetric
-from .mixins import MonotonicTimerMixin, UnitOfWorkMixin
+from ..models import TimerMetric
+from .mixins import MonotonicTimerMixin, UnitOfWorkMixin, clock_ns
 
 
 class _Timer(contextdecorator.ContextDecorator, MonotonicTimerMixin, UnitOfWorkMixin):
@@ -20,18 +22,64 @@ class _Timer(contextdecorator.ContextDecorator, MonotonicTimerMixin, UnitOfWorkM
         self.name = name
         self._units_of_work = units_of_work
         self.override_tags = override_tags
+        self.sample_weight = 1
 
     def __enter__(self):
         self.client.enter_scope(self.name)
-        self.start()
+        # A call the client's sampler skips isn't timed at all
+        self.sample_weight = self._sample()
+        if self.sample_weight:
+            self.start()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.stop()
-        self.submit()
+        if self.sample_weight:
+            self.stop()
+            self.submit()
         self.client.leave_scope()
 
     def submit(self, units_of_work=None):
         uow = units_of_work or self.units_of_work
-        self.client.submit(TimerMetric(self.metric_name, self.elapsed_ms, units_of_work=uow,
-                                       override_tags=self.override_tags))
+        weight = self.sample_weight or 1
+        self.client.submit(TimerMetric(self.metric_name, self.elapsed_ms, units_of_work=uow * weight,
+                                       override_tags=self.override_tags, sample_weight=weight))
+
+    def __call__(self, f):
+        """
+        Decorate f so that every call to it is timed. Each call keeps its own start time, and this Timer
+        is never modified, so the decorated function may be called from several threads (or recursively).
+        :param f: The function to time
+        :return: The decorated function
+        """
+        enter_call = self._enter_call
+        exit_call = self._exit_call
+
+        @functools.wraps(f)
+        def timed(*args, **kwargs):
+            start = enter_call()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                exit_call(start)
+
+        return timed
+
+    def _enter_call(self):
+        self.client.enter_scope(self.name)
+        if not self._sample():
+            return None
+        return clock_ns()
+
+    def _exit_call(self, start):
+        if start is None:
+            # Skipped by the sampler
+            self.client.leave_scope()
+            return
+        elapsed_ms = (clock_ns() - start) / 1e6
+        try:
+            name = self.client.get_scoped_metric_name()
+            weight = self._sample_weight(name)
+            self.client.submit(TimerMetric(name, elapsed_ms, units_of_work=self._units_of_work * weight,
+                                           override_tags=self.override_tags, sample_weight=weight))
+        finally:
+            self.client.leave_scope()
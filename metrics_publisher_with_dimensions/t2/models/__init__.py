@@ -3,7 +3,9 @@ from . import timer_metric
 from . import gauge_metric
 from . import cumulative_counter_metric
 from . import delta_counter_metric
+from . import aggregated_metric
 from . import payload
+from . import metric_buffer
 
 Metric = metric.Metric
 MetricMetadata = metric.MetricMetadata
@@ -11,5 +13,8 @@ TimerMetric = timer_metric.TimerMetric
 GaugeMetric = gauge_metric.GaugeMetric
 DeltaCounterMetric = delta_counter_metric.DeltaCounterMetric
 CumulativeCounterMetric = cumulative_counter_metric.CumulativeCounterMetric
+AggregatedMetric = aggregated_metric.AggregatedMetric
 Payload = payload.Payload
 OverlayPayload = payload.OverlayPayload
+ColumnarMetricBuffer = metric_buffer.ColumnarMetricBuffer
+ColumnarBatch = metric_buffer.ColumnarBatch
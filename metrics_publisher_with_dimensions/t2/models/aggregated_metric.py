@@ -0,0 +1,72 @@
+from .unit_of_work_metric import UnitsOfWorkMetric
+
+
+class AggregatedMetric(UnitsOfWorkMetric):
+    __slots__ = ('metric_class', 'count', 'min', 'max')
+
+    def __init__(self, name, metric_class, timestamp=None, override_tags=None):
+        """
+        An AggregatedMetric is a cell that folds many metrics of the same name, metadata, type and
+        time bucket into count/sum/min/max/uowCount. It is produced by
+        :py:class: `t2.aggregation.aggregator.MetricAggregator` and is formatted as if it were a
+        metric of `metric_class`.
+
+        :param name: The name of the aggregated metric
+        :param metric_class: The metric class that was folded into this cell (e.g. TimerMetric)
+        :param timestamp: The start of the time bucket this cell covers
+        :param override_tags: Optional dictionary of tags to override the default metadata
+        """
+        super(AggregatedMetric, self).__init__(
+            name,
+            0,
+            timestamp=timestamp,
+            units_of_work=0,
+            override_tags=override_tags)
+        self.metric_class = metric_class
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    @property
+    def sum(self):
+        return self.value
+
+    def fold(self, value, units_of_work=1, sample_weight=1):
+        """
+        Fold a single observation into this cell
+        :param value: The observed value
+        :param units_of_work: The units of work of the observation
+        :param sample_weight: How many observations this one stands for, if it was sampled
+        :return: None
+        """
+        if self.count == 0 or value < self.min:
+            self.min = value
+        if self.count == 0 or value > self.max:
+            self.max = value
+        self.count += sample_weight
+        self.value += value * sample_weight
+        self.units_of_work += units_of_work
+
+    def value_counts(self):
+        """
+        Express this cell as (value, count) pairs, the shape T2 series values use.
+        At most three pairs are returned and they preserve count, sum, min and max exactly:
+        the minimum and maximum once each, and the mean of the remaining observations.
+        :return: list of (value, count) tuples
+        """
+        if self.count == 1 or self.min == self.max:
+            return [(self.min, self.count)]
+        if self.count == 2:
+            return [(self.min, 1), (self.max, 1)]
+        rest = (self.value - self.min - self.max) / float(self.count - 2)
+        return [(self.min, 1), (rest, self.count - 2), (self.max, 1)]
+
+    def to_dict(self):
+        return {
+            "timestamp": self.timestamp,
+            "count": self.count,
+            "sum": self.value,
+            "min": self.min,
+            "max": self.max,
+            "uowCount": self.units_of_work,
+        }
@@ -0,0 +1,49 @@
+import math
+
+from . import timer_metric
+
+DEFAULT_RELATIVE_ACCURACY = 0.02
+DEFAULT_MAX_BUCKETS = 256
+# Values closer to zero than this are all reported as zero
+DEFAULT_MIN_VALUE = 1e-9
+
+
+class LogLinearQuantizer(object):
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, max_buckets=DEFAULT_MAX_BUCKETS,
+                 min_value=DEFAULT_MIN_VALUE, metric_types=(timer_metric.TimerMetric,)):
+        """
+        A LogLinearQuantizer maps values onto buckets whose bounds grow geometrically, so that the
+        value reported for a bucket is within relative_accuracy of every value that falls into it
+        (the DDSketch mapping). Overlay series that quantize their values hold one (value, count)
+        pair per bucket instead of one per distinct value, and never more than max_buckets pairs:
+        when a series has too many, its lowest buckets are merged.
+
+        :param relative_accuracy: The largest relative error of a reported value, between 0 and 1
+        :param max_buckets: The maximum number of (value, count) pairs per series
+        :param min_value: Values whose magnitude is below this are reported as 0
+        :param metric_types: The metric types whose values are quantized. Counters are left exact by default.
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        if max_buckets < 2:
+            raise ValueError("max_buckets must be at least 2")
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+        self.metric_types = frozenset(metric_types)
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._multiplier = 1 / math.log(self._gamma)
+
+    def quantize(self, value):
+        """
+        :param value: A raw value
+        :return: The value reported for the bucket that value falls into. NaN and infinities are returned as-is.
+        """
+        magnitude = abs(value)
+        if magnitude < self.min_value:
+            return 0.0
+        if not magnitude < float('inf'):
+            return value
+        index = math.ceil(math.log(magnitude) * self._multiplier)
+        bucket_value = 2 * self._gamma ** index / (self._gamma + 1)
+        return bucket_value if value > 0 else -bucket_value
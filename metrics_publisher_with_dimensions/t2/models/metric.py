@@ -1,6 +1,7 @@
 from datetime import datetime
 import json
 import hashlib
+import time
 
 REGION_KEY = 'region'
 AVAILABILTY_DOMAIN_KEY = 'availabilityDomain'
@@ -8,24 +9,53 @@ PROJECT_KEY = 'project'
 FLEET_KEY = 'fleet'
 HOSTNAME_KEY = 'hostname'
 
+EPOCH = datetime.utcfromtimestamp(0)
+
 
 class MetricMetadata(object):
+    __slots__ = ('project', 'fleet', 'hostname', 'availabilityDomain', 'region',
+                 '_key', '_hash', '_json_string', '_md5_hash', '_copies', '_json_prefixes')
+
+    # Upper bound on the number of interned copy_with() results kept per metadata object
+    MAX_INTERNED_COPIES = 1024
 
     def __init__(self, project, fleet=None, hostname=None, availabilityDomain=None, region=None):
         """
         MetricMetadata is data about the metric that's not the name or value.
         This metadata is used by the T2 system.
 
+        MetricMetadata is an immutable value type: its hash, JSON string and md5 hash are computed
+        at most once, and copy_with() results are interned so that the same overrides map to the
+        same object.
+
         :param project: The name of the project the metric belongs to
         :param fleet: The name of the fleet this metric belongs to
         :param hostname: The hostname that emitted this metric
         :param availabilityDomain: The availability domain for this metric
+        :param region: The region for this metric
         """
-        self.project = project
-        self.fleet = fleet
-        self.hostname = hostname
-        self.availabilityDomain = availabilityDomain
-        self.region = region
+        _set = object.__setattr__
+        _set(self, 'project', project)
+        _set(self, 'fleet', fleet)
+        _set(self, 'hostname', hostname)
+        _set(self, 'availabilityDomain', availabilityDomain)
+        _set(self, 'region', region)
+        key = (availabilityDomain, project, fleet, hostname, region)
+        _set(self, '_key', key)
+        _set(self, '_hash', hash(key))
+        _set(self, '_json_string', None)
+        _set(self, '_md5_hash', None)
+        _set(self, '_copies', {})
+        _set(self, '_json_prefixes', [None, None])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MetricMetadata is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("MetricMetadata is immutable")
+
+    def __reduce__(self):
+        return MetricMetadata, (self.project, self.fleet, self.hostname, self.availabilityDomain, self.region)
 
     def to_dict(self, include_region=False):
         d = {
@@ -41,46 +71,138 @@ class MetricMetadata(object):
         return d
 
     def copy_with(self, override_tags, include_region=False):
-        if override_tags is None:
-            override_tags = {}
+        """
+        Get the metadata obtained by applying override_tags to this metadata. Results are interned
+        per (override_tags, include_region), so repeated calls cost a single dict lookup.
+        :param override_tags: Optional dictionary of tags to override this metadata. Tag values must be hashable.
+        :param include_region: Whether to carry the region over to the copy
+        :return: MetricMetadata
+        """
+        key = (frozenset(override_tags.items()) if override_tags else None, include_region)
+
+        copy = self._copies.get(key)
+        if copy is None:
+            copy = self._copy_with(override_tags, include_region)
+            if len(self._copies) >= self.MAX_INTERNED_COPIES:
+                self._copies.clear()
+            self._copies[key] = copy
+        return copy
+
+    def _copy_with(self, override_tags, include_region):
         new_metadata = self.to_dict(include_region=include_region)
-        new_metadata.update(override_tags)
+        if override_tags:
+            new_metadata.update(override_tags)
         return MetricMetadata(**new_metadata)
 
     @property
     def json_string(self):
-        return json.dumps(self.to_dict(), sort_keys=True)
+        if self._json_string is None:
+            object.__setattr__(self, '_json_string', json.dumps(self.to_dict(), sort_keys=True))
+        return self._json_string
+
+    def json_prefix(self, include_region=False):
+        """
+        The compact JSON text of to_dict(include_region) without its closing brace, so that a serializer can
+        append more keys to it. It is computed once per metadata object.
+        :param include_region: Whether to include the region
+        :return: str
+        """
+        index = 1 if include_region else 0
+        prefix = self._json_prefixes[index]
+        if prefix is None:
+            prefix = json.dumps(self.to_dict(include_region=include_region), separators=(',', ':'))[:-1]
+            self._json_prefixes[index] = prefix
+        return prefix
 
     @property
     def md5_hash(self):
-        return hashlib.md5(self.json_string.encode('utf-8')).hexdigest()
+        if self._md5_hash is None:
+            object.__setattr__(self, '_md5_hash', hashlib.md5(self.json_string.encode('utf-8')).hexdigest())
+        return self._md5_hash
 
     def __hash__(self):
-        return hash(tuple((k, self.to_dict()[k]) for k in sorted(self.to_dict())))
+        return self._hash
 
     def __eq__(self, other):
-        return type(self) == type(other) and self.__hash__() == other.__hash__()
+        return self is other or (type(self) is type(other) and self._key == other._key)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "MetricMetadata(project={!r}, fleet={!r}, hostname={!r}, availabilityDomain={!r}, region={!r})".format(
+            self.project, self.fleet, self.hostname, self.availabilityDomain, self.region)
 
 
 class Metric(object):
-    def __init__(self, name, value, timestamp=None, override_tags=None):
+    __slots__ = ('name', 'value', 'timestamp', 'override_tags', 'dimensions')
+
+    metric_type = "gauge"
+
+    def __init__(self, name, value, timestamp=None, override_tags=None, dimensions=None):
         """
         A metric is a single data point. A metric has a name and a value
         (and a timestamp representing when it was created)
 
         :param name: The name of this metric
         :param value: The value of this metric.
-        :param timestamp: When this metric was created. Defaults to utcnow()
+        :param timestamp: When this metric was created, as a naive UTC datetime or as
+            milliseconds since the epoch. Defaults to now. It is stored as an int of epoch milliseconds.
         :param override_tags: Optional dictionary of tags to override the default metadata
+        :param dimensions: Optional dictionary of dimensions, sent to T2 as the "config" of the metric
         """
         self.name = name
         self.value = value
-        self.timestamp = timestamp or datetime.utcnow()
+        self.timestamp = int(time.time() * 1000) if timestamp is None else epoch_millis(timestamp)
         self.override_tags = override_tags
-        self.metric_type = "gauge"
+        self.dimensions = dimensions
 
     def to_dict(self):
         return {
             "value": self.value,
             "timestamp": self.timestamp,
         }
+
+
+def epoch_millis(timestamp=None):
+    """
+    Convert a timestamp to an int of milliseconds since the epoch
+    :param timestamp: A naive UTC datetime, a number of epoch milliseconds, or None for now
+    :return: int
+    """
+    if timestamp is None:
+        return int(time.time() * 1000)
+    if isinstance(timestamp, datetime):
+        return int((timestamp - EPOCH).total_seconds() * 1000 + .5)
+    return int(timestamp)
+
+
+def dimensions_key(dimensions):
+    """
+    A hashable key for a metric's dimensions, for grouping metrics by them
+    :param dimensions: A dictionary of dimensions, or None
+    :return: None if there are no dimensions, otherwise a key equal for equal dictionaries
+    """
+    if not dimensions:
+        return None
+    try:
+        return frozenset(dimensions.items())
+    except TypeError:
+        # Unhashable values are told apart by their repr
+        return frozenset((name, repr(value)) for name, value in dimensions.items())
+
+
+def set_dimensions(metric_or_metrics, dimensions):
+    """
+    Give metric(s) the same dimensions, unless dimensions is None
+    :param metric_or_metrics: A metric or a list of metrics
+    :param dimensions: A dictionary of dimensions, or None to leave the metrics' dimensions as they are
+    :return: None
+    """
+    if dimensions is None:
+        return
+    if isinstance(metric_or_metrics, list):
+        for m in metric_or_metrics:
+            m.dimensions = dimensions
+    elif metric_or_metrics is not None:
+        metric_or_metrics.dimensions = dimensions
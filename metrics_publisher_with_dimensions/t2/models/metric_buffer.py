@@ -0,0 +1,199 @@
+import logging
+from array import array
+
+from . import metric
+from . import gauge_metric
+from . import timer_metric
+from . import delta_counter_metric
+from . import cumulative_counter_metric
+from . import unit_of_work_metric
+
+logger = logging.getLogger(__name__)
+
+# The position of a class in this tuple is its type code in the buffer
+COLUMNAR_TYPES = (
+    metric.Metric,
+    gauge_metric.GaugeMetric,
+    timer_metric.TimerMetric,
+    delta_counter_metric.DeltaCounterMetric,
+    cumulative_counter_metric.CumulativeCounterMetric,
+)
+TYPE_CODES = dict((cls, code) for code, cls in enumerate(COLUMNAR_TYPES))
+
+# Values are stored as doubles; these flags restore their original Python type
+FLOAT_VALUE = 0
+INT_VALUE = 1
+
+MAX_INT_VALUE = 2 ** 53
+
+
+class ColumnarMetricBuffer(object):
+    # Reset the name and tag tables once they hold this many entries, so a burst of
+    # high-cardinality names can't grow them forever
+    MAX_TABLE_SIZE = 10000
+
+    def __init__(self):
+        """
+        A ColumnarMetricBuffer holds pending metrics column-wise in typed arrays instead of as
+        individual metric objects. Names and override tags are interned into tables and referred to
+        by id. Metrics that can't be represented in the columns (e.g. aggregated metrics, sampled
+        metrics, metrics with dimensions or non-numeric values) are kept as objects alongside the columns.
+
+        This class is not thread-safe; callers are expected to hold a lock.
+        """
+        self._reset_tables()
+        self._reset_columns()
+
+    def _reset_tables(self):
+        self._names = []
+        self._name_ids = {}
+        self._tags = [None]
+        self._tag_ids = {None: 0}
+
+    def _reset_columns(self):
+        self._name_ids_column = array('l')
+        self._tag_ids_column = array('l')
+        self._type_codes = array('b')
+        self._values = array('d')
+        self._value_kinds = array('b')
+        self._timestamps = array('q')
+        self._units_of_work = array('d')
+        self._others = []
+
+    def __len__(self):
+        return len(self._type_codes) + len(self._others)
+
+    @property
+    def nbytes(self):
+        """
+        :return: The number of bytes held by the columns (not counting the name and tag tables)
+        """
+        columns = (self._name_ids_column, self._tag_ids_column, self._type_codes, self._values,
+                   self._value_kinds, self._timestamps, self._units_of_work)
+        return sum(c.itemsize * len(c) for c in columns)
+
+    def append(self, m):
+        """
+        Add a metric to the buffer
+        :param m: The metric to add
+        :return: None
+        """
+        code = TYPE_CODES.get(type(m))
+        value = m.value
+        value_type = type(value)
+        if value_type is float:
+            kind = FLOAT_VALUE
+        elif value_type is int and -MAX_INT_VALUE < value < MAX_INT_VALUE:
+            kind = INT_VALUE
+        else:
+            code = None
+
+        if code is None or getattr(m, 'sample_weight', 1) != 1 or m.dimensions:
+            self._others.append(m)
+            return
+
+        tags_id = self._tag_id(m.override_tags)
+        if tags_id is None:
+            self._others.append(m)
+            return
+
+        name_id = self._name_ids.get(m.name)
+        if name_id is None:
+            name_id = len(self._names)
+            self._names.append(m.name)
+            self._name_ids[m.name] = name_id
+
+        self._name_ids_column.append(name_id)
+        self._tag_ids_column.append(tags_id)
+        self._type_codes.append(code)
+        self._values.append(value)
+        self._value_kinds.append(kind)
+        self._timestamps.append(m.timestamp)
+        self._units_of_work.append(getattr(m, 'units_of_work', 0))
+
+    def extend(self, metrics):
+        for m in metrics:
+            self.append(m)
+
+    def drain(self):
+        """
+        Remove everything from the buffer
+        :return: A ColumnarBatch holding the drained metrics
+        """
+        batch = ColumnarBatch(self._names, self._tags, self._name_ids_column, self._tag_ids_column,
+                              self._type_codes, self._values, self._value_kinds, self._timestamps,
+                              self._units_of_work, self._others)
+        self._reset_columns()
+        if len(self._names) >= self.MAX_TABLE_SIZE or len(self._tags) >= self.MAX_TABLE_SIZE:
+            # The batch keeps references to the old tables, so it's safe to start new ones
+            self._reset_tables()
+        return batch
+
+    def _tag_id(self, override_tags):
+        if not override_tags:
+            return 0
+        try:
+            key = frozenset(override_tags.items())
+        except TypeError:
+            return None
+        tags_id = self._tag_ids.get(key)
+        if tags_id is None:
+            tags_id = len(self._tags)
+            self._tags.append(override_tags)
+            self._tag_ids[key] = tags_id
+        return tags_id
+
+
+class ColumnarBatch(object):
+    __slots__ = ('names', 'tags', 'name_ids', 'tag_ids', 'type_codes', 'values', 'value_kinds',
+                 'timestamps', 'units_of_work', 'others')
+
+    def __init__(self, names, tags, name_ids, tag_ids, type_codes, values, value_kinds, timestamps,
+                 units_of_work, others):
+        """
+        A ColumnarBatch is a contiguous, picklable snapshot of a ColumnarMetricBuffer.
+        """
+        self.names = names
+        self.tags = tags
+        self.name_ids = name_ids
+        self.tag_ids = tag_ids
+        self.type_codes = type_codes
+        self.values = values
+        self.value_kinds = value_kinds
+        self.timestamps = timestamps
+        self.units_of_work = units_of_work
+        self.others = others
+
+    def __len__(self):
+        return len(self.type_codes) + len(self.others)
+
+    def __getstate__(self):
+        return dict((slot, getattr(self, slot)) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+    def to_metrics(self):
+        """
+        Rebuild the metric objects held by this batch
+        :return: list of metrics
+        """
+        metrics = []
+        append = metrics.append
+        names, tags = self.names, self.tags
+        for i in range(len(self.type_codes)):
+            cls = COLUMNAR_TYPES[self.type_codes[i]]
+            value = self.values[i]
+            if self.value_kinds[i] == INT_VALUE:
+                value = int(value)
+            if issubclass(cls, unit_of_work_metric.UnitsOfWorkMetric):
+                uow = self.units_of_work[i]
+                append(cls(names[self.name_ids[i]], value, timestamp=self.timestamps[i],
+                           units_of_work=int(uow) if uow.is_integer() else uow,
+                           override_tags=tags[self.tag_ids[i]]))
+            else:
+                append(cls(names[self.name_ids[i]], value, timestamp=self.timestamps[i],
+                           override_tags=tags[self.tag_ids[i]]))
+        metrics.extend(self.others)
+        return metrics
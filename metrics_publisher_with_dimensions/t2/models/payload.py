@@ -1,11 +1,12 @@
+import heapq
 import logging
-import datetime
 
 from . import metric
 from . import gauge_metric
 from . import timer_metric
 from . import delta_counter_metric
 from . import cumulative_counter_metric
+from . import aggregated_metric
 
 logger = logging.getLogger(__name__)
 
@@ -17,16 +18,19 @@ MODELS_TO_JSON_KEY_MAP = {
     cumulative_counter_metric.CumulativeCounterMetric: 'cumulativeCounters',
 }
 
-epoch = datetime.datetime.utcfromtimestamp(0)
-
 
 class Payload(object):
-    def __init__(self, metadata):
+    def __init__(self, metadata, dimensions=None):
+        """
+        :param metadata: The metadata of every metric in the payload
+        :param dimensions: The dimensions of every metric in the payload, or None
+        """
         self.metadata = metadata
+        self.dimensions = dimensions
         self.metrics = {}
 
     def add_metric(self, new_metric):
-        metric_type_key = MODELS_TO_JSON_KEY_MAP.get(type(new_metric))
+        metric_type_key = MODELS_TO_JSON_KEY_MAP.get(_model_type(new_metric))
 
         if metric_type_key is None:
             logger.warning("Cannot add a metric type of '{}'".format(type(new_metric)))
@@ -42,49 +46,107 @@ class Payload(object):
 
 
 class OverlayPayload(object):
-    def __init__(self, metadata):
+    def __init__(self, metadata, quantizer=None, dimensions=None):
+        """
+        :param metadata: The metadata of every metric in the payload
+        :param quantizer: An optional LogLinearQuantizer. Series of the metric types it covers hold
+            bucketed (value, count) pairs instead of one pair per distinct value.
+        :param dimensions: The dimensions of every metric in the payload, or None
+        """
         self.metadata = metadata
+        self.dimensions = dimensions
         self.metrics = []
+        self.quantizer = quantizer
+        self._metrics_by_name = {}
 
     def add_metric(self, new_metric):
-        for m in self.metrics:
-            if new_metric.name == m.name:
-                m.add_metric_values(new_metric)
-                return
-
-        m = OverlayMetric(new_metric.name)
+        m = self._metrics_by_name.get(new_metric.name)
+        if m is None:
+            quantizer = self.quantizer
+            if quantizer is not None and _model_type(new_metric) not in quantizer.metric_types:
+                quantizer = None
+            m = OverlayMetric(new_metric.name, quantizer)
+            self._metrics_by_name[new_metric.name] = m
+            self.metrics.append(m)
         m.add_metric_values(new_metric)
-        self.metrics.append(m)
+
+    def add_value_counts(self, name, timestamp, value_counts):
+        """
+        Add values that were already counted elsewhere, such as a series read back from a metric log tap.
+        They are never quantized: their metric type isn't known.
+        :param name: The metric name
+        :param timestamp: The second of the series, in epoch milliseconds
+        :param value_counts: (value, count) pairs
+        :return: None
+        """
+        m = self._metrics_by_name.get(name)
+        if m is None:
+            m = OverlayMetric(name)
+            self._metrics_by_name[name] = m
+            self.metrics.append(m)
+        series = m.series_at(timestamp)
+        for value, count in value_counts:
+            series.add_value(value, count)
 
 
 class OverlayMetric(object):
-    def __init__(self, name):
+    def __init__(self, name, quantizer=None):
         self.name = name
         self.series = []
+        self.quantizer = quantizer
+        self._series_by_timestamp = {}
 
     def add_metric_values(self, m):
-        for s in self.series:
-            if s.t2_timestamp == _format_t2_timestamp(m.timestamp):
-                s.add_value(m.value)
-                return
+        _add_values(self.series_at(m.timestamp), m)
 
-        new_series = Series(m.timestamp)
-        new_series.add_value(m.value)
-        self.series.append(new_series)
+    def series_at(self, timestamp):
+        series = self._series_by_timestamp.get(timestamp)
+        if series is None:
+            series = Series(timestamp, self.quantizer)
+            self._series_by_timestamp[timestamp] = series
+            self.series.append(series)
+        return series
 
 
 class Series(object):
-    def __init__(self, timestamp):
-        self.t2_timestamp = _format_t2_timestamp(timestamp)
+    def __init__(self, timestamp, quantizer=None):
+        self.t2_timestamp = timestamp
         self.values = []
-
-    def add_value(self, raw_value):
-        for value in self.values:
-            if value.value == raw_value:
-                value.count += 1
+        self.quantizer = quantizer
+        self._values_by_value = {}
+        # Once buckets have been merged, everything at or below this bucket's value is counted in it
+        self._floor = None
+
+    def add_value(self, raw_value, count=1):
+        if self.quantizer is not None:
+            raw_value = self.quantizer.quantize(raw_value)
+            if self._floor is not None and raw_value <= self._floor.value:
+                self._floor.count += count
                 return
 
-        self.values.append(Value(1, raw_value))
+        value = self._values_by_value.get(raw_value)
+        if value is not None:
+            value.count += count
+            return
+
+        value = Value(count, raw_value)
+        self.values.append(value)
+        # NaN never equals anything, so every NaN sample gets an entry of its own
+        if raw_value == raw_value:
+            self._values_by_value[raw_value] = value
+
+        if self.quantizer is not None and len(self.values) > self.quantizer.max_buckets:
+            self._merge_lowest_buckets()
+
+    def _merge_lowest_buckets(self):
+        candidates = [v for v in self.values if v.value == v.value]
+        if len(candidates) < 2:
+            return
+        lowest, floor = heapq.nsmallest(2, candidates, key=lambda v: v.value)
+        floor.count += lowest.count
+        self.values.remove(lowest)
+        del self._values_by_value[lowest.value]
+        self._floor = floor
 
 
 class Value(object):
@@ -93,5 +155,15 @@ class Value(object):
         self.value = value
 
 
-def _format_t2_timestamp(timestamp):
-    return int((timestamp - epoch).total_seconds() * 1000 + .5)  # timestamps are in ms, monotonic() returns ns
+def _model_type(m):
+    if isinstance(m, aggregated_metric.AggregatedMetric):
+        return m.metric_class
+    return type(m)
+
+
+def _add_values(series, m):
+    if isinstance(m, aggregated_metric.AggregatedMetric):
+        for value, count in m.value_counts():
+            series.add_value(value, count)
+    else:
+        series.add_value(m.value, getattr(m, 'sample_weight', 1))
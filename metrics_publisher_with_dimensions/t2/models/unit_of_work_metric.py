@@ -2,13 +2,22 @@ from .metric import Metric
 
 
 class UnitsOfWorkMetric(Metric):
-    def __init__(self, name, value, timestamp=None, units_of_work=1, override_tags=None):
-        super(UnitsOfWorkMetric, self).__init__(
-            name,
-            value,
-            timestamp=timestamp,
-            override_tags=override_tags)
+    __slots__ = ('units_of_work', 'sample_weight')
+
+    def __init__(self, name, value, timestamp=None, units_of_work=1, override_tags=None, sample_weight=1,
+                 dimensions=None):
+        """
+        A metric that also counts the units of work it covers, such as a timer or a delta counter. See Metric
+        for the other parameters.
+
+        :param units_of_work: The units of work this metric covers
+        :param sample_weight: How many calls this metric stands for: N if it was recorded by an instrument
+            sampling 1 in N calls (see t2.instrumentation.sampler.Sampler). It is reported as the metric's count.
+        """
+        super(UnitsOfWorkMetric, self).__init__(name, value, timestamp=timestamp, override_tags=override_tags,
+                                                dimensions=dimensions)
         self.units_of_work = units_of_work
+        self.sample_weight = sample_weight
 
     def to_dict(self):
         return {
@@ -0,0 +1,330 @@
+"""
+Upload metric log tap files to T2.
+
+T2MetricLogEmitter writes a Metrics_v1.0-<md5>.log file (rotated hourly to
+Metrics_v1.0-<md5>.log.<date>_<hour>) and a metric-log-tap-<md5>.metadata file per metadata.
+LogTapReplayer reads them back and uploads their lines as Overlay payloads. It remembers in a
+checkpoint file how far each file has been uploaded, so it can be run again and again (say, on a
+host that is only online now and then) without uploading a line twice.
+
+Run with: python -m metrics_publisher_with_dimensions.t2.replay <log directory> --endpoint <url>
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .emitters.payload_encoder import PayloadEncoder, COMPRESSION_DEFLATE, COMPRESSION_GZIP
+from .emitters.t2_emitter import T2Emitter
+from .emitters.t2_metric_log_emitter import METADATA_FILENAME_PREFIX, METRIC_LOG_FILE_PREFIX
+from .formatters import T2OverlayFormatter
+from .models import MetricMetadata, OverlayPayload
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILENAME = "replay-checkpoint.json"
+DEFAULT_MAX_LINES_PER_BATCH = 5000
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_WAIT_MULTIPLIER = 0.5  # seconds
+MAX_RETRY_WAIT = 10.0  # seconds
+# Only used to name requests
+REPLAY_PROJECT = "log-tap-replay"
+
+
+class LogTapReplayer(object):
+    def __init__(self, logdir, endpoint, region=None, checkpoint_file=None, authentication_provider=None,
+                 mtls_client_cert_file=None, mtls_client_key_file=None, ca_cert_file=None, payload_encoder=None,
+                 max_lines_per_batch=DEFAULT_MAX_LINES_PER_BATCH, max_metrics_per_request=None,
+                 max_request_bytes=None, max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        A LogTapReplayer uploads the log tap files in a directory to T2. Files are memory-mapped and read a
+        batch of lines at a time. Each batch is merged into an Overlay payload with the metadata from the
+        file's metadata file, and up to max_concurrent_requests batches are uploaded at once.
+
+        A file's checkpoint only moves past a batch once it and every batch before it were uploaded, so
+        nothing is lost if a run stops halfway. Checkpoints follow files by inode, so a file that was
+        rotated since the last run isn't uploaded again under its new name. A trailing line without a
+        newline is still being written, and is left for the next run.
+
+        :param logdir: The directory the log tap files are in
+        :param endpoint: The T2 endpoint to upload to
+        :param region: The region of the metrics. Log tap metadata files don't record it.
+        :param checkpoint_file: Where to keep the checkpoints. Defaults to replay-checkpoint.json in logdir.
+        :param authentication_provider: Authentication for the requests, as for T2Emitter
+        :param mtls_client_cert_file: The client certificate for mTLS, as for T2Emitter
+        :param mtls_client_key_file: The client key for mTLS, as for T2Emitter
+        :param ca_cert_file: The CA bundle to verify T2 with, as for T2Emitter
+        :param payload_encoder: The PayloadEncoder for request bodies, to compress them for example
+        :param max_lines_per_batch: The number of log lines merged into each payload
+        :param max_metrics_per_request: Split payloads with more series than this, or None
+        :param max_request_bytes: Split payloads bigger than this, or None
+        :param max_concurrent_requests: The maximum number of uploads in flight
+        :param max_attempts: The number of times a request is tried before the run gives up
+        """
+        self.logdir = logdir
+        self.region = region
+        self.checkpoint_file = checkpoint_file or os.path.join(logdir, CHECKPOINT_FILENAME)
+        self.max_lines_per_batch = max_lines_per_batch
+        self.max_metrics_per_request = max_metrics_per_request
+        self.max_request_bytes = max_request_bytes
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_attempts = max_attempts
+        self.formatter = T2OverlayFormatter()
+        self.emitter = T2Emitter(
+            MetricMetadata(REPLAY_PROJECT, region=region),
+            endpoint=endpoint,
+            synchronous=True,
+            formatter=self.formatter,
+            mtls_client_cert_file=mtls_client_cert_file,
+            mtls_client_key_file=mtls_client_key_file,
+            authentication_provider=authentication_provider,
+            ca_cert_file=ca_cert_file,
+            payload_encoder=payload_encoder
+        )
+        self._checkpoints = {}
+        self._metadata_by_hash = {}
+        self._lock = threading.Lock()
+
+        self.files_replayed = 0
+        self.lines_replayed = 0
+        self.lines_skipped = 0
+        self.requests_sent = 0
+        self.bytes_sent = 0
+
+    def log_tap_files(self):
+        """
+        :return: A list of (path, md5 hash) for every log tap file in logdir, each metadata's rotated
+            files first, oldest first
+        """
+        prefix = METRIC_LOG_FILE_PREFIX + "-"
+        entries = []
+        for name in os.listdir(self.logdir):
+            if not name.startswith(prefix):
+                continue
+            md5_hash, log, suffix = name[len(prefix):].partition(".log")
+            if not log or (suffix and not suffix.startswith(".")):
+                continue
+            entries.append((md5_hash, suffix == "", suffix, name))
+        return [(os.path.join(self.logdir, name), md5_hash) for md5_hash, _, _, name in sorted(entries)]
+
+    def replay(self):
+        """
+        Upload everything that wasn't uploaded by a previous run. The run stops at the first file whose
+        upload fails; the rest is left for the next run.
+        :return: True if everything was uploaded
+        """
+        self._checkpoints = self._load_checkpoints()
+        files = self.log_tap_files()
+        # Forget the files that are gone, so their inodes can't be mistaken for new files'
+        live = set(_file_key(path) for path, _ in files)
+        self._checkpoints = dict((key, c) for key, c in self._checkpoints.items() if key in live)
+
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrent_requests)
+        try:
+            for path, md5_hash in files:
+                metadata = self._metadata(md5_hash)
+                if metadata is None:
+                    logger.warning("No metadata file for %s, skipping it", path)
+                    continue
+                if not self._replay_file(path, md5_hash, metadata, executor):
+                    return False
+        finally:
+            executor.shutdown()
+            self._save_checkpoints()
+        return True
+
+    def stats(self):
+        """
+        :return: A dict of counters describing what was uploaded so far
+        """
+        return {
+            "filesReplayed": self.files_replayed,
+            "linesReplayed": self.lines_replayed,
+            "linesSkipped": self.lines_skipped,
+            "requestsSent": self.requests_sent,
+            "bytesSent": self.bytes_sent,
+        }
+
+    def _metadata(self, md5_hash):
+        if md5_hash not in self._metadata_by_hash:
+            path = os.path.join(self.logdir, "{}-{}.metadata".format(METADATA_FILENAME_PREFIX, md5_hash))
+            try:
+                with open(path) as metadata_fp:
+                    fields = json.load(metadata_fp)
+            except (IOError, OSError, ValueError):
+                logger.exception("Could not read %s", path)
+                fields = None
+            metadata = None if fields is None else MetricMetadata(region=self.region, **fields)
+            self._metadata_by_hash[md5_hash] = metadata
+        return self._metadata_by_hash[md5_hash]
+
+    def _replay_file(self, path, md5_hash, metadata, executor):
+        key = _file_key(path)
+        size = os.path.getsize(path)
+        checkpoint = self._checkpoints.get(key)
+        offset = 0
+        if checkpoint is not None and checkpoint["md5"] == md5_hash and checkpoint["offset"] <= size:
+            offset = checkpoint["offset"]
+        if offset >= size:
+            return True
+
+        logger.info("Uploading %s from byte %d", path, offset)
+        # Batches in flight, oldest first: (end offset, futures)
+        in_flight = deque()
+        uploaded = True
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for end, payload in self._batches(path, mapped, offset, metadata):
+                    bodies = []
+                    if payload.metrics:
+                        bodies = self.formatter.encode_payload_chunks(payload, self.max_metrics_per_request,
+                                                                      self.max_request_bytes)
+                    in_flight.append((end, [executor.submit(self._upload, body) for body in bodies]))
+                    if len(in_flight) > self.max_concurrent_requests:
+                        uploaded = self._complete(key, path, md5_hash, in_flight.popleft())
+                        if not uploaded:
+                            break
+                while uploaded and in_flight:
+                    uploaded = self._complete(key, path, md5_hash, in_flight.popleft())
+                if uploaded:
+                    self.files_replayed += 1
+            finally:
+                # Whatever is still in flight after a failure must not move the checkpoint, but it must not
+                # outlive the file either
+                for _, futures in in_flight:
+                    for future in futures:
+                        future.exception()
+                mapped.close()
+        return uploaded
+
+    def _batches(self, path, mapped, offset, metadata):
+        size = len(mapped)
+        position = offset
+        while position < size:
+            payload = OverlayPayload(metadata)
+            lines = 0
+            while lines < self.max_lines_per_batch:
+                newline = mapped.find(b"\n", position)
+                if newline < 0:
+                    break
+                self._add_line(path, payload, mapped[position:newline])
+                position = newline + 1
+                lines += 1
+            if lines == 0:
+                return
+            yield position, payload
+
+    def _add_line(self, path, payload, raw_line):
+        try:
+            line = json.loads(raw_line.decode("utf-8"))
+            for series in line["series"]:
+                payload.add_value_counts(line["name"], series["second"],
+                                         [(value["value"], value["count"]) for value in series["values"]])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Skipping malformed line in %s: %r", path, raw_line[:200])
+            self.lines_skipped += 1
+            return
+        self.lines_replayed += 1
+
+    def _complete(self, key, path, md5_hash, batch):
+        end, futures = batch
+        for future in futures:
+            error = future.exception()
+            if error is not None:
+                logger.error("Could not upload %s: %s", path, error)
+                return False
+        self._checkpoints[key] = {"path": path, "md5": md5_hash, "offset": end}
+        self._save_checkpoints()
+        return True
+
+    def _upload(self, body):
+        attempt = 1
+        while True:
+            try:
+                self.emitter.send(body)
+            except Exception as e:
+                if attempt >= self.max_attempts:
+                    raise
+                delay = min(RETRY_WAIT_MULTIPLIER * 2 ** (attempt - 1), MAX_RETRY_WAIT)
+                logger.warning("Upload attempt %d failed (%s), retrying in %.1fs", attempt, e, delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            with self._lock:
+                self.requests_sent += 1
+                self.bytes_sent += len(body)
+            return
+
+    def _load_checkpoints(self):
+        try:
+            with open(self.checkpoint_file) as checkpoint_fp:
+                return json.load(checkpoint_fp)["files"]
+        except (IOError, OSError):
+            return {}
+        except (ValueError, KeyError):
+            logger.warning("Ignoring unreadable checkpoint file %s", self.checkpoint_file)
+            return {}
+
+    def _save_checkpoints(self):
+        tmp = self.checkpoint_file + ".tmp"
+        with open(tmp, "w") as checkpoint_fp:
+            json.dump({"files": self._checkpoints}, checkpoint_fp, sort_keys=True)
+        os.rename(tmp, self.checkpoint_file)
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return "{}:{}".format(st.st_dev, st.st_ino)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upload metric log tap files to T2")
+    parser.add_argument("logdir", help="The directory the log tap files are in")
+    parser.add_argument("--endpoint", required=True, help="The T2 endpoint to upload to")
+    parser.add_argument("--region", help="The region of the metrics")
+    parser.add_argument("--checkpoint-file", help="Where to keep the checkpoints (default: in logdir)")
+    parser.add_argument("--mtls-client-cert-file")
+    parser.add_argument("--mtls-client-key-file")
+    parser.add_argument("--ca-cert-file")
+    parser.add_argument("--compression", choices=(COMPRESSION_GZIP, COMPRESSION_DEFLATE))
+    parser.add_argument("--max-lines-per-batch", type=int, default=DEFAULT_MAX_LINES_PER_BATCH)
+    parser.add_argument("--max-metrics-per-request", type=int)
+    parser.add_argument("--max-request-bytes", type=int)
+    parser.add_argument("--max-concurrent-requests", type=int, default=DEFAULT_MAX_CONCURRENT_REQUESTS)
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    parser.add_argument("--verbose", "-v", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    replayer = LogTapReplayer(
+        args.logdir,
+        args.endpoint,
+        region=args.region,
+        checkpoint_file=args.checkpoint_file,
+        mtls_client_cert_file=args.mtls_client_cert_file,
+        mtls_client_key_file=args.mtls_client_key_file,
+        ca_cert_file=args.ca_cert_file,
+        payload_encoder=PayloadEncoder(compression=args.compression),
+        max_lines_per_batch=args.max_lines_per_batch,
+        max_metrics_per_request=args.max_metrics_per_request,
+        max_request_bytes=args.max_request_bytes,
+        max_concurrent_requests=args.max_concurrent_requests,
+        max_attempts=args.max_attempts
+    )
+    uploaded = replayer.replay()
+    json.dump(replayer.stats(), sys.stdout, sort_keys=True)
+    sys.stdout.write("\n")
+    return 0 if uploaded else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
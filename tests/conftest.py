@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.instrumentation.scope_stack import ScopeStack
+
+
+class LocalT2Server(object):
+    def __init__(self):
+        """
+        A stand-in for the T2 endpoint on localhost: it answers every PUT with status (200 unless set
+        otherwise, to stage an outage for example) and keeps the bodies, and the headers of each request in
+        the same order. The server runs in a background thread until close() is called.
+        """
+        self.status = 200
+        self.bodies = []
+        self.headers = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server._lock:
+                    server.bodies.append(body)
+                    server.headers.append(dict(self.headers))
+                self.send_response(server.status)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.endpoint = "http://127.0.0.1:{}/".format(self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever, name="local-t2-server")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            del self.bodies[:]
+            del self.headers[:]
+
+    def series(self):
+        """
+        :return: A list of (name, value, count) for every value of every Overlay body received so far
+        """
+        with self._lock:
+            bodies = list(self.bodies)
+        return [(m["name"], v["value"], v["count"]) for body in bodies for m in json.loads(body)["metrics"]
+                for s in m["series"] for v in s["values"]]
+
+    def count(self, name=None):
+        """
+        :param name: Only count the values of metrics with this name
+        :return: The sum of the counts of every Overlay value received so far
+        """
+        return sum(count for n, _, count in self.series() if name is None or n == name)
+
+
+class RecordingClient(object):
+    """
+    Stands in for a metrics Client: it keeps a scope stack and an optional Sampler, and records whatever is
+    submitted
+    """
+    def __init__(self, sampler=None):
+        self._scope = ScopeStack()
+        self.sampler = sampler
+        self.submitted = []
+
+    def enter_scope(self, scope_name):
+        self._scope.enter(scope_name)
+
+    def leave_scope(self):
+        self._scope.leave()
+
+    def get_scoped_metric_name(self):
+        return self._scope.prefix
+
+    def submit(self, metric_or_metrics, dimensions=None):
+        if isinstance(metric_or_metrics, list):
+            self.submitted.extend(metric_or_metrics)
+        else:
+            self.submitted.append(metric_or_metrics)
+
+
+@pytest.fixture
+def recording_client():
+    return RecordingClient()
+
+
+@pytest.fixture
+def t2_server():
+    server = LocalT2Server()
+    try:
+        yield server
+    finally:
+        server.close()
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def wait_for():
+    """
+    A function that polls condition() until it is true or timeout seconds have passed, and returns its last result
+    """
+    return _wait_for
@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.aggregation import MetricAggregator
+from metrics_publisher_with_dimensions.t2.models import TimerMetric
+
+
+def client_config(server, **metrics_config):
+    config = {"project": "test", "region": "r", "availabilityDomain": "ad-1", "synchronous": True,
+              "aggregateMetrics": True, "aggregationFlushIntervalMillis": 200,
+              "t2Config": {"fleet": "fleet", "endpointOverride": server.endpoint}}
+    config.update(metrics_config)
+    return {"metricsConfig": config}
+
+
+def test_unhashable_tag_values_are_aggregated():
+    aggregator = MetricAggregator()
+    assert aggregator.add(TimerMetric("op.Time", 1.0, override_tags={"hosts": ["a", "b"]}))
+    assert aggregator.add(TimerMetric("op.Time", 2.0, override_tags={"hosts": ["a", "b"]}))
+    cells = aggregator.drain()
+    assert len(cells) == 1
+    assert cells[0].count == 2
+
+
+def test_client_drains_the_aggregator_once_submits_stop(t2_server, wait_for):
+    pytest.importorskip("telemetry_endpoint_provider")
+    pytest.importorskip("pic.environment")
+    from metrics_publisher_with_dimensions.t2.client import OverlayClient
+
+    client = OverlayClient(client_config(t2_server), authentication_provider=None)
+    try:
+        for i in range(3):
+            client.submit(TimerMetric("op.Time", float(i)))
+        assert wait_for(lambda: t2_server.bodies), "aggregated metrics were never sent"
+        assert t2_server.count() == t2_server.count("op.Time") == 3
+    finally:
+        client.close()
+
+
+def test_async_client_drains_the_aggregator_once_submits_stop(t2_server):
+    pytest.importorskip("telemetry_endpoint_provider")
+    pytest.importorskip("pic.environment")
+    from metrics_publisher_with_dimensions.t2.async_client import AsyncOverlayClient
+
+    async def main(server):
+        client = AsyncOverlayClient(client_config(server, maxBufferTimeMillis=50), authentication_provider=None)
+        for i in range(3):
+            client.submit(TimerMetric("op.Time", float(i)))
+        deadline = time.time() + 5
+        while not server.bodies and time.time() < deadline:
+            await asyncio.sleep(0.02)
+        sent = list(server.series())
+        await client.close()
+        return sent
+
+    sent = asyncio.run(main(t2_server))
+    assert sent, "aggregated metrics were never sent"
+    assert set(name for name, _, _ in sent) == {"op.Time"}
+    assert sum(count for _, _, count in sent) == 3
@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.emitters import retry_scheduler
+from metrics_publisher_with_dimensions.t2.emitters.async_t2_emitter import AsyncT2Emitter
+from metrics_publisher_with_dimensions.t2.formatters import T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.instrumentation.async_instruments import AsyncScope
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata, TimerMetric
+
+METADATA = MetricMetadata("test", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+
+
+def test_concurrent_calls_of_a_decorated_coroutine_keep_their_own_state(recording_client):
+    client = recording_client
+
+    @AsyncScope(client, "Op")
+    async def op(seconds):
+        await asyncio.sleep(seconds)
+
+    async def main():
+        await asyncio.gather(op(0.3), op(0.05))
+
+    asyncio.run(main())
+    times = sorted(m.value for m in client.submitted if m.name == "Op.Time")
+    assert len(times) == 2
+    assert 40 <= times[0] < 200
+    assert 290 <= times[1] < 340
+
+
+def test_async_emitter_uploads_to_a_stand_in_server(t2_server):
+    async def main(server):
+        emitter = AsyncT2Emitter(METADATA, endpoint=server.endpoint, formatter=T2OverlayFormatter(),
+                                 max_pending_metrics=10, max_wait_time=100, jitter=0)
+        for i in range(25):
+            emitter.emit(TimerMetric("op.Time", float(i % 5), timestamp=1000))
+        await emitter.close()
+
+    asyncio.run(main(t2_server))
+    series = t2_server.series()
+    assert sum(count for _, _, count in series) == 25
+    assert set(name for name, _, _ in series) == {"op.Time"}
+
+
+def test_async_client_uploads_to_a_stand_in_server(t2_server):
+    pytest.importorskip("telemetry_endpoint_provider")
+    pytest.importorskip("pic.environment")
+    from metrics_publisher_with_dimensions.t2.async_client import AsyncOverlayClient
+
+    async def main(server):
+        client = AsyncOverlayClient({"metricsConfig": {
+            "project": "test", "region": "r", "availabilityDomain": "ad-1",
+            "t2Config": {"fleet": "fleet", "endpointOverride": server.endpoint}}}, authentication_provider=None)
+
+        @client.time("handle")
+        async def handle():
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[handle() for _ in range(3)])
+        async with client.gauge("free") as g:
+            g.value = 7
+        await client.close()
+
+    asyncio.run(main(t2_server))
+    series = t2_server.series()
+    assert t2_server.count("handle") == 3
+    assert ("free", 7, 1) in series
+
+
+class FakeMonotonic(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_async_emitter_retries_payloads_that_got_a_server_error(t2_server, monkeypatch):
+    clock = FakeMonotonic()
+    monkeypatch.setattr(retry_scheduler, "monotonic", clock)
+
+    async def main(server):
+        emitter = AsyncT2Emitter(METADATA, endpoint=server.endpoint, formatter=T2OverlayFormatter(),
+                                 max_pending_metrics=1, max_wait_time=50, jitter=0)
+        server.status = 503
+        emitter.emit(TimerMetric("op", 1.0))
+        while len(emitter.retry_scheduler) == 0:
+            await asyncio.sleep(0.01)
+        server.status = 200
+        server.reset()
+        # The background task keeps flushing while the retry waits for its backoff
+        await asyncio.sleep(0.2)
+        assert server.bodies == []
+
+        clock.now += 2
+        while len(emitter.retry_scheduler) > 0:
+            await asyncio.sleep(0.01)
+        await emitter.close()
+
+    asyncio.run(main(t2_server))
+    assert t2_server.count("op") == 1
+
+
+def test_async_emitter_close_does_not_wait_for_retry_backoffs(t2_server):
+    async def main(server):
+        emitter = AsyncT2Emitter(METADATA, endpoint=server.endpoint, formatter=T2OverlayFormatter(),
+                                 max_metrics_per_request=1)
+        server.status = 503
+        for i in range(3):
+            emitter.emit(TimerMetric("op{}".format(i), 1.0))
+        started = time.time()
+        await emitter.close()
+        return time.time() - started
+
+    # The flush on close uploads the three payloads together, then makes one last attempt at the first
+    # retry only, as it fails too
+    assert asyncio.run(main(t2_server)) < 1.0
+    assert len(t2_server.bodies) == 4
+
+
+def test_async_emitter_reports_metrics_discarded_by_a_full_buffer(t2_server):
+    emitter = AsyncT2Emitter(METADATA, endpoint=t2_server.endpoint, formatter=T2OverlayFormatter(), queue_size=2)
+    # Outside the event loop nothing is flushed until close
+    for i in range(5):
+        emitter.emit(TimerMetric("op", 1.0))
+    asyncio.run(emitter.close())
+    assert t2_server.count("op") == 2
+    assert ("test-failed-attempts", 3, 1) in t2_server.series()
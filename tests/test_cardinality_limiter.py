@@ -0,0 +1,102 @@
+import logging
+
+from metrics_publisher_with_dimensions.t2.aggregation import CardinalityLimiter
+from metrics_publisher_with_dimensions.t2.aggregation import cardinality_limiter
+from metrics_publisher_with_dimensions.t2.formatters import T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import GaugeMetric, MetricMetadata
+
+METADATA = MetricMetadata("test", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def gauge(host, disk="sda", **tags):
+    tags["hostname"] = host
+    return GaugeMetric("free", 1.0, override_tags=tags, dimensions={"disk": disk})
+
+
+def make_limiter(monkeypatch, max_combinations=2):
+    clock = FakeClock()
+    monkeypatch.setattr(cardinality_limiter, "time", clock)
+    return CardinalityLimiter(max_combinations=max_combinations, window_seconds=60), clock
+
+
+def test_combinations_over_the_limit_are_folded(monkeypatch):
+    limiter, _ = make_limiter(monkeypatch)
+    admitted = [gauge("a"), gauge("b"), gauge("a")]
+    limiter.limit(admitted)
+    assert [(m.override_tags, m.dimensions) for m in admitted] == [
+        ({"hostname": "a"}, {"disk": "sda"}), ({"hostname": "b"}, {"disk": "sda"}),
+        ({"hostname": "a"}, {"disk": "sda"})]
+
+    rejected = gauge("c", disk="sdc")
+    limiter.limit(rejected)
+    assert rejected.override_tags == {"hostname": "__other__"}
+    assert rejected.dimensions == {"disk": "__other__"}
+
+
+def test_routing_tags_are_never_folded(monkeypatch):
+    limiter, _ = make_limiter(monkeypatch, max_combinations=0)
+    metric = gauge("c", project="other-project", fleet="other-fleet", availabilityDomain="ad-2", region="r2")
+    limiter.limit(metric)
+    assert metric.override_tags == {"hostname": "__other__", "project": "other-project", "fleet": "other-fleet",
+                                    "availabilityDomain": "ad-2", "region": "r2"}
+    payload = T2OverlayFormatter().format(metric, default_metadata=METADATA)[0]
+    assert (payload["project"], payload["fleet"], payload["hostname"]) == ("other-project", "other-fleet",
+                                                                           "__other__")
+
+
+def test_metrics_without_tags_or_dimensions_are_not_limited(monkeypatch):
+    limiter, _ = make_limiter(monkeypatch, max_combinations=0)
+    metric = GaugeMetric("free", 1.0)
+    limiter.limit(metric)
+    assert metric.override_tags is None and metric.dimensions is None
+    assert limiter.stats()["combinations"] == 0
+    assert limiter.stats()["rejectedCombinations"] == 0
+
+
+def test_a_new_window_forgets_the_combinations_seen(monkeypatch):
+    limiter, clock = make_limiter(monkeypatch)
+    limiter.limit([gauge("a"), gauge("b")])
+    late = gauge("c")
+    limiter.limit(late)
+    assert late.override_tags == {"hostname": "__other__"}
+
+    clock.now += 60
+    fresh = gauge("c")
+    limiter.limit(fresh)
+    assert fresh.override_tags == {"hostname": "c"}
+    assert limiter.stats()["combinations"] == 1
+
+
+def test_one_warning_per_window(monkeypatch, caplog):
+    limiter, clock = make_limiter(monkeypatch, max_combinations=1)
+    with caplog.at_level(logging.WARNING, logger=cardinality_limiter.__name__):
+        limiter.limit([gauge(str(i)) for i in range(5)])
+        assert len(caplog.records) == 1
+        assert "hostname" in caplog.records[0].getMessage()
+
+        clock.now += 60
+        limiter.limit([gauge(str(i)) for i in range(5, 10)])
+        assert len(caplog.records) == 2
+
+
+def test_stats_count_the_folded_metrics(monkeypatch):
+    limiter, clock = make_limiter(monkeypatch)
+    limiter.limit([gauge("a"), gauge("b"), gauge("c"), gauge("d", disk="sdd")])
+    assert limiter.stats() == {
+        "maxCombinations": 2,
+        "combinations": 2,
+        "rejectedCombinations": 2,
+        "lastRejected": {"overrideTags": {"hostname": "d"}, "dimensions": {"disk": "sdd"}},
+    }
+    clock.now += 60
+    limiter.limit(gauge("e"))
+    assert limiter.stats()["combinations"] == 1
+    assert limiter.stats()["rejectedCombinations"] == 2
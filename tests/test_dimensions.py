@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.emitters import T2Emitter
+from metrics_publisher_with_dimensions.t2.formatters import T2Formatter, T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import GaugeMetric, MetricMetadata, TimerMetric
+
+METADATA = MetricMetadata("test", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+TIMESTAMP = 1700000000000
+FORMATTERS = [T2Formatter, T2OverlayFormatter, lambda: T2OverlayFormatter(histogram_relative_accuracy=0.01)]
+
+
+def make_metrics():
+    return [
+        TimerMetric("op.Time", 1.0, timestamp=TIMESTAMP),
+        GaugeMetric("free", 10.0, timestamp=TIMESTAMP, dimensions={"disk": "sda"}),
+        GaugeMetric("free", 20.0, timestamp=TIMESTAMP, dimensions={"disk": "sdb"}),
+        GaugeMetric("used", 5.0, timestamp=TIMESTAMP, dimensions={"disk": "sda"}),
+        GaugeMetric("free", 30.0, timestamp=TIMESTAMP, dimensions={u"dév": [1, 2], "n": None},
+                    override_tags={"hostname": "other-host"}),
+    ]
+
+
+def configs(payload):
+    """
+    :return: The config of every entry of the payload, as sorted JSON
+    """
+    return [json.dumps(e.get("config"), sort_keys=True)
+            for v in payload.values() if isinstance(v, list) for e in v]
+
+
+@pytest.mark.parametrize("make_formatter", FORMATTERS)
+def test_dimensions_are_sent_as_the_config_of_every_entry(make_formatter):
+    payloads = make_formatter().format(make_metrics(), default_metadata=METADATA)
+    by_config = {}
+    for payload in payloads:
+        payload_configs = configs(payload)
+        assert len(set(payload_configs)) == 1
+        by_config.setdefault(payload_configs[0], []).append(payload)
+    assert sorted(by_config) == sorted(
+        ['null', '{"disk": "sda"}', '{"disk": "sdb"}', '{"d\\u00e9v": [1, 2], "n": null}'])
+    sda = by_config['{"disk": "sda"}']
+    assert len(sda) == 1
+    assert len(configs(sda[0])) == 2
+
+
+def test_dimensioned_gauges_are_batched_by_the_background_emitter(t2_server):
+    emitter = T2Emitter(METADATA, endpoint=t2_server.endpoint, flusher_mode="thread", formatter=T2OverlayFormatter(),
+                        max_pending_metrics=1000, max_wait_time=60000, jitter=0)
+    for i in range(40):
+        emitter.emit(GaugeMetric("disk{}.Free".format(i % 5), float(i), timestamp=TIMESTAMP,
+                                 dimensions={"device": "sd{}".format(i % 2)}))
+    emitter.close()
+    assert len(t2_server.bodies) == 2
+    assert sorted(configs(json.loads(body))[0] for body in t2_server.bodies) == [
+        '{"device": "sd0"}', '{"device": "sd1"}']
+    assert t2_server.count() == 40
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.aggregation import MetricAggregator
+from metrics_publisher_with_dimensions.t2.formatters import T2Formatter, T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import (CumulativeCounterMetric, DeltaCounterMetric, GaugeMetric,
+                                                         Metric, MetricMetadata, TimerMetric)
+
+METADATA = MetricMetadata("test", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+TIMESTAMP = 1700000000000
+FORMATTERS = [T2Formatter, T2OverlayFormatter, lambda: T2OverlayFormatter(histogram_relative_accuracy=0.01)]
+
+
+def make_metrics():
+    metrics = []
+    for i in range(60):
+        timestamp = TIMESTAMP + (i % 3) * 1000
+        tags = {"hostname": "other-host"} if i % 7 == 0 else None
+        metrics.append(TimerMetric("op{}.Time".format(i % 4), i * 1.5, timestamp=timestamp, override_tags=tags))
+        metrics.append(DeltaCounterMetric("op{}.Count".format(i % 4), i % 3, timestamp=timestamp))
+    metrics.extend([
+        GaugeMetric("gauge", 0.1, timestamp=TIMESTAMP),
+        CumulativeCounterMetric("cumulative", 2 ** 70, timestamp=TIMESTAMP),
+        Metric("raw", -2 ** 63, timestamp=TIMESTAMP),
+        GaugeMetric("nan", float("nan"), timestamp=TIMESTAMP),
+        GaugeMetric("inf", float("inf"), timestamp=TIMESTAMP),
+        GaugeMetric("-inf", float("-inf"), timestamp=TIMESTAMP),
+        GaugeMetric("big float", 1e300, timestamp=TIMESTAMP),
+        GaugeMetric("bool", True, timestamp=TIMESTAMP),
+        GaugeMetric(u"café \"quoted\"", 1, timestamp=TIMESTAMP),
+        TimerMetric("sampled.Time", 3.0, timestamp=TIMESTAMP, units_of_work=10, sample_weight=10),
+        GaugeMetric("free", 10.0, timestamp=TIMESTAMP, dimensions={"disk": "sda"}),
+        GaugeMetric("free", 20.0, timestamp=TIMESTAMP, dimensions={"disk": "sdb"}),
+        GaugeMetric("used", 5.0, timestamp=TIMESTAMP, dimensions={"disk": "sda"}),
+        GaugeMetric("free", 30.0, timestamp=TIMESTAMP, dimensions={u"dév": [1, 2], "n": None},
+                    override_tags={"hostname": "other-host"}),
+    ])
+    aggregator = MetricAggregator()
+    for i in range(20):
+        aggregator.add(TimerMetric("aggregated.Time", float(i % 5), timestamp=TIMESTAMP))
+    metrics.extend(aggregator.drain())
+    return metrics
+
+
+def dumps(payload):
+    return json.dumps(payload, separators=(',', ':')).encode('ascii')
+
+
+@pytest.mark.parametrize("make_formatter", FORMATTERS)
+def test_encode_matches_json_dumps_of_format(make_formatter):
+    formatter = make_formatter()
+    expected = [dumps(p) for p in formatter.format(make_metrics(), default_metadata=METADATA)]
+    assert formatter.encode(make_metrics(), default_metadata=METADATA) == expected
+
+
+@pytest.mark.parametrize("make_formatter", FORMATTERS)
+def test_encode_matches_json_dumps_of_format_for_a_single_metric(make_formatter):
+    formatter = make_formatter()
+    for metric in make_metrics():
+        assert formatter.encode(metric, default_metadata=METADATA) == [
+            dumps(p) for p in formatter.format(metric, default_metadata=METADATA)]
+
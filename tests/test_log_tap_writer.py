@@ -0,0 +1,134 @@
+import json
+import logging
+import logging.handlers
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.emitters import log_tap_writer
+from metrics_publisher_with_dimensions.t2.emitters.log_tap_writer import LogTapWriter
+from metrics_publisher_with_dimensions.t2.emitters.t2_metric_log_emitter import T2MetricLogEmitter
+from metrics_publisher_with_dimensions.t2.models import TimerMetric
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+START = 1700000000
+
+
+class FakeTime(object):
+    """
+    Stands in for the time module, with a clock the test moves
+    """
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def lines_of(path):
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def log_tap_path(emitter):
+    return os.path.join(emitter.logdir, emitter._filename_for_metric_log(emitter.default_metadata))
+
+
+def test_rotated_files_are_named_like_timed_rotating_file_handler(tmpdir, monkeypatch):
+    clock = FakeTime(START)
+    monkeypatch.setattr(log_tap_writer, "time", clock)
+    monkeypatch.setattr(logging.handlers, "time", clock)
+    writer = LogTapWriter(max_latency=60)
+    emitter = T2MetricLogEmitter("r", "ad-1", "test", "fleet", "host", str(tmpdir), writer=writer)
+    path = log_tap_path(emitter)
+    old_path = str(tmpdir.join("old").join(os.path.basename(path)))
+    os.mkdir(os.path.dirname(old_path))
+    for p in (path, old_path):
+        open(p, "w").close()
+        os.utime(p, (START, START))
+    handler = logging.handlers.TimedRotatingFileHandler(old_path, when="h")
+
+    for now, name in ((START, "before"), (START + 3600, "after")):
+        clock.now = now
+        emitter.emit(TimerMetric(name, 1.0))
+        emitter.flush()
+        handler.emit(logging.makeLogRecord({"msg": name}))
+    handler.close()
+    emitter.close()
+
+    rotated = sorted(name for name in os.listdir(str(tmpdir)) if name.startswith(os.path.basename(path) + "."))
+    old_rotated = sorted(name for name in os.listdir(os.path.dirname(old_path))
+                         if name.startswith(os.path.basename(old_path) + "."))
+    assert rotated == old_rotated
+    assert rotated == [os.path.basename(path) + time.strftime(".%Y-%m-%d_%H", time.localtime(START))]
+    assert [json.loads(line)["name"] for line in lines_of(str(tmpdir.join(rotated[0])))] == ["before"]
+    assert [json.loads(line)["name"] for line in lines_of(path)] == ["after"]
+    assert lines_of(os.path.join(os.path.dirname(old_path), old_rotated[0])) == ["before"]
+    assert lines_of(old_path) == ["after"]
+    assert writer.stats()["rotations"] == 1
+
+
+def test_lines_over_max_pending_lines_are_dropped(tmpdir):
+    writer = LogTapWriter(max_latency=60, max_pending_lines=3)
+    log_tap_file = writer.open(str(tmpdir.join("tap.log")))
+    for i in range(5):
+        log_tap_file.write("line{}".format(i))
+    assert writer.lines_dropped == 2
+    writer.close()
+    assert lines_of(log_tap_file.path) == ["line0", "line1", "line2"]
+    assert writer.stats()["linesWritten"] == 3
+    assert writer.stats()["linesDropped"] == 2
+
+
+@pytest.mark.parametrize("flush_on_close", [True, False])
+def test_close_writes_or_drops_the_waiting_lines(tmpdir, flush_on_close):
+    writer = LogTapWriter(max_latency=60, flush_on_close=flush_on_close)
+    log_tap_file = writer.open(str(tmpdir.join("tap.log")))
+    log_tap_file.write("a")
+    log_tap_file.write("b")
+    writer.close()
+    if flush_on_close:
+        assert lines_of(log_tap_file.path) == ["a", "b"]
+        assert writer.lines_dropped == 0
+    else:
+        assert lines_of(log_tap_file.path) == []
+        assert writer.lines_dropped == 2
+
+
+def test_waiting_lines_are_written_when_the_interpreter_exits(tmpdir):
+    path = str(tmpdir.join("tap.log"))
+    script = """
+import sys
+from metrics_publisher_with_dimensions.t2.emitters.log_tap_writer import LogTapWriter
+log_tap_file = LogTapWriter(max_latency=60).open(sys.argv[1])
+for i in range(3):
+    log_tap_file.write("line{}".format(i))
+"""
+    child = subprocess.run([sys.executable, "-c", script, path], cwd=ROOT, stderr=subprocess.PIPE,
+                           universal_newlines=True, timeout=60)
+    assert child.returncode == 0, child.stderr
+    assert lines_of(path) == ["line0", "line1", "line2"]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_a_forked_child_writes_only_its_own_lines(tmpdir):
+    writer = LogTapWriter(max_latency=60)
+    log_tap_file = writer.open(str(tmpdir.join("tap.log")))
+    log_tap_file.write("parent before fork")
+    pid = os.fork()
+    if pid == 0:
+        try:
+            log_tap_file.write("child")
+            writer.close()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    log_tap_file.write("parent after fork")
+    writer.close()
+    assert sorted(lines_of(log_tap_file.path)) == ["child", "parent after fork", "parent before fork"]
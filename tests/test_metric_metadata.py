@@ -0,0 +1,69 @@
+import pickle
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata
+
+
+def make_metadata(**overrides):
+    fields = dict(project="p", fleet="f", hostname="h", availabilityDomain="ad", region="r")
+    fields.update(overrides)
+    return MetricMetadata(**fields)
+
+
+def test_copy_with_interns_equal_overrides():
+    metadata = make_metadata()
+    copy = metadata.copy_with({"hostname": "other"})
+    assert copy is metadata.copy_with({"hostname": "other"})
+    assert copy is metadata.copy_with(dict([("hostname", "other")]))
+    assert copy.hostname == "other" and copy.project == "p"
+    assert metadata.copy_with(None) is metadata.copy_with({})
+    assert metadata.copy_with(None, include_region=True) is not metadata.copy_with(None)
+    assert metadata.copy_with(None).region is None
+    assert metadata.copy_with(None, include_region=True).region == "r"
+
+
+def test_interned_copies_are_bounded(monkeypatch):
+    monkeypatch.setattr(MetricMetadata, "MAX_INTERNED_COPIES", 3)
+    metadata = make_metadata()
+    copies = [metadata.copy_with({"hostname": "host{}".format(i)}) for i in range(10)]
+    assert len(metadata._copies) <= 3
+    assert [c.hostname for c in copies] == ["host{}".format(i) for i in range(10)]
+    # An evicted copy is rebuilt equal to the first one
+    assert metadata.copy_with({"hostname": "host0"}) == copies[0]
+
+
+def test_unhashable_override_values_are_refused():
+    with pytest.raises(TypeError):
+        make_metadata().copy_with({"fleet": ["a"]})
+
+
+def test_metadata_is_immutable():
+    metadata = make_metadata()
+    with pytest.raises(AttributeError):
+        metadata.project = "other"
+    with pytest.raises(AttributeError):
+        del metadata.fleet
+    assert metadata.project == "p"
+
+
+def test_equality_and_hash_cover_every_field_including_region():
+    assert make_metadata() == make_metadata()
+    assert hash(make_metadata()) == hash(make_metadata())
+    assert make_metadata(region="other") != make_metadata()
+    assert make_metadata(hostname="other") != make_metadata()
+    assert make_metadata() != make_metadata().to_dict()
+    assert len({make_metadata(), make_metadata(), make_metadata(region="other")}) == 2
+
+
+def test_cached_strings_match_the_fields():
+    metadata = make_metadata()
+    assert metadata.json_string == '{"availabilityDomain": "ad", "fleet": "f", "hostname": "h", "project": "p"}'
+    assert metadata.json_string is metadata.json_string
+    assert metadata.md5_hash == make_metadata(region="other").md5_hash
+    assert metadata.json_prefix() + "}" == '{"availabilityDomain":"ad","project":"p","fleet":"f","hostname":"h"}'
+
+
+def test_metadata_survives_pickling():
+    metadata = make_metadata()
+    assert pickle.loads(pickle.dumps(metadata)) == metadata
@@ -0,0 +1,56 @@
+import json
+import zlib
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.emitters import T2Emitter
+from metrics_publisher_with_dimensions.t2.emitters.payload_encoder import PayloadEncoder
+from metrics_publisher_with_dimensions.t2.formatters import T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata, TimerMetric
+
+METADATA = MetricMetadata("test", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+THRESHOLD = 2048
+
+
+def decompress(body, content_encoding):
+    if content_encoding == "gzip":
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if content_encoding == "deflate":
+        return zlib.decompress(body)
+    return body
+
+
+def put(server, compression, metric_names):
+    """
+    Emit one metric per name synchronously through a compressing encoder, and return the uncompressed JSON of
+    the payload
+    """
+    formatter = T2OverlayFormatter()
+    metrics = [TimerMetric(name, 1.0, timestamp=1700000000000) for name in metric_names]
+    expected = json.dumps(formatter.format(metrics, default_metadata=METADATA)[0], separators=(',', ':'))
+    emitter = T2Emitter(METADATA, endpoint=server.endpoint, synchronous=True, formatter=formatter,
+                        payload_encoder=PayloadEncoder(compression=compression, compression_threshold=THRESHOLD))
+    emitter.emit(metrics)
+    emitter.close()
+    return expected.encode('utf-8')
+
+
+@pytest.mark.parametrize("compression", ["gzip", "deflate"])
+def test_bodies_above_the_threshold_are_compressed(t2_server, compression):
+    expected = put(t2_server, compression, ["op{}.Time".format(i) for i in range(100)])
+    bodies, headers = t2_server.bodies, t2_server.headers
+    assert len(expected) >= THRESHOLD
+    assert len(bodies) == 1
+    assert headers[0].get("Content-Encoding") == compression
+    assert len(bodies[0]) < len(expected)
+    assert decompress(bodies[0], headers[0]["Content-Encoding"]) == expected
+
+
+@pytest.mark.parametrize("compression", ["gzip", "deflate"])
+def test_bodies_below_the_threshold_are_sent_as_is(t2_server, compression):
+    expected = put(t2_server, compression, ["op.Time"])
+    bodies, headers = t2_server.bodies, t2_server.headers
+    assert len(expected) < THRESHOLD
+    assert len(bodies) == 1
+    assert "Content-Encoding" not in headers[0]
+    assert bodies[0] == expected
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.emitters import T2Emitter
+from metrics_publisher_with_dimensions.t2.formatters import T2Formatter, T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import DeltaCounterMetric, GaugeMetric, MetricMetadata, TimerMetric
+
+METADATA = MetricMetadata("test", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+TIMESTAMP = 1700000000000
+FORMATTERS = [T2Formatter, T2OverlayFormatter, lambda: T2OverlayFormatter(histogram_relative_accuracy=0.01)]
+
+
+def make_metrics():
+    metrics = []
+    for i in range(60):
+        timestamp = TIMESTAMP + (i % 3) * 1000
+        tags = {"hostname": "other-host"} if i % 7 == 0 else None
+        metrics.append(TimerMetric("op{}.Time".format(i % 4), i * 1.5, timestamp=timestamp, override_tags=tags))
+        metrics.append(DeltaCounterMetric("op{}.Count".format(i % 4), i % 3, timestamp=timestamp))
+    metrics.extend([
+        GaugeMetric("free", 10.0, timestamp=TIMESTAMP, dimensions={"disk": "sda"}),
+        GaugeMetric("free", 20.0, timestamp=TIMESTAMP, dimensions={"disk": "sdb"}),
+        GaugeMetric(u"café \"quoted\"", 1, timestamp=TIMESTAMP),
+    ])
+    return metrics
+
+
+def entries(payloads):
+    """
+    The series of every entry of the payloads, by metadata, entry list, name and config, in order
+    """
+    merged = {}
+    for payload in payloads:
+        metadata = tuple(sorted((k, v) for k, v in payload.items() if not isinstance(v, list)))
+        for key, value in payload.items():
+            if not isinstance(value, list):
+                continue
+            for entry in value:
+                merged.setdefault((metadata, key, entry["name"], json.dumps(entry.get("config"), sort_keys=True)),
+                                  []).extend(entry["series"])
+    return merged
+
+
+def series_count(payload):
+    return sum(len(e["series"]) for v in payload.values() if isinstance(v, list) for e in v)
+
+
+@pytest.mark.parametrize("make_formatter", FORMATTERS)
+@pytest.mark.parametrize("max_metrics,max_bytes", [(1, None), (3, None), (None, 300), (None, 2000), (4, 1000)])
+def test_chunked_encode_splits_the_same_series(make_formatter, max_metrics, max_bytes):
+    formatter = make_formatter()
+    expected = formatter.format(make_metrics(), default_metadata=METADATA)
+    chunks = formatter.encode(make_metrics(), default_metadata=METADATA, max_metrics=max_metrics,
+                              max_bytes=max_bytes)
+    assert len(chunks) > len(expected)
+    decoded = [json.loads(chunk) for chunk in chunks]
+    assert entries(decoded) == entries(json.loads(json.dumps(p)) for p in expected)
+    for chunk, payload in zip(chunks, decoded):
+        series = series_count(payload)
+        if max_metrics is not None:
+            assert 1 <= series <= max_metrics
+        if max_bytes is not None and series > 1:
+            assert len(chunk) <= max_bytes
+
+
+def test_emitter_sends_each_chunk_as_its_own_request(t2_server):
+    emitter = T2Emitter(METADATA, endpoint=t2_server.endpoint, synchronous=True, formatter=T2OverlayFormatter(),
+                        max_metrics_per_request=5)
+    emitter.emit([TimerMetric("op{}.Time".format(i), 1.0, timestamp=TIMESTAMP) for i in range(23)])
+    emitter.close()
+    assert [series_count(json.loads(body)) for body in t2_server.bodies] == [5, 5, 5, 5, 3]
+    assert t2_server.count() == 23
@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.emitters.pipeline_stats import (PipelineStats, HTTP_SECONDS,
+                                                                          METRICS_DROPPED, METRICS_EMITTED,
+                                                                          QUEUE_DEPTH_HIGH_WATER)
+
+fork_only = pytest.mark.skipif(not hasattr(os, "fork"), reason="The flusher process is only forked where fork exists")
+
+
+def _in_flusher_process(stats, target):
+    def run():
+        stats.use_own_slice()
+        target()
+
+    process = multiprocessing.get_context("fork").Process(target=run)
+    process.start()
+    return process
+
+
+def test_counters_histograms_and_high_water_marks():
+    stats = PipelineStats()
+    stats.increment(METRICS_EMITTED)
+    stats.increment(METRICS_EMITTED, 4)
+    stats.record_high_water(QUEUE_DEPTH_HIGH_WATER, 7)
+    stats.record_high_water(QUEUE_DEPTH_HIGH_WATER, 3)
+    stats.observe(HTTP_SECONDS, 0.5)
+    stats.observe(HTTP_SECONDS, 1.5)
+
+    snapshot = stats.snapshot()
+    assert snapshot[METRICS_EMITTED] == 5
+    assert snapshot[QUEUE_DEPTH_HIGH_WATER] == 7
+    assert snapshot[HTTP_SECONDS] == {"count": 2, "sum": 2.0, "min": 0.5, "max": 1.5, "mean": 1.0}
+    assert stats.get(METRICS_EMITTED) == 5
+
+    assert stats.unreported(METRICS_EMITTED) == 5
+    assert stats.unreported(METRICS_EMITTED) == 0
+    stats.increment(METRICS_EMITTED, 2)
+    assert stats.unreported(METRICS_EMITTED) == 2
+    assert stats.unreported(HTTP_SECONDS) == (2, 2.0)
+    assert stats.unreported(HTTP_SECONDS) == (0, 0.0)
+    # Reporting doesn't reset what a snapshot shows
+    assert stats.snapshot()[METRICS_EMITTED] == 7
+
+
+def test_only_shared_stats_have_a_flusher_slice():
+    with pytest.raises(ValueError):
+        PipelineStats().use_own_slice()
+
+
+@fork_only
+def test_a_flusher_process_updates_are_combined_with_the_parents():
+    stats = PipelineStats(shared=True)
+    stats.increment(METRICS_EMITTED, 10)
+    stats.record_high_water(QUEUE_DEPTH_HIGH_WATER, 5)
+    stats.observe(HTTP_SECONDS, 2.0)
+
+    def flusher():
+        stats.increment(METRICS_EMITTED, 3)
+        stats.record_high_water(QUEUE_DEPTH_HIGH_WATER, 9)
+        stats.observe(HTTP_SECONDS, 1.0)
+        stats.observe(HTTP_SECONDS, 4.0)
+
+    process = _in_flusher_process(stats, flusher)
+    process.join(10)
+    assert process.exitcode == 0
+
+    snapshot = stats.snapshot()
+    assert snapshot[METRICS_EMITTED] == 13
+    assert snapshot[QUEUE_DEPTH_HIGH_WATER] == 9
+    assert snapshot[HTTP_SECONDS] == {"count": 3, "sum": 7.0, "min": 1.0, "max": 4.0, "mean": 7.0 / 3}
+
+
+@fork_only
+def test_what_one_process_reported_is_not_reported_again_by_the_other():
+    stats = PipelineStats(shared=True)
+    stats.increment(METRICS_DROPPED, 4)
+    reported = multiprocessing.get_context("fork").Value('d', 0)
+
+    def flusher():
+        stats.increment(METRICS_DROPPED, 2)
+        reported.value = stats.unreported(METRICS_DROPPED)
+
+    process = _in_flusher_process(stats, flusher)
+    process.join(10)
+    assert process.exitcode == 0
+    assert reported.value == 6
+
+    assert stats.unreported(METRICS_DROPPED) == 0
+    stats.increment(METRICS_DROPPED)
+    assert stats.unreported(METRICS_DROPPED) == 1
+
+
+@fork_only
+def test_terminating_a_flusher_process_mid_update_does_not_block_the_parent():
+    stats = PipelineStats(shared=True)
+    started = multiprocessing.get_context("fork").Event()
+
+    def flusher():
+        started.set()
+        while True:
+            stats.increment(METRICS_EMITTED)
+            stats.observe(HTTP_SECONDS, 1.0)
+
+    process = _in_flusher_process(stats, flusher)
+    assert started.wait(10)
+    process.terminate()
+    process.join(10)
+
+    updated = threading.Event()
+
+    def parent():
+        stats.increment(METRICS_DROPPED)
+        stats.observe(HTTP_SECONDS, 1.0)
+        stats.unreported(METRICS_EMITTED)
+        stats.snapshot()
+        updated.set()
+
+    thread = threading.Thread(target=parent)
+    thread.daemon = True
+    thread.start()
+    assert updated.wait(5)
+    assert stats.get(METRICS_DROPPED) == 1
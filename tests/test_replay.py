@@ -0,0 +1,60 @@
+import os
+
+from metrics_publisher_with_dimensions.t2.emitters.t2_metric_log_emitter import T2MetricLogEmitter
+from metrics_publisher_with_dimensions.t2.models import TimerMetric
+from metrics_publisher_with_dimensions.t2.replay import LogTapReplayer
+
+
+def write_log_tap(logdir, values):
+    emitter = T2MetricLogEmitter("r", "ad-1", "test", "fleet", "host", str(logdir))
+    for value in values:
+        emitter.emit(TimerMetric("op.Time", float(value), timestamp=1700000000000))
+    emitter.close()
+
+
+def sent_values(server):
+    return sorted(value for _, value, count in server.series() for _ in range(count))
+
+
+def replayer(logdir, server):
+    return LogTapReplayer(str(logdir), server.endpoint, region="r", max_lines_per_batch=2, max_attempts=1)
+
+
+def test_replay_uploads_each_line_once(tmpdir, t2_server):
+    write_log_tap(tmpdir, range(5))
+    assert replayer(tmpdir, t2_server).replay()
+    assert sent_values(t2_server) == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+    t2_server.reset()
+    assert replayer(tmpdir, t2_server).replay()
+    assert t2_server.bodies == []
+
+
+def test_replay_after_rotation_uploads_only_new_lines(tmpdir, t2_server):
+    write_log_tap(tmpdir, range(5))
+    assert replayer(tmpdir, t2_server).replay()
+    log_file = [name for name in os.listdir(str(tmpdir)) if name.endswith(".log")][0]
+    os.rename(str(tmpdir.join(log_file)), str(tmpdir.join(log_file + ".2026-10-17_10")))
+    write_log_tap(tmpdir, [10, 11])
+
+    t2_server.reset()
+    assert replayer(tmpdir, t2_server).replay()
+    assert sent_values(t2_server) == [10.0, 11.0]
+
+
+def test_replay_keeps_the_checkpoint_through_an_outage(tmpdir, t2_server):
+    write_log_tap(tmpdir, range(3))
+    assert replayer(tmpdir, t2_server).replay()
+    write_log_tap(tmpdir, range(20, 25))
+    checkpoint = tmpdir.join("replay-checkpoint.json").read()
+
+    t2_server.status = 503
+    t2_server.reset()
+    assert not replayer(tmpdir, t2_server).replay()
+    assert t2_server.bodies, "the upload was never attempted"
+    assert tmpdir.join("replay-checkpoint.json").read() == checkpoint
+
+    t2_server.status = 200
+    t2_server.reset()
+    assert replayer(tmpdir, t2_server).replay()
+    assert sent_values(t2_server) == [20.0, 21.0, 22.0, 23.0, 24.0]
@@ -0,0 +1,220 @@
+import pytest
+import requests
+
+from metrics_publisher_with_dimensions.t2.emitters import T2Emitter
+from metrics_publisher_with_dimensions.t2.emitters import retry_scheduler
+from metrics_publisher_with_dimensions.t2.emitters.retry_scheduler import (CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN,
+                                                                           CIRCUIT_OPEN, CircuitBreaker,
+                                                                           RetryScheduler)
+from metrics_publisher_with_dimensions.t2.emitters.spill_store import SpillStore
+from metrics_publisher_with_dimensions.t2.formatters import T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata, TimerMetric
+
+METADATA = MetricMetadata("test", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+
+
+class FakeMonotonic(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeMonotonic()
+    monkeypatch.setattr(retry_scheduler, "monotonic", clock)
+    return clock
+
+
+def test_payloads_come_out_in_due_order(clock):
+    scheduler = RetryScheduler()
+    scheduler.schedule("late", 2, 3.0)
+    scheduler.schedule("early", 2, 1.0)
+    scheduler.schedule("middle", 3, 2.0)
+    scheduler.schedule("also middle", 2, 2.0)
+    assert scheduler.pop_due() == []
+    assert scheduler.time_to_next_due() == 1.0
+
+    clock.now += 2.0
+    assert scheduler.pop_due() == [("early", 2), ("middle", 3), ("also middle", 2)]
+    assert scheduler.time_to_next_due() == 1.0
+    clock.now += 5.0
+    assert scheduler.time_to_next_due() == 0.0
+    assert scheduler.pop_due() == [("late", 2)]
+    assert scheduler.time_to_next_due() is None
+
+
+def test_payloads_beyond_max_pending_are_refused(clock):
+    scheduler = RetryScheduler(max_pending=2)
+    assert scheduler.schedule("a", 2, 1.0)
+    assert scheduler.schedule("b", 2, 1.0)
+    assert not scheduler.schedule("c", 2, 1.0)
+    assert len(scheduler) == 2
+    clock.now += 1.0
+    scheduler.pop_due()
+    assert scheduler.schedule("c", 2, 1.0)
+    assert scheduler.stats() == {"retriesPending": 1, "retriesScheduled": 3, "retriesDispatched": 2,
+                                 "retriesRefused": 1}
+
+
+def test_pop_all_takes_everything_in_due_order(clock):
+    scheduler = RetryScheduler()
+    scheduler.schedule("b", 3, 20.0)
+    scheduler.schedule("a", 2, 10.0)
+    assert scheduler.pop_all() == [("a", 2), ("b", 3)]
+    assert len(scheduler) == 0
+    assert scheduler.pop_all() == []
+    assert scheduler.stats()["retriesDispatched"] == 2
+
+
+def test_an_empty_scheduler_passed_to_an_emitter_is_kept():
+    scheduler, breaker = RetryScheduler(), CircuitBreaker()
+    assert not scheduler
+    emitter = T2Emitter(METADATA, endpoint="http://127.0.0.1:1/", synchronous=True, retry_scheduler=scheduler,
+                        circuit_breaker=breaker)
+    assert emitter.retry_scheduler is scheduler
+    assert emitter.circuit_breaker is breaker
+
+
+def test_the_circuit_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_CLOSED
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+    assert breaker.time_to_probe() == 30
+    clock.now += 10
+    assert not breaker.allow()
+    assert breaker.time_to_probe() == 20
+
+
+def test_a_single_probe_closes_the_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert not breaker.allow()
+    assert breaker.time_to_probe() == retry_scheduler.PROBE_WAIT
+    breaker.record_success()
+    assert breaker.state == CIRCUIT_CLOSED
+    assert breaker.allow() and breaker.allow()
+    assert breaker.time_to_probe() == 0
+
+
+def test_a_failed_probe_reopens_the_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.stats() == {"circuitState": CIRCUIT_HALF_OPEN, "sendSuccesses": 0, "sendFailures": 2,
+                               "sendsRejected": 2, "circuitOpened": 2, "circuitProbes": 2}
+
+
+def make_emitter(server, **kwargs):
+    return T2Emitter(METADATA, endpoint=server.endpoint, synchronous=True, formatter=T2OverlayFormatter(),
+                     **kwargs)
+
+
+def test_failed_sends_are_retried_by_later_emits(t2_server, clock):
+    emitter = make_emitter(t2_server)
+    t2_server.status = 503
+    emitter.emit(TimerMetric("first", 1.0))
+    assert len(t2_server.bodies) == 1
+    assert len(emitter.retry_scheduler) == 1
+
+    t2_server.status = 200
+    emitter.emit(TimerMetric("second", 1.0))
+    # The retry isn't due yet
+    assert len(emitter.retry_scheduler) == 1
+    assert t2_server.count("first") == 1
+
+    clock.now += retry_scheduler.DEFAULT_RESET_TIMEOUT
+    emitter.emit(TimerMetric("third", 1.0))
+    assert len(emitter.retry_scheduler) == 0
+    assert [name for name, _, _ in t2_server.series()] == ["first", "second", "third", "first"]
+    emitter.close()
+
+
+def test_an_open_circuit_keeps_payloads_away_from_t2(t2_server, clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    emitter = make_emitter(t2_server, circuit_breaker=breaker)
+    t2_server.status = 503
+    for i in range(2):
+        emitter.emit(TimerMetric("failed{}".format(i), 1.0))
+    assert breaker.state == CIRCUIT_OPEN
+    t2_server.reset()
+    for i in range(3):
+        emitter.emit(TimerMetric("held{}".format(i), 1.0))
+    assert t2_server.bodies == []
+    assert len(emitter.retry_scheduler) == 5
+
+    # Once the circuit lets a probe through and it succeeds, everything due goes out
+    t2_server.status = 200
+    clock.now += 30
+    emitter.emit(TimerMetric("probe", 1.0))
+    assert breaker.state == CIRCUIT_CLOSED
+    assert sorted(name for name, _, _ in t2_server.series()) == [
+        "failed0", "failed1", "held0", "held1", "held2", "probe"]
+    assert len(emitter.retry_scheduler) == 0
+
+
+def test_close_makes_a_last_attempt_at_pending_retries(t2_server, clock):
+    emitter = make_emitter(t2_server)
+    t2_server.status = 503
+    emitter.emit(TimerMetric("op", 1.0))
+    t2_server.status = 200
+    t2_server.reset()
+    emitter.close()
+    assert t2_server.count("op") == 1
+    assert len(emitter.retry_scheduler) == 0
+
+
+def make_process_emitter(server, **kwargs):
+    # Every emit is handed to the queue watcher process right away
+    return T2Emitter(METADATA, endpoint=server.endpoint, formatter=T2OverlayFormatter(), max_pending_metrics=1,
+                     **kwargs)
+
+
+def test_close_makes_a_last_attempt_at_the_queue_watchers_retries(t2_server, clock, wait_for):
+    emitter = make_process_emitter(t2_server)
+    t2_server.status = 503
+    emitter.emit(TimerMetric("op", 1.0))
+    # The clock is frozen in the watcher too, so its retry never becomes due by itself
+    assert wait_for(lambda: len(t2_server.bodies) == 1)
+    t2_server.status = 200
+    t2_server.reset()
+    emitter.close()
+    assert t2_server.count("op") == 1
+    assert not emitter.watcher.is_alive()
+    assert emitter.watcher.exitcode == 0
+
+
+def test_close_spills_the_queue_watchers_retries_that_still_fail(t2_server, clock, wait_for, tmp_path):
+    emitter = make_process_emitter(t2_server, spill_store=SpillStore(str(tmp_path)))
+    t2_server.status = 503
+    emitter.emit(TimerMetric("op", 1.0))
+    assert wait_for(lambda: len(t2_server.bodies) == 1)
+    emitter.close()
+    assert emitter.watcher.exitcode == 0
+
+    t2_server.status = 200
+    t2_server.reset()
+    store = SpillStore(str(tmp_path))
+    assert store.replay(lambda body: requests.put(t2_server.endpoint, data=body).raise_for_status()) == 1
+    assert t2_server.count("op") == 1
@@ -0,0 +1,121 @@
+import pytest
+
+from metrics_publisher_with_dimensions.t2.formatters import T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.instrumentation import delta_counter as delta_counter_module
+from metrics_publisher_with_dimensions.t2.instrumentation import sampler as sampler_module
+from metrics_publisher_with_dimensions.t2.instrumentation import timer as timer_module
+from metrics_publisher_with_dimensions.t2.instrumentation.delta_counter import DeltaCounter
+from metrics_publisher_with_dimensions.t2.instrumentation.sampler import Sampler
+from metrics_publisher_with_dimensions.t2.instrumentation.timer import _Timer
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata, TimerMetric
+
+METADATA = MetricMetadata("test", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+TIMESTAMP = 1700000000000
+
+
+def test_sample_weight_is_reported_as_the_count():
+    payload = T2OverlayFormatter().format(
+        TimerMetric("op", 1.0, timestamp=TIMESTAMP, units_of_work=5, sample_weight=5), default_metadata=METADATA)[0]
+    assert payload["metrics"][0]["series"][0]["values"] == [{"count": 5, "value": 1.0}]
+
+
+def test_rates_are_looked_up_by_exact_name_then_longest_prefix_then_default():
+    sampler = Sampler(default_rate=0.5, rates={"Api.Get.Time": 1.0},
+                      prefix_rates={"Api": 0.1, "Api.Get": 0.01, "Db": 0})
+    assert sampler.interval("Api.Get.Time") == 1
+    assert sampler.interval("Api.Get.Count") == 100
+    assert sampler.interval("Api.Put.Time") == 10
+    assert sampler.interval("Db.Query.Time") == 0
+    assert sampler.interval("Other.Time") == 2
+
+
+@pytest.mark.parametrize("rate,interval", [(1.0, 1), (0.9, 1), (0.3, 3), (0.26, 4), (0.01, 100), (1e-9, 10 ** 9),
+                                           (0, 0)])
+def test_rates_are_rounded_to_one_in_n(rate, interval):
+    assert Sampler(default_rate=rate).interval("op") == interval
+
+
+@pytest.mark.parametrize("rate", [-0.1, 1.5])
+def test_rates_outside_zero_to_one_are_refused(rate):
+    with pytest.raises(ValueError):
+        Sampler(default_rate=rate)
+    with pytest.raises(ValueError):
+        Sampler(prefix_rates={"op": rate})
+
+
+def test_sample_records_one_in_n_calls_with_weight_n():
+    sampler = Sampler(default_rate=0.1)
+    sampler._random = lambda: 0.099
+    assert sampler.sample("op") == 10
+    sampler._random = lambda: 0.1
+    assert sampler.sample("op") == 0
+
+    sampler = Sampler(default_rate=0.1)
+    weights = [sampler.sample("op") for _ in range(20000)]
+    assert set(weights) == {0, 10}
+    assert 17000 < sum(weights) < 23000
+
+
+def test_rate_zero_records_nothing_and_rate_one_records_everything():
+    sampler = Sampler(default_rate=1.0, prefix_rates={"off": 0})
+    sampler._random = lambda: 0.0
+    assert all(sampler.sample("off.Time") == 0 for _ in range(100))
+    sampler._random = lambda: 0.999999
+    assert all(sampler.sample("on.Time") == 1 for _ in range(100))
+
+
+def test_intervals_are_resolved_once_per_name(monkeypatch):
+    sampler = Sampler(default_rate=0.5, prefix_rates={"Api": 0.1})
+    resolved = []
+    resolve = sampler._resolve
+    monkeypatch.setattr(sampler, "_resolve", lambda name: resolved.append(name) or resolve(name))
+    for _ in range(5):
+        sampler.sample("Api.Time")
+        sampler.interval("Other")
+    assert resolved == ["Api.Time", "Other"]
+
+    monkeypatch.setattr(sampler_module, "MAX_CACHED_NAMES", 3)
+    for i in range(10):
+        sampler.interval("name{}".format(i))
+    assert len(sampler._intervals) <= 3
+
+
+def test_unsampled_calls_do_not_read_the_clock_or_allocate_a_metric(recording_client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("an unsampled call must not get this far")
+
+    monkeypatch.setattr(timer_module, "TimerMetric", fail)
+    monkeypatch.setattr(delta_counter_module, "DeltaCounterMetric", fail)
+    monkeypatch.setattr(timer_module, "clock_ns", fail)
+    monkeypatch.setattr(_Timer, "start", fail)
+    recording_client.sampler = Sampler(default_rate=0)
+
+    @_Timer(recording_client, "Decorated")
+    def work():
+        return recording_client.get_scoped_metric_name()
+
+    assert work() == "Decorated"
+    with _Timer(recording_client, "Managed"):
+        assert recording_client.get_scoped_metric_name() == "Managed"
+    with DeltaCounter(recording_client, "Rows") as counter:
+        counter.increment()
+    assert recording_client.submitted == []
+    assert recording_client.get_scoped_metric_name() == ""
+
+
+def test_sampled_metrics_carry_their_weight(recording_client):
+    recording_client.sampler = Sampler(default_rate=0.25)
+    recording_client.sampler._random = lambda: 0.0
+
+    @_Timer(recording_client, "Decorated", units_of_work=2)
+    def work():
+        pass
+
+    work()
+    with _Timer(recording_client, "Managed"):
+        pass
+    with DeltaCounter(recording_client, "Rows") as counter:
+        counter.increment()
+        counter.increment()
+    weights = [(m.name, m.sample_weight, m.units_of_work) for m in recording_client.submitted]
+    assert weights == [("Decorated", 4, 8), ("Managed", 4, 4), ("Rows", 4, 8)]
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.instrumentation.async_instruments import AsyncScope, AsyncTimer
+from metrics_publisher_with_dimensions.t2.instrumentation.scope_stack import ScopeStack
+
+
+def names(client):
+    return sorted(m.name for m in client.submitted)
+
+
+def test_concurrent_tasks_keep_their_own_scopes(recording_client):
+    client = recording_client
+    seen = []
+
+    async def handle(scope_name):
+        async with AsyncScope(client, scope_name):
+            for _ in range(3):
+                await asyncio.sleep(0)
+                seen.append((scope_name, client.get_scoped_metric_name()))
+                async with AsyncTimer(client, "Step"):
+                    await asyncio.sleep(0)
+
+    async def main():
+        await asyncio.gather(handle("A"), handle("B"))
+
+    asyncio.run(main())
+    assert sorted(set(seen)) == [("A", "A"), ("B", "B")]
+    assert names(client) == sorted(["A.Fault", "A.Time", "B.Fault", "B.Time"] + ["A.Step", "B.Step"] * 3)
+
+
+def test_a_task_starts_with_the_scopes_of_its_creator(recording_client):
+    client = recording_client
+
+    async def child():
+        assert client.get_scoped_metric_name() == "Parent"
+        async with AsyncTimer(client, "Child"):
+            await asyncio.sleep(0)
+
+    async def main():
+        async with AsyncScope(client, "Parent"):
+            task = asyncio.ensure_future(child())
+            await asyncio.sleep(0)
+            # The child's scope stays in the child
+            assert client.get_scoped_metric_name() == "Parent"
+            await task
+        assert client.get_scoped_metric_name() == ""
+
+    asyncio.run(main())
+    assert "Parent.Child" in names(client)
+
+
+def test_threads_start_with_an_empty_stack():
+    stack = ScopeStack()
+    stack.enter("Main")
+    prefixes = []
+
+    def run():
+        prefixes.append(stack.prefix)
+        stack.enter("Worker")
+        prefixes.append(stack.prefix)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert prefixes == ["", "Worker"]
+    assert stack.prefix == "Main"
+
+
+def test_nested_scopes_make_a_dotted_prefix():
+    stack = ScopeStack()
+    stack.enter("Api")
+    stack.enter("GetWidget")
+    assert stack.prefix == "Api.GetWidget"
+    stack.leave()
+    assert stack.prefix == "Api"
+    stack.leave()
+    assert stack.prefix == ""
+    with pytest.raises(IndexError):
+        stack.leave()
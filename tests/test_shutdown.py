@@ -0,0 +1,59 @@
+"""
+A process-mode T2Emitter hands metrics to its watcher through a multiprocessing.Queue, whose feeder thread
+writes them to a pipe. If the pipe is full when close() terminates the watcher, the feeder blocks for good and
+the interpreter hangs at exit. These tests run the emitter in a child interpreter, so a hang shows up as a
+timeout instead of hanging the test run.
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PRELUDE = """
+import sys
+from metrics_publisher_with_dimensions.t2.emitters import t2_emitter
+from metrics_publisher_with_dimensions.t2.formatters import T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata, TimerMetric
+
+METADATA = MetricMetadata("test", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+"""
+
+# Nobody ever reads the queue, so the pipe fills up and the feeder blocks on it
+UNREAD_QUEUE = PRELUDE + """
+t2_emitter.CLOSE_DRAIN_TIMEOUT = 0.5
+emitter = t2_emitter.T2Emitter(METADATA, endpoint="http://127.0.0.1:1/", flusher=lambda: None, queue_size=20000)
+for i in range(5000):
+    emitter.emit(TimerMetric("op{}.Time".format(i % 50), float(i)))
+emitter.close()
+print("closed")
+"""
+
+# close() right after a burst, while the feeder still holds metrics the final flush can't see yet
+BURST = PRELUDE + """
+emitter = t2_emitter.T2Emitter(METADATA, endpoint=sys.argv[1], formatter=T2OverlayFormatter(),
+                               queue_size=20000, max_wait_time=100, jitter=0)
+for i in range(20000):
+    emitter.emit(TimerMetric("op{}.Time".format(i % 50), float(i % 7)))
+emitter.close()
+emitter.watcher.join()
+print("closed")
+"""
+
+
+def run_child(script, *args, **kwargs):
+    return subprocess.run([sys.executable, "-c", script] + list(args), cwd=ROOT, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True, timeout=kwargs.get("timeout", 60))
+
+
+def test_close_does_not_hang_the_interpreter_when_the_queue_is_never_read():
+    child = run_child(UNREAD_QUEUE, timeout=30)
+    assert child.returncode == 0, child.stderr
+    assert child.stdout.strip() == "closed"
+
+
+def test_close_flushes_everything_emitted_in_a_burst(t2_server):
+    child = run_child(BURST, t2_server.endpoint)
+    assert child.returncode == 0, child.stderr
+    assert child.stdout.strip() == "closed"
+    assert t2_server.count() == 20000
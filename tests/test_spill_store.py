@@ -0,0 +1,293 @@
+import multiprocessing
+import os
+import signal
+
+import pytest
+
+from metrics_publisher_with_dimensions.t2.emitters import T2Emitter
+from metrics_publisher_with_dimensions.t2.emitters import retry_scheduler, spill_store
+from metrics_publisher_with_dimensions.t2.emitters.spill_store import (FRAME_HEADER, OPEN_SEGMENT_SUFFIX,
+                                                                       REPLAY_LOCK_FILE_NAME, SEALED_SEGMENT_SUFFIX,
+                                                                       SEGMENT_PREFIX, SpillStore)
+from metrics_publisher_with_dimensions.t2.emitters.t2_emitter import (FLUSHER_MODE_THREAD, MAX_RETRY_WAIT,
+                                                                      MAX_SEND_ATTEMPTS)
+from metrics_publisher_with_dimensions.t2.formatters import T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata, TimerMetric
+
+METADATA = MetricMetadata("test", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+# Every body below is 24 bytes, so every frame is 40
+FRAME_SIZE = FRAME_HEADER.size + 24
+
+fork_only = pytest.mark.skipif(not hasattr(os, "fork"), reason="Needs fork")
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+        self.millis = 1700000000000
+
+    def monotonic(self):
+        return self.now
+
+    def epoch_millis(self):
+        return self.millis
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(spill_store, "monotonic", clock)
+    monkeypatch.setattr(spill_store, "epoch_millis", clock.epoch_millis)
+    monkeypatch.setattr(retry_scheduler, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / "spill")
+
+
+def body(i):
+    return "spilled body number {:04d}".format(i).encode("ascii")
+
+
+def segments(directory, suffix):
+    return sorted(n for n in os.listdir(directory) if n.startswith(SEGMENT_PREFIX) and n.endswith(suffix))
+
+
+def replay_all(directory, **kwargs):
+    replayed = []
+    SpillStore(directory, **kwargs).replay(replayed.append)
+    return replayed
+
+
+def test_fsyncs_are_batched_by_bytes_and_time(directory, clock, monkeypatch):
+    synced = []
+    monkeypatch.setattr(spill_store.os, "fsync", synced.append)
+    store = SpillStore(directory, fsync_bytes=3 * FRAME_SIZE, fsync_interval=10)
+    for i in range(5):
+        store.append(body(i))
+    assert len(synced) == 1  # Once the third frame made it to fsync_bytes
+
+    clock.now += 10
+    store.append(body(5))
+    assert len(synced) == 2
+
+    store.close()
+    assert len(synced) == 3  # Sealing always syncs
+
+
+def test_segments_are_sealed_by_size(directory, clock):
+    store = SpillStore(directory, segment_bytes=3 * FRAME_SIZE)
+    for i in range(4):
+        store.append(body(i))
+    assert len(segments(directory, SEALED_SEGMENT_SUFFIX)) == 1
+    assert len(segments(directory, OPEN_SEGMENT_SUFFIX)) == 1
+    # Only sealed segments are replayed
+    assert replay_all(directory) == [body(i) for i in range(3)]
+
+
+def test_segments_are_sealed_by_age(directory, clock):
+    store = SpillStore(directory, segment_age=30)
+    store.append(body(0))
+    clock.now += 29
+    store.seal_if_stale()
+    assert segments(directory, SEALED_SEGMENT_SUFFIX) == []
+
+    clock.now += 1
+    store.seal_if_stale()
+    assert len(segments(directory, SEALED_SEGMENT_SUFFIX)) == 1
+
+    # An append to a segment that got too old seals it and starts a new one
+    store.append(body(1))
+    clock.now += 30
+    store.append(body(2))
+    assert len(segments(directory, SEALED_SEGMENT_SUFFIX)) == 2
+    assert len(segments(directory, OPEN_SEGMENT_SUFFIX)) == 1
+
+
+def test_segments_are_replayed_oldest_first(directory, clock):
+    # With the clock frozen, only the sequence number tells the segments of this process apart
+    store = SpillStore(directory, segment_bytes=1)
+    for i in range(12):
+        store.append(body(i))
+    assert len(segments(directory, SEALED_SEGMENT_SUFFIX)) == 12
+    assert replay_all(directory) == [body(i) for i in range(12)]
+
+
+def test_replay_resumes_from_the_cursor(directory, clock):
+    store = SpillStore(directory)
+    for i in range(10):
+        store.append(body(i))
+    store.close()
+
+    sent = []
+
+    def send(b):
+        if b == body(4):
+            raise IOError("T2 is down")
+        sent.append(b)
+
+    assert store.replay(send) == 4
+    assert store.replay(sent.append, max_bodies=2) == 2
+    # A new store (after a restart, say) picks up where the last replay stopped
+    assert replay_all(directory) == [body(i) for i in range(6, 10)]
+    assert sent == [body(i) for i in range(6)]
+    assert os.listdir(directory) == [REPLAY_LOCK_FILE_NAME]
+
+
+@fork_only
+def test_a_replay_killed_mid_segment_is_resumed_without_duplicates(directory, tmp_path):
+    store = SpillStore(directory)
+    for i in range(10):
+        store.append(body(i))
+    store.close()
+    sent_file = str(tmp_path / "sent")
+
+    def replay_until_killed():
+        def send(b):
+            if b == body(5):
+                os.kill(os.getpid(), signal.SIGKILL)
+            with open(sent_file, "ab") as f:
+                f.write(b + b"\n")
+
+        SpillStore(directory).replay(send)
+
+    process = multiprocessing.get_context("fork").Process(target=replay_until_killed)
+    process.start()
+    process.join(10)
+    assert process.exitcode == -signal.SIGKILL
+
+    with open(sent_file, "rb") as f:
+        sent = f.read().splitlines()
+    # The killed replay held the replay lock, which went away with it
+    sent.extend(replay_all(directory))
+    assert sent == [body(i) for i in range(10)]
+
+
+@fork_only
+def test_a_killed_writers_segment_is_adopted_and_replayed_exactly_once(directory):
+    def spill_until_killed():
+        store = SpillStore(directory, fsync_bytes=1)
+        for i in range(10):
+            store.append(body(i))
+        os.kill(os.getpid(), signal.SIGKILL)
+
+    process = multiprocessing.get_context("fork").Process(target=spill_until_killed)
+    process.start()
+    process.join(10)
+    assert process.exitcode == -signal.SIGKILL
+    orphans = segments(directory, OPEN_SEGMENT_SUFFIX)
+    assert len(orphans) == 1
+    # The writer died while appending another frame
+    with open(os.path.join(directory, orphans[0]), "ab") as f:
+        f.write(FRAME_HEADER.pack(24, 0, 0) + b"torn")
+
+    first = SpillStore(directory)
+    replayed = []
+    assert first.replay(replayed.append) == 10
+    assert first.stats()["framesDiscarded"] == 1
+    assert replayed == [body(i) for i in range(10)]
+    assert replay_all(directory) == []
+
+
+def test_segments_of_live_processes_are_left_alone(directory, clock):
+    SpillStore(directory).append(body(0))
+    # The segment of a process that is still running, e.g. the parent of a flusher process
+    name = "{}{:013d}-{}-{:06d}{}".format(SEGMENT_PREFIX, clock.millis, os.getppid(), 1, OPEN_SEGMENT_SUFFIX)
+    os.rename(os.path.join(directory, segments(directory, OPEN_SEGMENT_SUFFIX)[0]), os.path.join(directory, name))
+
+    assert replay_all(directory) == []
+    assert segments(directory, OPEN_SEGMENT_SUFFIX) == [name]
+
+
+@pytest.mark.skipif(spill_store.fcntl is None, reason="Replays are only serialized with flock")
+def test_only_one_store_replays_at_a_time(directory, clock):
+    store = SpillStore(directory)
+    for i in range(3):
+        store.append(body(i))
+    store.close()
+
+    other = SpillStore(directory)
+    sent = []
+    nested = []
+
+    def send(b):
+        nested.append(other.replay(sent.append))
+        sent.append(b)
+
+    assert store.replay(send) == 3
+    assert nested == [0, 0, 0]
+    assert sent == [body(i) for i in range(3)]
+
+
+def test_the_oldest_segments_are_evicted_when_the_store_is_full(directory, clock):
+    store = SpillStore(directory, max_bytes=5 * FRAME_SIZE, segment_bytes=2 * FRAME_SIZE)
+    for i in range(8):
+        assert store.append(body(i))
+    store.close()
+    assert store.stats()["segmentsEvicted"] == 2
+    assert replay_all(directory) == [body(i) for i in range(4, 8)]
+
+
+def test_bodies_are_discarded_when_nothing_can_be_evicted(directory, clock):
+    store = SpillStore(directory, max_bytes=FRAME_SIZE)
+    assert store.append(body(0))
+    assert not store.append(body(1))
+    store.close()
+    assert store.stats()["framesDiscarded"] == 1
+    assert replay_all(directory) == [body(0)]
+
+
+def test_bodies_older_than_max_age_are_discarded(directory, clock):
+    store = SpillStore(directory, max_age=60)
+    store.append(body(0))
+    clock.millis += 30 * 1000
+    store.append(body(1))
+    store.close()
+    clock.millis += 30 * 1000 + 1
+    replaying = SpillStore(directory, max_age=60)
+    replayed = []
+    assert replaying.replay(replayed.append) == 1
+    assert replayed == [body(1)]
+    assert replaying.stats()["framesDiscarded"] == 1
+
+
+def test_the_emitter_spills_what_does_not_fit_in_its_buffer(t2_server, directory):
+    store = SpillStore(directory, segment_age=0)
+    emitter = T2Emitter(METADATA, endpoint=t2_server.endpoint, formatter=T2OverlayFormatter(),
+                        flusher_mode=FLUSHER_MODE_THREAD, queue_size=2, max_pending_metrics=100, max_wait_time=60000,
+                        spill_store=store)
+    for i in range(5):
+        emitter.emit(TimerMetric("op{}".format(i), 1.0))
+    assert t2_server.bodies == []
+    assert store.stats()["framesSpilled"] == 3
+    assert emitter.pipeline_stats.snapshot()["metricsSpilled"] == 3
+
+    # The flush on close sends what was buffered, then replays what was spilled
+    emitter.close()
+    assert sorted(name for name, _, _ in t2_server.series()) == ["op{}".format(i) for i in range(5)]
+    assert store.stats()["framesReplayed"] == 3
+
+
+def test_the_emitter_spills_payloads_that_ran_out_of_retries_and_replays_them(t2_server, directory, clock):
+    store = SpillStore(directory, segment_age=0)
+    emitter = T2Emitter(METADATA, endpoint=t2_server.endpoint, synchronous=True, formatter=T2OverlayFormatter(),
+                        spill_store=store,
+                        circuit_breaker=retry_scheduler.CircuitBreaker(failure_threshold=MAX_SEND_ATTEMPTS + 1))
+    t2_server.status = 503
+    emitter.emit(TimerMetric("op", 1.0))
+    for _ in range(MAX_SEND_ATTEMPTS - 1):
+        clock.now += MAX_RETRY_WAIT
+        emitter._send_due_retries()
+    assert t2_server.count("op") == MAX_SEND_ATTEMPTS
+    assert len(emitter.retry_scheduler) == 0
+    assert store.stats()["framesSpilled"] == 1
+
+    # Once T2 is back, the next emit replays it
+    t2_server.status = 200
+    t2_server.reset()
+    emitter.emit(TimerMetric("recovered", 1.0))
+    assert sorted(name for name, _, _ in t2_server.series()) == ["op", "recovered"]
+    assert store.stats()["framesReplayed"] == 1
+    emitter.close()
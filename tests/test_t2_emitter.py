@@ -0,0 +1,32 @@
+import json
+
+from metrics_publisher_with_dimensions.t2.emitters import T2Emitter
+from metrics_publisher_with_dimensions.t2.formatters import T2OverlayFormatter
+from metrics_publisher_with_dimensions.t2.models import MetricMetadata, TimerMetric
+
+METADATA = MetricMetadata("test", fleet="fleet", hostname="host", availabilityDomain="ad-1", region="r")
+
+
+def test_columnar_buffer_reaches_the_watcher_once_emits_stop(t2_server, wait_for):
+    emitter = T2Emitter(METADATA, endpoint=t2_server.endpoint, columnar_buffer=True, max_wait_time=200,
+                        jitter=0, formatter=T2OverlayFormatter())
+    try:
+        for i in range(3):
+            emitter.emit(TimerMetric("op.Time", float(i)))
+        assert wait_for(lambda: t2_server.bodies), "buffered metrics were never sent"
+        assert t2_server.count() == 3
+    finally:
+        emitter.close()
+        emitter.watcher.join()
+
+
+def test_synchronous_emits_send_self_telemetry_once_per_interval(t2_server):
+    emitter = T2Emitter(METADATA, endpoint=t2_server.endpoint, synchronous=True, self_telemetry=True,
+                        max_wait_time=60000, formatter=T2OverlayFormatter())
+    for i in range(5):
+        emitter.emit(TimerMetric("op.Time", float(i)))
+    emitter.close()
+    names = [[m["name"] for m in json.loads(body)["metrics"]] for body in t2_server.bodies]
+    assert len(names) == 5
+    assert any(name.startswith("test-client-") for name in names[0])
+    assert all(names_of_emit == ["op.Time"] for names_of_emit in names[1:])